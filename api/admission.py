@@ -0,0 +1,164 @@
+"""
+Admission control: bulkheads between classes of API routes.
+
+Every request is sorted into a route class (see classify) and must get a
+slot in that class's bulkhead before it runs. A bulkhead lets `limit`
+requests run at once and `queue_size` more wait, in arrival order, for at
+most ADMISSION_QUEUE_TIMEOUT seconds; anything beyond that is shed at once
+with 429 and Retry-After instead of piling up.
+
+Classes don't share slots, so a burst of detection requests from the AI page
+fills the inference bulkhead and gets 429s while feeds, photos and comments
+keep their own. Reads get by far the most room and priority: while any read
+is waiting for a slot, new inference and upload requests are shed rather
+than queued. The slot is held until the response, streamed or not, has
+been sent.
+
+Health, stats and metrics routes are exempt so they keep answering under load.
+"""
+
+import asyncio
+import re
+from collections import deque
+from typing import Dict, Optional
+
+from starlette.responses import JSONResponse
+
+from settings import ADMISSION_CONTROL, ADMISSION_LIMITS, ADMISSION_QUEUE_TIMEOUT, ADMISSION_RETRY_AFTER
+
+# (class, method or None for any, path pattern), first match wins; requests
+# matching none are "reads" if they are GET or HEAD and "writes" otherwise
+ROUTE_CLASSES = (
+    ("exempt", None, re.compile(r"^/(ready|metrics|api/detect-objects/stats|api/admission/stats)/?$")),
+    ("inference", "POST", re.compile(r"^/api/detect-objects/(batch/)?$")),
+    ("inference", None, re.compile(r"^/posts/\d+/frames/(score/)?$")),
+    ("uploads", "POST", re.compile(r"^/posts/create/$")),
+)
+# Classes shed while reads are queueing
+YIELD_TO_READS = {"inference", "uploads"}
+
+
+def classify(method: str, path: str) -> str:
+    """The route class of a request."""
+    for route_class, route_method, pattern in ROUTE_CLASSES:
+        if (route_method is None or route_method == method) and pattern.match(path):
+            return route_class
+    return "reads" if method in ("GET", "HEAD") else "writes"
+
+
+class Rejected(Exception):
+    """The bulkhead is full, or the request waited too long for a slot."""
+
+
+class Bulkhead:
+    """
+    At most `limit` holders at a time and `queue_size` waiters. Used from
+    the event loop only, so the counters need no lock.
+    """
+
+    def __init__(self, name: str, limit: int, queue_size: int):
+        self.name = name
+        self.limit = limit
+        self.queue_size = queue_size
+        self.active = 0
+        self._waiters = deque()
+        self.admitted = 0
+        self.rejected = 0
+        self.timed_out = 0
+
+    @property
+    def waiting(self) -> int:
+        return len(self._waiters)
+
+    async def acquire(self, timeout: Optional[float] = ADMISSION_QUEUE_TIMEOUT) -> None:
+        """Take a slot, waiting for one if the queue has room. Raises Rejected."""
+        if self.active < self.limit and not self._waiters:
+            self.active += 1
+            self.admitted += 1
+            return
+        if len(self._waiters) >= self.queue_size:
+            self.rejected += 1
+            raise Rejected(self.name)
+
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.append(future)
+        try:
+            await asyncio.wait_for(future, timeout)
+        except BaseException as e:
+            if future.done() and not future.cancelled():
+                # A slot was handed over just as we gave up on it
+                self.release()
+            else:
+                try:
+                    self._waiters.remove(future)
+                except ValueError:
+                    pass
+            if isinstance(e, asyncio.TimeoutError):
+                self.timed_out += 1
+                raise Rejected(self.name)
+            raise
+        self.admitted += 1
+
+    def release(self) -> None:
+        """Give the slot to the longest waiting request, or free it."""
+        while self._waiters:
+            future = self._waiters.popleft()
+            if not future.done():
+                future.set_result(None)
+                return
+        self.active -= 1
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "active": self.active,
+            "waiting": self.waiting,
+            "limit": self.limit,
+            "queue_size": self.queue_size,
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "timed_out": self.timed_out,
+        }
+
+
+bulkheads = {name: Bulkhead(name, limit, queue_size) for name, (limit, queue_size) in ADMISSION_LIMITS.items()}
+
+
+def stats() -> Dict[str, Dict[str, int]]:
+    return {name: bulkhead.stats() for name, bulkhead in bulkheads.items()}
+
+
+class AdmissionMiddleware:
+    """ASGI middleware that runs each HTTP request inside its class's bulkhead."""
+
+    def __init__(self, app, enabled: bool = ADMISSION_CONTROL):
+        self.app = app
+        self.enabled = enabled
+
+    async def __call__(self, scope, receive, send):
+        if not self.enabled or scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        route_class = classify(scope["method"], scope["path"])
+        bulkhead = bulkheads.get(route_class)
+        if bulkhead is None:
+            await self.app(scope, receive, send)
+            return
+
+        try:
+            reads = bulkheads.get("reads")
+            if route_class in YIELD_TO_READS and reads is not None and reads.waiting:
+                bulkhead.rejected += 1
+                raise Rejected(route_class)
+            await bulkhead.acquire()
+        except Rejected:
+            response = JSONResponse(
+                {"detail": "The server is busy. Please try again shortly."},
+                status_code=429,
+                headers={"Retry-After": str(ADMISSION_RETRY_AFTER)},
+            )
+            await response(scope, receive, send)
+            return
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            bulkhead.release()
@@ -1,50 +1,69 @@
-import uuid
-from fastapi import FastAPI, HTTPException, Query
+from fastapi import APIRouter, FastAPI, HTTPException, Query
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse, JSONResponse
-from pydantic import BaseModel
+from fastapi.responses import FileResponse, JSONResponse, Response, StreamingResponse
+from pydantic import BaseModel, Field
 from backend import (
-    session, User, add_user, 
-    login, get_post_or_404, Post, Comment,
+    init_db, session, User, add_user, 
+    login, get_post_or_404, Post, Comment, PostDetection, FrameHeatmap, FrameContribution,
     utcnow
 )
 from settings import *
+from storage import (
+    ensure_upload_dirs, receive_upload, store_blob, release_blob,
+    photo_store, PhotoStat, temp_path, discard
+)
+from normalize import (
+    get_pool as get_normalize_pool, shutdown_pool as shutdown_normalize_pool,
+    normalize_image, make_placeholder
+)
+from photo_cache import (
+    photo_stat_cache, etag_matches, parse_range,
+    iter_file_range, RangeNotSatisfiable
+)
+from orphan_gc import collect_orphans
 from datetime import timedelta, datetime
+import asyncio
+import base64
+import contextlib
 import jwt
+from sqlalchemy import select, update
+from sqlalchemy.exc import IntegrityError
 import os
 import os.path
+import mimetypes
+from functools import lru_cache
 from typing import Optional, List, Dict, Any
-import base64
-import io
-from ultralytics import YOLO
-import cv2
-import numpy as np
-from PIL import Image
+from detection import inference_pool, batch_scheduler, DetectionError, QueueFull, DETECTION_MODES, POST_MODE
+from detection_cache import detection_cache, cache_key, config_version
+from image_probe import ImageInfo, ImageRejected, check_image, check_file
+import json
+import zipfile
+from array import array
+import admission
+from admission import AdmissionMiddleware
+import logging
+from logs import setup_logging, shutdown_logging, dropped_records, RequestIdMiddleware
+import metrics
+from metrics import MetricsMiddleware, upload_bytes
+
+router = APIRouter()
 
-try:
-    os.mkdir("uploads")
-except:
-    pass
+logger = logging.getLogger(__name__)
 
-app = FastAPI()
+# Image formats object detection accepts
+SUPPORTED_IMAGE_TYPES = ('image/jpeg', 'image/jpg', 'image/png', 'image/webp')
 
 # Token blacklist set to store invalidated tokens
 token_blacklist = set()
 
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=HOSTS,
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
-
-from fastapi import File, UploadFile
+from fastapi import File, UploadFile, BackgroundTasks
 from fastapi import Depends
 from fastapi.security import OAuth2PasswordBearer
 from fastapi import Request
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="login")
+# For routes that take a token only for some requests
+optional_oauth2_scheme = OAuth2PasswordBearer(tokenUrl="login", auto_error=False)
 
 def get_current_user(token: str = Depends(oauth2_scheme)):
     # Check if token is blacklisted
@@ -63,7 +82,7 @@ class UserCreate(BaseModel):
     username: str
     password: str
 
-@app.post("/users/register/")
+@router.post("/users/register/")
 def create_user(user: UserCreate):
     if session.query(User).filter_by(username=user.username).first():
         raise HTTPException(status_code=409, detail="Username already registered")
@@ -80,7 +99,7 @@ class UserLogin(BaseModel):
 
 SECRET_KEY = "your_secret_key"  # Change this to a secure key
 
-@app.post("/users/login/")
+@router.post("/users/login/")
 def login_user(user: UserLogin):
     if login(user.username, user.password):
         # Generate a token
@@ -91,8 +110,8 @@ def login_user(user: UserLogin):
         return {"message": "Login successful", "token": token}
     raise HTTPException(status_code=401, detail="Invalid username or password")
 
-@app.post("/posts/create/")
-async def create_post(file: UploadFile = File(...), current_user: str = Depends(get_current_user)):
+@router.post("/posts/create/")
+async def create_post(background_tasks: BackgroundTasks, file: UploadFile = File(...), current_user: str = Depends(get_current_user)):
     if not file.content_type.startswith('image/'):
         raise HTTPException(status_code=400, detail="File type not supported")
     
@@ -101,16 +120,164 @@ async def create_post(file: UploadFile = File(...), current_user: str = Depends(
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
     
-    filename = uuid.uuid4().hex + "." + file.filename.split(".")[-1]
-    file_location = f"uploads/{filename}"
-    with open(file_location, "wb") as buffer:
-        buffer.write(await file.read())
-    p = Post(photo_uuid=filename, user_id=user.id)
+    if file.size is not None and file.size > IMAGE_MAX_BYTES:
+        raise HTTPException(status_code=413, detail=f"Image is larger than {IMAGE_MAX_BYTES // (1024 * 1024)} MB")
+
+    # Hash while streaming so identical uploads share one stored file
+    digest, tmp_path, size = await receive_upload(file)
+    upload_bytes.inc("posts", amount=size)
+    # Refuse pixel bombs and files that aren't images before anything decodes them
+    try:
+        await asyncio.to_thread(check_file, tmp_path)
+    except ImageRejected as e:
+        discard(tmp_path)
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+    filename, created = store_blob(session, digest, tmp_path, size, file.filename)
+    p = Post(photo_uuid=filename, user_id=user.id, original_size=size)
     session.add(p)
-    session.commit()
+    try:
+        session.commit()
+    except Exception:
+        session.rollback()
+        if created:
+            photo_store.delete(filename)
+        raise
+    # Background tasks run in order, so the placeholder is made from the normalized photo
+    if NORMALIZE_UPLOADS:
+        background_tasks.add_task(normalize_post, p.id)
+    background_tasks.add_task(generate_placeholder, p.id)
+    if DETECT_ON_UPLOAD:
+        background_tasks.add_task(detect_post, p.id)
     return {"message": "Post created successfully", "post_id": p.id}
 
-@app.get("/posts/")
+async def normalize_post(post_id: int):
+    """
+    Re-encode a post's photo in the normalization pool and point the post at
+    the result. The original file is not deleted here: it becomes an orphan
+    once unreferenced, so clients that already have its URL keep working
+    until the orphan collector's grace period is over.
+    """
+    post = session.query(Post).filter_by(id=post_id).first()
+    if post is None:
+        return
+
+    tmp_path = temp_path()
+    with photo_store.local_path(post.photo_uuid) as source:
+        if source is None:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+            result = await loop.run_in_executor(get_normalize_pool(), normalize_image, source, tmp_path)
+        except Exception:
+            logger.exception("Error normalizing photo of post %d", post_id)
+            discard(tmp_path)
+            return
+
+    # The post may have been deleted while we were busy
+    post = session.query(Post).filter_by(id=post_id).first()
+    if result is None or post is None:
+        discard(tmp_path)
+        return
+    if not result["keep"]:
+        discard(tmp_path)
+        post.normalized_size = result["original_size"]
+        session.commit()
+        return
+
+    old_photo = post.photo_uuid
+    new_photo, created = store_blob(
+        session, result["digest"], tmp_path, result["normalized_size"], f"photo.{result['extension']}"
+    )
+    post.photo_uuid = new_photo
+    post.normalized_size = result["normalized_size"]
+    release_blob(session, old_photo)
+    try:
+        session.commit()
+    except Exception:
+        session.rollback()
+        if created:
+            photo_store.delete(new_photo)
+        raise
+
+async def generate_placeholder(post_id: int):
+    """Render the preview shown in feeds while a post's photo loads."""
+    post = session.query(Post).filter_by(id=post_id).first()
+    if post is None:
+        return
+
+    with photo_store.local_path(post.photo_uuid) as source:
+        if source is None:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+            placeholder = await loop.run_in_executor(get_normalize_pool(), make_placeholder, source)
+        except Exception:
+            logger.exception("Error generating placeholder for post %d", post_id)
+            return
+
+    post = session.query(Post).filter_by(id=post_id).first()
+    if post is None:
+        return
+    post.placeholder = placeholder
+    session.commit()
+
+async def detect_post(post_id: int):
+    """
+    Run object detection on a post's photo and store the result, so viewers
+    read it from post_detections instead of each running the model.
+    """
+    post = session.query(Post).filter_by(id=post_id).first()
+    if post is None:
+        return
+    record = post.detection
+    if record is None:
+        record = PostDetection(post_id=post_id)
+        session.add(record)
+    record.status = "pending"
+    record.updated_at = utcnow()
+    session.commit()
+
+    photo = post.photo_uuid
+    with photo_store.local_path(photo) as source:
+        if source is None:
+            return
+        contents = await asyncio.to_thread(read_file, source)
+
+    result = error = None
+    try:
+        body = await detect_when_ready(contents, POST_MODE)
+        result = json.loads(body)
+    except QueueFull:
+        error = "Inference queue full"
+    except DetectionError as e:
+        error = e.detail
+    except Exception as e:
+        logger.warning("Error detecting objects in post %d: %s", post_id, e)
+        error = str(e)
+
+    # The post may have been deleted while we were busy
+    record = session.query(PostDetection).filter_by(post_id=post_id).first()
+    if record is None:
+        return
+    if result is None:
+        record.status = "failed"
+        record.error = error
+    else:
+        record.status = "done"
+        record.error = None
+        record.detected_objects = result["detected_objects"]
+        record.suggested_frame = result["suggested_frame"]
+        record.image_width = result["image_size"]["width"]
+        record.image_height = result["image_size"]["height"]
+        record.saliency = base64.b64decode(result["saliency"])
+        record.model_version = config_version()
+    session.commit()
+
+def read_file(path: str) -> bytes:
+    with open(path, "rb") as f:
+        return f.read()
+
+@router.get("/posts/")
 async def get_posts(sort_by: str = "recent", page: int = 0, limit: int = 18):
     """
     Get posts with sorting and pagination
@@ -151,7 +318,8 @@ async def get_posts(sort_by: str = "recent", page: int = 0, limit: int = 18):
             "photo_uuid": post.photo_uuid,
             "user_id": username,  # Use username instead of user_id
             "created_at": post.created_at.isoformat(),
-            "thumbs_up": thumbs_up
+            "thumbs_up": thumbs_up,
+            "placeholder": post.placeholder
         })
     
     # Get total count for pagination info
@@ -168,7 +336,7 @@ async def get_posts(sort_by: str = "recent", page: int = 0, limit: int = 18):
     }
 
 # Keep these endpoints for backward compatibility but mark as deprecated
-@app.get("/posts/recent/")
+@router.get("/posts/recent/")
 async def get_recent_posts():
     """
     DEPRECATED: Use /posts/?sort_by=recent instead
@@ -176,7 +344,7 @@ async def get_recent_posts():
     posts_response = await get_posts(sort_by="recent", page=0, limit=18)
     return {"posts": posts_response["posts"]}
 
-@app.get("/posts/all/{paging}")
+@router.get("/posts/all/{paging}")
 async def get_all_posts(paging: int):
     """
     DEPRECATED: Use /posts/?page={paging} instead
@@ -184,7 +352,7 @@ async def get_all_posts(paging: int):
     posts_response = await get_posts(sort_by="recent", page=paging, limit=18)
     return {"posts": posts_response["posts"]}
 
-@app.get("/posts/{post_id}/")
+@router.get("/posts/{post_id}/")
 async def get_post(post_id: int):
     post = session.query(Post).filter_by(id=post_id).first()
     if not post:
@@ -208,12 +376,13 @@ async def get_post(post_id: int):
         "photo_uuid": post.photo_uuid,
         "user_id": username,  # Use username instead of user_id
         "created_at": post.created_at.isoformat(),
-        "thumbs_up": thumbs_up
+        "thumbs_up": thumbs_up,
+        "placeholder": post.placeholder
     }
     
     return {"post": formatted_post}
 
-@app.get("/users/{user_id}/posts/")
+@router.get("/users/{user_id}/posts/")
 async def get_user_posts(user_id: int, current_user: str = Depends(get_current_user)):
     # Get the authenticated user's ID
     auth_user = session.query(User).filter_by(username=current_user).first()
@@ -242,12 +411,226 @@ async def get_user_posts(user_id: int, current_user: str = Depends(get_current_u
             "photo_uuid": post.photo_uuid,
             "user_id": auth_user.username,  # Use username instead of user_id
             "created_at": post.created_at.isoformat(),
-            "thumbs_up": thumbs_up
+            "thumbs_up": thumbs_up,
+            "placeholder": post.placeholder
         })
     
     return {"posts": formatted_posts}
 
-@app.post("/posts/{post_id}/thumbs-up/")
+@router.get("/posts/{post_id}/detections/")
+async def get_post_detections(post_id: int, background_tasks: BackgroundTasks):
+    """
+    Objects detected in a post's photo, in the photo's pixel coordinates.
+    Posts uploaded before detection-on-upload are analyzed on first request;
+    until a result is stored the response has status "pending" and code 202.
+    """
+    post = get_post_or_404(post_id)
+    record = post.detection
+    if record is None:
+        record = PostDetection(post_id=post_id, status="pending")
+        session.add(record)
+        session.commit()
+        background_tasks.add_task(detect_post, post_id)
+    elif record.status == "pending" and record.updated_at < utcnow() - timedelta(minutes=10):
+        # The job was lost, e.g. to a restart
+        background_tasks.add_task(detect_post, post_id)
+    if record.status == "pending":
+        return JSONResponse({"post_id": post_id, "status": "pending"}, status_code=202)
+    if record.status == "failed":
+        return {"post_id": post_id, "status": "failed", "error": record.error}
+    return {
+        "post_id": post_id,
+        "status": "done",
+        "detected_objects": record.detected_objects,
+        "suggested_frame": record.suggested_frame,
+        "image_size": {"width": record.image_width, "height": record.image_height},
+    }
+
+@router.get("/posts/{post_id}/frames/")
+async def get_post_frames(post_id: int, background_tasks: BackgroundTasks,
+                          ratios: str = Query(",".join(COMPOSITION_ASPECT_RATIOS)),
+                          k: int = Query(COMPOSITION_TOP_K, ge=1, le=10)):
+    """
+    The k best frames of a post's photo for each aspect ratio in `ratios`
+    ("W:H", comma separated), scored from its stored detections. Answers like
+    the detections endpoint while those aren't available.
+    """
+    ratio_list = [ratio.strip() for ratio in ratios.split(",") if ratio.strip()]
+    if not 1 <= len(ratio_list) <= 8:
+        raise HTTPException(status_code=400, detail="Give between 1 and 8 aspect ratios")
+    detections = await get_post_detections(post_id, background_tasks)
+    if not isinstance(detections, dict) or detections["status"] != "done":
+        return detections
+    try:
+        frames = await asyncio.to_thread(rank_frames, detections, ratio_list, k, stored_saliency(post_id))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"post_id": post_id, "suggested_frames": frames}
+
+def stored_saliency(post_id: int) -> Optional[bytes]:
+    """The saliency grid stored with a post's detections, if any."""
+    record = session.query(PostDetection).filter_by(post_id=post_id).first()
+    return record.saliency if record is not None else None
+
+def rank_frames(detections: Dict[str, Any], ratios: List[str], k: int,
+                saliency: Optional[bytes] = None) -> Dict[str, List[Dict]]:
+    # Imported here: API processes that never frame a photo don't need NumPy
+    from composition import stored_grid, suggest_frames
+    width, height = detections["image_size"]["width"], detections["image_size"]["height"]
+    return suggest_frames(detections["detected_objects"], width, height, ratios, k,
+                          saliency=stored_grid(saliency, width, height))
+
+class FrameRect(BaseModel):
+    # NaN and infinity would poison the heatmap sums for good
+    x: float = Field(allow_inf_nan=False)
+    y: float = Field(allow_inf_nan=False)
+    width: float = Field(allow_inf_nan=False)
+    height: float = Field(allow_inf_nan=False)
+
+class FrameScoreRequest(BaseModel):
+    frames: List[FrameRect]
+    contribute: bool = False
+
+@router.post("/posts/{post_id}/frames/score/")
+async def score_post_frames(post_id: int, request: FrameScoreRequest, background_tasks: BackgroundTasks,
+                            token: Optional[str] = Depends(optional_oauth2_scheme)):
+    """
+    Score many user frames (photo pixels) of a post's photo in one pass
+    against its stored detections. Each gets a 0-100 "score" relative to the
+    best frame of the closest aspect ratio, which is returned too, and its
+    overlap with it. With contribute, the frames are also added to the
+    post's community heatmap; that needs a logged-in user, once per post.
+    """
+    user = None
+    if request.contribute:
+        if token is None:
+            raise HTTPException(status_code=401, detail="Log in to contribute frames",
+                                headers={"WWW-Authenticate": "Bearer"})
+        user = session.query(User).filter_by(username=get_current_user(token)).first()
+        if user is None:
+            raise HTTPException(status_code=401, detail="Invalid authentication credentials")
+        if session.query(FrameContribution).filter_by(post_id=post_id, user_id=user.id).first() is not None:
+            raise HTTPException(status_code=409, detail="You already contributed frames to this post")
+    if not 1 <= len(request.frames) <= FRAME_SCORE_MAX_FRAMES:
+        raise HTTPException(status_code=400, detail=f"Send between 1 and {FRAME_SCORE_MAX_FRAMES} frames")
+    if any(f.width <= 0 or f.height <= 0 for f in request.frames):
+        raise HTTPException(status_code=400, detail="Frames must have a positive width and height")
+    detections = await get_post_detections(post_id, background_tasks)
+    if not isinstance(detections, dict) or detections["status"] != "done":
+        return detections
+    width, height = detections["image_size"]["width"], detections["image_size"]["height"]
+    if any(f.x < 0 or f.y < 0 or f.x + f.width > width or f.y + f.height > height for f in request.frames):
+        raise HTTPException(status_code=400, detail=f"Frames must lie within the {width}x{height} photo")
+
+    frames = [{"x": f.x, "y": f.y, "width": f.width, "height": f.height} for f in request.frames]
+    scores, best, contribution = await asyncio.to_thread(score_user_frames, detections, frames, request.contribute,
+                                                         stored_saliency(post_id))
+    if request.contribute:
+        if not add_to_heatmap(post_id, user.id, contribution):
+            raise HTTPException(status_code=409, detail="You already contributed frames to this post")
+    return {"post_id": post_id, "scores": scores, "best_frames": best}
+
+def score_user_frames(detections: Dict[str, Any], frames: List[Dict], contribute: bool,
+                      saliency: Optional[bytes] = None):
+    """
+    Scores and best frames for score_post_frames, against the same saliency
+    the suggested frames were chosen with, and, with contribute, what the
+    frames add to the heatmap: the grid shape, coverage counts, number of
+    frames and frame_sums.
+    """
+    from composition import score_frames, frame_coverage, frame_sums, grid_shape, stored_grid
+    width, height = detections["image_size"]["width"], detections["image_size"]["height"]
+    scores, best = score_frames(frames, detections["detected_objects"], width, height,
+                                saliency=stored_grid(saliency, width, height))
+    contribution = None
+    if contribute:
+        contribution = (grid_shape(width, height), frame_coverage(frames, width, height).tobytes(),
+                        len(frames), frame_sums(frames, width, height))
+    return scores, best, contribution
+
+def add_to_heatmap(post_id: int, user_id: int, contribution: tuple) -> bool:
+    """
+    Fold a user's submitted frames into a post's heatmap. Returns False,
+    changing nothing, if they already contributed to it.
+
+    Several API workers may add to one heatmap at once, so this is one
+    transaction that writes before it reads: the sums are incremented in SQL,
+    and the counts are read and merged only once that write holds the lock
+    (the row in PostgreSQL, the database in SQLite).
+    """
+    (columns, rows), delta_bytes, frames, (dx, dy, dwidth, dheight) = contribution
+    for attempt in range(2):
+        session.add(FrameContribution(post_id=post_id, user_id=user_id, frames=frames))
+        try:
+            session.flush()
+        except IntegrityError:
+            session.rollback()
+            return False
+
+        heatmap = update(FrameHeatmap).where(FrameHeatmap.post_id == post_id)
+        updated = session.execute(
+            heatmap.where(FrameHeatmap.columns == columns, FrameHeatmap.rows == rows).values(
+                frames=FrameHeatmap.frames + frames,
+                sum_x=FrameHeatmap.sum_x + dx, sum_y=FrameHeatmap.sum_y + dy,
+                sum_width=FrameHeatmap.sum_width + dwidth, sum_height=FrameHeatmap.sum_height + dheight,
+            ),
+            execution_options={"synchronize_session": False},
+        ).rowcount
+        if updated:
+            counts, delta = array("I"), array("I")
+            counts.frombytes(session.execute(
+                select(FrameHeatmap.counts).where(FrameHeatmap.post_id == post_id)).scalar_one())
+            delta.frombytes(delta_bytes)
+            merged = array("I", (min(a + b, 0xFFFFFFFF) for a, b in zip(counts, delta)))
+            session.execute(heatmap.values(counts=merged.tobytes()), execution_options={"synchronize_session": False})
+        else:
+            # No heatmap yet, or the photo was replaced by one of another shape; start over
+            session.query(FrameContribution).filter(FrameContribution.post_id == post_id,
+                                                    FrameContribution.user_id != user_id).delete()
+            values = dict(columns=columns, rows=rows, counts=delta_bytes, frames=frames,
+                          sum_x=dx, sum_y=dy, sum_width=dwidth, sum_height=dheight)
+            if not session.execute(heatmap.values(**values), execution_options={"synchronize_session": False}).rowcount:
+                session.add(FrameHeatmap(post_id=post_id, **values))
+        try:
+            session.commit()
+            return True
+        except IntegrityError:
+            # Another worker created the heatmap first; add to theirs
+            session.rollback()
+            if attempt:
+                raise
+
+@router.get("/posts/{post_id}/frames/community/")
+async def get_community_frames(post_id: int):
+    """
+    How the community frames a post's photo: the number of frames submitted,
+    the average frame and a heatmap of how many frames cover each cell of a
+    `columns` x `rows` grid over the photo, as a list of rows. A single read
+    of the aggregate kept by frames/score/.
+    """
+    post = get_post_or_404(post_id)
+    heatmap = post.frame_heatmap
+    if heatmap is None or not heatmap.frames or post.detection is None:
+        return {"post_id": post_id, "frames": 0, "average_frame": None, "heatmap": None}
+
+    counts = array("I")
+    counts.frombytes(heatmap.counts)
+    width, height = post.detection.image_width, post.detection.image_height
+    n = heatmap.frames
+    return {
+        "post_id": post_id,
+        "frames": n,
+        "average_frame": {
+            "x": round(heatmap.sum_x / n * width),
+            "y": round(heatmap.sum_y / n * height),
+            "width": round(heatmap.sum_width / n * width),
+            "height": round(heatmap.sum_height / n * height),
+        },
+        "grid": {"columns": heatmap.columns, "rows": heatmap.rows},
+        "heatmap": [counts[r * heatmap.columns:(r + 1) * heatmap.columns].tolist() for r in range(heatmap.rows)],
+    }
+
+@router.post("/posts/{post_id}/thumbs-up/")
 async def thumbs_up_post(post_id: int, current_user: str = Depends(get_current_user)):
     post = get_post_or_404(post_id)
     user = session.query(User).filter_by(username=current_user).first()
@@ -265,7 +648,7 @@ async def thumbs_up_post(post_id: int, current_user: str = Depends(get_current_u
     session.commit()
     return {"message": "Thumbs up added successfully"}
 
-@app.post("/posts/{post_id}/thumbs-down/")
+@router.post("/posts/{post_id}/thumbs-down/")
 async def thumbs_down_post(post_id: int, current_user: str = Depends(get_current_user)):
     post = get_post_or_404(post_id)
     user = session.query(User).filter_by(username=current_user).first()
@@ -283,7 +666,7 @@ async def thumbs_down_post(post_id: int, current_user: str = Depends(get_current
     session.commit()
     return {"message": "Thumbs up removed successfully"}
 
-@app.post("/posts/{post_id}/delete/")
+@router.post("/posts/{post_id}/delete/")
 async def delete_post(post_id: int, current_user: str = Depends(get_current_user)):
     post = get_post_or_404(post_id)
     user = session.query(User).filter_by(id=post.user_id).first()
@@ -293,12 +676,16 @@ async def delete_post(post_id: int, current_user: str = Depends(get_current_user
     # Delete associated comments first (as a backup measure)
     session.query(Comment).filter_by(post_id=post_id).delete()
     
-    # Then delete the post
+    # Then delete the post, dropping the photo if no other post shares it
+    unused_photo = release_blob(session, post.photo_uuid)
     session.delete(post)
     session.commit()
+    if unused_photo:
+        photo_store.delete(unused_photo)
+        photo_stat_cache.invalidate(unused_photo)
     return {"message": "Post deleted successfully"}
 
-@app.post("/posts/{post_id}/comment/add/")
+@router.post("/posts/{post_id}/comment/add/")
 async def comment_post(post_id: int, request: Request, current_user: str = Depends(get_current_user)):
     try:
         body = await request.json()
@@ -320,7 +707,7 @@ async def comment_post(post_id: int, request: Request, current_user: str = Depen
     session.commit()
     return {"message": "Comment added successfully", "comment_id": comment_obj.id}
 
-@app.get("/posts/{post_id}/comments/")
+@router.get("/posts/{post_id}/comments/")
 async def get_post_comments(post_id: int):
     comments = session.query(Comment).filter_by(post_id=post_id).order_by(Comment.created_at.desc()).all()
     
@@ -340,7 +727,7 @@ async def get_post_comments(post_id: int):
     
     return {"comments": formatted_comments}
 
-@app.post("/posts/{post_id}/comment/{comment_id}/delete/")
+@router.post("/posts/{post_id}/comment/{comment_id}/delete/")
 async def delete_comment(post_id: int, comment_id: int, current_user: str = Depends(get_current_user)):
     comment = session.query(Comment).filter_by(id=comment_id).first()
     if not comment:
@@ -352,26 +739,104 @@ async def delete_comment(post_id: int, comment_id: int, current_user: str = Depe
     session.commit()
     return {"message": "Comment deleted successfully"}
 
-@app.post("/users/logout/")
+@router.post("/users/logout/")
 async def logout_user(current_user: str = Depends(get_current_user), token: str = Depends(oauth2_scheme)):
     # Add the token to the blacklist
     token_blacklist.add(token)
     return {"message": "Successfully logged out"}
 
+UPLOADS_ROOT = os.path.abspath(UPLOAD_DIR)
+
+@lru_cache(maxsize=PHOTO_STAT_CACHE_SIZE)
 def inside(photoname):
-    abspath = os.path.abspath(os.path.join("./uploads/", photoname))
-    return os.path.commonprefix([abspath, os.path.abspath("./uploads/")]) == os.path.abspath("./uploads/")
+    abspath = os.path.abspath(os.path.join(UPLOADS_ROOT, photoname))
+    return os.path.dirname(abspath) == UPLOADS_ROOT
+
+@router.get("/photos/{photoname}")
+async def get_photo(photoname: str, request: Request):
+    """
+    Serve an uploaded photo.
 
-@app.get("/photos/{photoname}")
-async def get_photo(photoname: str):
+    Photo names are never reused, so responses are marked immutable. Also
+    answers conditional requests with 304 and single byte ranges with 206.
+    """
     if not inside(photoname):
         raise HTTPException(status_code=403, detail="Unauthorized")
-    if not os.path.exists(f"uploads/{photoname}"):
+    photo = photo_stat_cache.get(photoname, photo_store.lookup)
+    if photo is None:
         raise HTTPException(status_code=404, detail="Photo doesn't exist")
 
-    return FileResponse(f"uploads/{photoname}")
+    headers = {
+        "Cache-Control": f"public, max-age={PHOTO_CACHE_MAX_AGE}, immutable",
+        "ETag": photo.etag,
+        "Accept-Ranges": "bytes",
+    }
+    if etag_matches(request.headers.get("if-none-match"), photo.etag):
+        return Response(status_code=304, headers=headers)
+
+    size = photo.size
+    byte_range = None
+    # A stale If-Range means the client's partial copy is outdated: send it all
+    if request.headers.get("if-range", photo.etag) == photo.etag:
+        try:
+            byte_range = parse_range(request.headers.get("range"), size)
+        except RangeNotSatisfiable:
+            headers["Content-Range"] = f"bytes */{size}"
+            return Response(status_code=416, headers=headers)
+
+    media_type = mimetypes.guess_type(photoname)[0] or "application/octet-stream"
+    if byte_range is None:
+        if isinstance(photo, PhotoStat):
+            return FileResponse(photo.path, headers=headers, stat_result=photo.stat_result)
+        # Pack store: a view of a memory-mapped segment, sent without copying
+        return Response(photo_store.read(photo), headers=headers, media_type=media_type)
+
+    start, end = byte_range
+    headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+    if not isinstance(photo, PhotoStat):
+        return Response(
+            photo_store.read(photo)[start:end + 1],
+            status_code=206,
+            headers=headers,
+            media_type=media_type,
+        )
+    headers["Content-Length"] = str(end - start + 1)
+    return StreamingResponse(
+        iter_file_range(photo.path, start, end),
+        status_code=206,
+        headers=headers,
+        media_type=media_type,
+    )
+
+async def run_orphan_gc():
+    """Periodically collect photos that no post references."""
+    while True:
+        await asyncio.sleep(ORPHAN_GC_INTERVAL)
+        try:
+            report = await asyncio.to_thread(collect_orphans, on_removed=photo_stat_cache.invalidate)
+            logger.info("Orphan photo collection: %s", report)
+        except Exception:
+            logger.exception("Error in orphan photo collection")
+
+@router.get("/ready")
+async def readiness(require_model: bool = False):
+    """
+    Readiness probe. The API serves feeds and photos as soon as it has
+    started; the model state tells whether detection requests will be
+    answered without waiting for the model to load. With require_model=true
+    the probe fails with 503 until the model is ready.
+    """
+    ready = not require_model or inference_pool.model_state == "ready"
+    return JSONResponse(
+        {
+            "ready": ready,
+            "model": inference_pool.model_state,
+            "model_error": inference_pool.model_error,
+        },
+        status_code=200 if ready else 503,
+    )
 
-@app.get("/users/liked-posts/")
+@router.get("/users/liked-posts/")
 async def get_user_liked_posts(current_user: str = Depends(get_current_user)):
     user = session.query(User).filter_by(username=current_user).first()
     if not user:
@@ -379,7 +844,7 @@ async def get_user_liked_posts(current_user: str = Depends(get_current_user)):
     
     return {"liked_posts": user.thumbed_posts}
 
-@app.get("/posts/changed")
+@router.get("/posts/changed")
 async def check_posts_changed(since: str = Query(..., description="ISO format timestamp (e.g., '2023-04-01T12:00:00.000Z')")):
     """
     Check if any posts have been created or modified since the specified timestamp.
@@ -406,31 +871,33 @@ async def check_posts_changed(since: str = Query(..., description="ISO format ti
             since_datetime = datetime.fromisoformat(since.replace('Z', '+00:00'))
             # Make it timezone-naive for comparison with database timestamps
             since_datetime_local = since_datetime.replace(tzinfo=None)
-            print(f"Parsed UTC timestamp: {since_datetime}, converted to local: {since_datetime_local}")
+            logger.debug("Parsed UTC timestamp: %s, converted to local: %s", since_datetime, since_datetime_local)
         else:
             # If no timezone specified, assume it's already in local time
             since_datetime_local = datetime.fromisoformat(since)
-            print(f"Parsed local timestamp: {since_datetime_local}")
+            logger.debug("Parsed local timestamp: %s", since_datetime_local)
         
         # Get the current time (already in local timezone)
         current_time = utcnow()
         # Make sure current_time is timezone-naive for comparison
         if current_time.tzinfo is not None:
             current_time = current_time.replace(tzinfo=None)
-        print(f"Current time: {current_time}")
         
         # Ensure the timestamp is not in the future
         if since_datetime_local > current_time:
-            print(f"Warning: Provided timestamp {since_datetime_local} is in the future. Using current time {current_time} instead.")
+            logger.debug("Provided timestamp %s is in the future. Using current time %s instead.",
+                         since_datetime_local, current_time)
             since_datetime_local = current_time
         
-        print(f"Using timestamp for query: {since_datetime_local}")
+        logger.debug("Using timestamp for query: %s", since_datetime_local)
         
-        # For debugging, let's print all posts in the database
-        all_posts = session.query(Post).all()
-        print(f"Total posts in database: {len(all_posts)}")
-        for post in all_posts:
-            print(f"Post {post.id}: created_at={post.created_at}, updated_at={post.updated_at}, thumbs_up={post.thumbs_up}")
+        # Loads the whole table, so only when explicitly asked for
+        if LOG_POSTS_DUMP and logger.isEnabledFor(logging.DEBUG):
+            all_posts = session.query(Post).all()
+            logger.debug("Total posts in database: %d", len(all_posts))
+            for post in all_posts:
+                logger.debug("Post %d: created_at=%s, updated_at=%s, thumbs_up=%d",
+                             post.id, post.created_at, post.updated_at, post.thumbs_up)
         
         # Get all posts that might have changed since the timestamp
         all_posts_query = session.query(Post).filter(
@@ -441,7 +908,7 @@ async def check_posts_changed(since: str = Query(..., description="ISO format ti
         )
         
         all_changed_posts = all_posts_query.all()
-        print(f"Total changed posts: {len(all_changed_posts)}")
+        logger.debug("Total changed posts: %d", len(all_changed_posts))
         
         # Identify new posts (created after the timestamp)
         new_posts = [post for post in all_changed_posts if post.created_at > since_datetime_local]
@@ -451,18 +918,7 @@ async def check_posts_changed(since: str = Query(..., description="ISO format ti
         updated_posts = [post for post in all_changed_posts if post.updated_at > since_datetime_local and post.created_at <= since_datetime_local]
         updated_post_ids = [post.id for post in updated_posts]
         
-        # For debugging
-        if new_posts:
-            for post in new_posts:
-                print(f"New post: id={post.id}, created_at={post.created_at}, updated_at={post.updated_at}")
-        else:
-            print("No new posts found")
-        
-        if updated_posts:
-            for post in updated_posts:
-                print(f"Updated post: id={post.id}, created_at={post.created_at}, updated_at={post.updated_at}")
-        else:
-            print("No updated posts found")
+        logger.debug("New posts: %s, updated posts: %s", new_post_ids, updated_post_ids)
         
         # Determine if anything has changed
         changed = len(new_post_ids) > 0 or len(updated_post_ids) > 0
@@ -474,8 +930,7 @@ async def check_posts_changed(since: str = Query(..., description="ISO format ti
             "since": since_datetime_local.isoformat()
         }
     except Exception as e:
-        # Log the error for debugging
-        print(f"Error in check_posts_changed: {str(e)}")
+        logger.exception("Error in check_posts_changed")
         # Return a default response instead of an error
         return {
             "changed": False,
@@ -484,172 +939,332 @@ async def check_posts_changed(since: str = Query(..., description="ISO format ti
             "error": str(e)
         }
 
-# Initialize YOLOv8 model with better error handling
-try:
-    print("Initializing YOLOv8 model...")
-    yolo_model = YOLO("yolov8n.pt")  # Using the nano model for faster processing
-    print("YOLOv8 model initialized successfully")
-except Exception as e:
-    print(f"Error initializing YOLOv8 model: {str(e)}")
-    # We'll initialize it as None and check for it in the endpoint
-    yolo_model = None
+def multipart_body(boundary: str, parts: List[tuple]) -> bytes:
+    """A multipart/mixed body from (content type, bytes) parts."""
+    chunks = []
+    for content_type, data in parts:
+        chunks.append(f"--{boundary}\r\nContent-Type: {content_type}\r\n"
+                      f"Content-Length: {len(data)}\r\n\r\n".encode())
+        chunks.append(data)
+        chunks.append(b"\r\n")
+    chunks.append(f"--{boundary}--\r\n".encode())
+    return b"".join(chunks)
+
+async def detect_cached(contents: bytes, mode: str, info: Optional[ImageInfo] = None) -> tuple:
+    """
+    The serialized detect-objects response for `contents`, from the cache if
+    the same image was analyzed before, and the multipart boundary used in
+    binary mode. `info` is the image's header from check_image, if probed.
+    """
+    key = await asyncio.to_thread(cache_key, contents, mode)
+    boundary = f"figart-{key[:32]}"
+
+    async def detect():
+        result = await batch_scheduler.detect(contents, mode, info)
+        if mode != "binary":
+            return JSONResponse(result).body
+        boxed_jpeg = result.pop("boxed_jpeg")
+        return multipart_body(boundary, [
+            ("application/json", JSONResponse(result).body),
+            ("image/jpeg", boxed_jpeg),
+        ])
+
+    return await detection_cache.get_or_compute(key, detect), boundary
 
-@app.post("/api/detect-objects/")
-async def detect_objects(file: UploadFile = File(...)):
+async def detect_when_ready(contents: bytes, mode: str, retries: int = DETECT_ON_UPLOAD_RETRIES,
+                            info: Optional[ImageInfo] = None) -> bytes:
+    """
+    detect_cached for background and batch work: when the inference queue is
+    full, wait and try again instead of failing, so interactive requests keep
+    priority. Raises QueueFull once `retries` attempts were turned away.
+    """
+    for attempt in range(retries + 1):
+        try:
+            body, _ = await detect_cached(contents, mode, info)
+            return body
+        except QueueFull:
+            if attempt == retries:
+                raise
+            await asyncio.sleep(INFERENCE_RETRY_AFTER * (attempt + 1))
+
+@router.post("/api/detect-objects/")
+async def detect_objects(file: UploadFile = File(...), mode: str = Query("full")):
     """
     Analyze an image with YOLO to detect objects and suggest an optimal frame.
     Returns boxes of detected objects and a suggested frame.
+
+    mode selects how much image work is done:
+    - full (default): the boxed image as base64 JPEG in "boxed_image"
+    - preview: a downscaled boxed image in "boxed_image"
+    - boxes: no image, only detections to draw over the client's own copy
+    - binary: a multipart/mixed response with the JSON followed by the full
+      boxed image as an image/jpeg part
+
+    Boxes and frames are in the photo's pixels, "image_size". The boxed
+    image may be smaller, e.g. for large JPEGs decoded at reduced size; its
+    size is "boxed_image_size".
+
+    The work runs on the inference pool so the event loop stays responsive,
+    batched with other requests arriving at the same time.
     """
+    # Validate file type
+    logger.debug("Processing file: %s, content_type: %s", file.filename, file.content_type)
+    if not file.content_type.startswith('image/'):
+        raise HTTPException(status_code=400, detail="Only image files are accepted")
+
+    if file.content_type not in SUPPORTED_IMAGE_TYPES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Unsupported image format: {file.content_type}. Please use JPEG, PNG or WebP images."
+        )
+
+    if mode not in DETECTION_MODES:
+        raise HTTPException(status_code=400, detail=f"Unknown mode: {mode}. Use one of {', '.join(DETECTION_MODES)}.")
+
+    if file.size is not None and file.size > IMAGE_MAX_BYTES:
+        raise HTTPException(status_code=413, detail=f"Image is larger than {IMAGE_MAX_BYTES // (1024 * 1024)} MB")
+
+    # Read the uploaded image
+    contents = await file.read()
+    logger.debug("Read %d bytes of data", len(contents))
+    upload_bytes.inc("detect-objects", amount=len(contents))
+
+    # Check the header before anything decodes it, off the event loop: GIF,
+    # WebP and TIFF headers are walked frame by frame
     try:
-        # Check if model was successfully initialized
-        if yolo_model is None:
-            raise HTTPException(status_code=500, detail="YOLOv8 model could not be initialized. Please try again later.")
-            
-        # Validate file type
-        print(f"Processing file: {file.filename}, content_type: {file.content_type}")
-        if not file.content_type.startswith('image/'):
-            raise HTTPException(status_code=400, detail="Only image files are accepted")
-            
-        # Supported image formats
-        supported_formats = ['image/jpeg', 'image/jpg', 'image/png']
-        if file.content_type not in supported_formats:
-            raise HTTPException(
-                status_code=400, 
-                detail=f"Unsupported image format: {file.content_type}. Please use JPEG or PNG images."
-            )
-            
-        # Read the uploaded image
-        contents = await file.read()
-        print(f"Read {len(contents)} bytes of data")
-        
-        # Convert to numpy array
-        nparr = np.frombuffer(contents, np.uint8)
-        print(f"Converted to numpy array of shape: {nparr.shape}")
-        
-        # Check for empty image
-        if len(nparr) == 0:
-            raise HTTPException(status_code=400, detail="Empty image file received")
-            
-        # Decode image
-        img = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-        if img is None:
-            print("Failed to decode image")
-            raise HTTPException(status_code=400, detail="Could not decode image. Please try a different image format.")
-        
-        print(f"Decoded image of shape: {img.shape}")
-        
-        # Keep a copy of the original image for frame suggestion
-        original_img = img.copy()
-        
-        # Run YOLOv8 inference on the image
-        print("Running YOLOv8 inference...")
-        try:
-            results = yolo_model(img)
-            print(f"YOLOv8 inference completed successfully")
-        except Exception as yolo_err:
-            print(f"YOLOv8 inference error: {str(yolo_err)}")
-            raise HTTPException(status_code=500, detail=f"YOLOv8 processing error: {str(yolo_err)}")
-        
-        # Get the detection results
-        detections = []
-        for r in results:
-            print(f"Processing detection results: {len(r.boxes)} boxes found")
-            boxes = r.boxes
-            for box in boxes:
-                x1, y1, x2, y2 = map(int, box.xyxy[0])
-                confidence = float(box.conf[0])
-                cls = int(box.cls[0])
-                class_name = r.names[cls]
-                
-                detections.append({
-                    "box": [x1, y1, x2, y2],
-                    "confidence": confidence,
-                    "class": class_name
-                })
-        
-        print(f"Processed {len(detections)} detections")
-        
-        # Draw boxes on the image for visualization
-        for det in detections:
-            x1, y1, x2, y2 = det["box"]
-            cv2.rectangle(img, (x1, y1), (x2, y2), (0, 255, 0), 2)
-            cv2.putText(img, f"{det['class']} {det['confidence']:.2f}", 
-                       (x1, y1 - 5), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 0), 2)
-        
-        # Calculate a suggested frame based on detected objects
-        print("Calculating suggested frame")
-        suggested_frame = calculate_suggested_frame(detections, original_img)
-        print(f"Suggested frame: {suggested_frame}")
-        
-        # Convert the processed image to base64 for response
-        print("Encoding image to base64")
-        try:
-            _, buffer = cv2.imencode('.jpg', img)
-            img_base64 = base64.b64encode(buffer).decode('utf-8')
-            print(f"Encoded image to base64, length: {len(img_base64)}")
-        except Exception as enc_err:
-            print(f"Error encoding image to base64: {str(enc_err)}")
-            raise HTTPException(status_code=500, detail=f"Image encoding error: {str(enc_err)}")
-        
-        # Prepare and return response
-        response_data = {
-            "detected_objects": detections,
-            "boxed_image": img_base64,
-            "suggested_frame": suggested_frame
-        }
-        print("Returning successful response")
-        return JSONResponse(response_data)
-        
-    except HTTPException as he:
-        # Re-raise HTTP exceptions
-        print(f"HTTP Exception: {he.detail}")
-        raise
+        info = await asyncio.to_thread(check_image, contents)
+    except ImageRejected as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+
+    try:
+        body, boundary = await detect_cached(contents, mode, info)
+    except QueueFull:
+        raise HTTPException(
+            status_code=503,
+            detail="Too many images are being analyzed. Please try again shortly.",
+            headers={"Retry-After": str(INFERENCE_RETRY_AFTER)}
+        )
+    except DetectionError as e:
+        logger.info("Detection failed with %d: %s", e.status_code, e.detail)
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
     except Exception as e:
-        # Log the full error and traceback
-        import traceback
-        error_traceback = traceback.format_exc()
-        print(f"Unexpected error in detect_objects: {str(e)}")
-        print(f"Traceback: {error_traceback}")
+        logger.exception("Unexpected error in detect_objects")
         raise HTTPException(status_code=500, detail=f"Image processing error: {str(e)}")
 
+    if mode == "binary":
+        return Response(body, media_type=f"multipart/mixed; boundary={boundary}")
+    return Response(body, media_type="application/json")
 
-def calculate_suggested_frame(detections: List[Dict], image: np.ndarray) -> Dict[str, int]:
+async def batch_images(form, archive):
     """
-    Calculate the optimal frame based on detected objects.
+    Yield (name, contents, error) for each image of a batch request: the
+    "files" parts, then the images in the zip "archive". Only one image is
+    read at a time; the rest stay in the spooled upload.
     """
-    height, width = image.shape[:2]
-    
-    # Default frame dimensions (mobile aspect ratio)
-    frame_width = 375
-    frame_height = 667
-    
-    # If no objects detected, center the frame
-    if not detections:
-        frame_x = max(0, (width - frame_width) // 2)
-        frame_y = max(0, (height - frame_height) // 2)
-        return {"x": frame_x, "y": frame_y, "width": frame_width, "height": frame_height}
-    
-    # Calculate bounding box that contains all detected objects
-    # (with some margin)
-    margin = 50  # pixels of margin
-    
-    all_boxes = [d["box"] for d in detections]
-    min_x = max(0, min([box[0] for box in all_boxes]) - margin)
-    min_y = max(0, min([box[1] for box in all_boxes]) - margin)
-    max_x = min(width, max([box[2] for box in all_boxes]) + margin)
-    max_y = min(height, max([box[3] for box in all_boxes]) + margin)
-    
-    # Calculate center of this bounding box
-    center_x = (min_x + max_x) // 2
-    center_y = (min_y + max_y) // 2
-    
-    # Calculate frame position to center around the objects
-    frame_x = max(0, min(width - frame_width, center_x - frame_width // 2))
-    frame_y = max(0, min(height - frame_height, center_y - frame_height // 2))
-    
+    for file in form.getlist("files"):
+        if file.content_type not in SUPPORTED_IMAGE_TYPES:
+            yield file.filename, None, f"Unsupported image format: {file.content_type}"
+        elif file.size is not None and file.size > DETECTION_BATCH_MAX_IMAGE_BYTES:
+            yield file.filename, None, "Image too large"
+        else:
+            yield file.filename, await file.read(), None
+    if archive is None:
+        return
+    for info in archive_images(archive):
+        if info.file_size > DETECTION_BATCH_MAX_IMAGE_BYTES:
+            yield info.filename, None, "Image too large"
+            continue
+        try:
+            yield info.filename, await asyncio.to_thread(archive.read, info), None
+        except (zipfile.BadZipFile, NotImplementedError, RuntimeError) as e:
+            yield info.filename, None, f"Unreadable archive entry: {str(e)}"
+
+def archive_images(archive: zipfile.ZipFile) -> List[zipfile.ZipInfo]:
+    """Image entries of a zip, skipping directories and macOS resource forks."""
+    return [
+        info for info in archive.infolist()
+        if not info.is_dir()
+        and not info.filename.startswith("__MACOSX/")
+        and mimetypes.guess_type(info.filename)[0] in SUPPORTED_IMAGE_TYPES
+    ]
+
+def error_line(index: int, name: str, error: str, status: int) -> bytes:
+    return json.dumps({"index": index, "name": name, "error": error, "status": status}).encode() + b"\n"
+
+async def stream_batch_detections(form, archive, mode: str):
+    """
+    NDJSON lines of batch detection results in the order they finish, each
+    tagged with the image's position in the request and its name.
+    """
+    async def run(index: int, name: str, contents: bytes) -> bytes:
+        upload_bytes.inc("detect-objects-batch", amount=len(contents))
+        try:
+            info = await asyncio.to_thread(check_image, contents)
+            body = await detect_when_ready(contents, mode, info=info)
+        except ImageRejected as e:
+            return error_line(index, name, e.detail, e.status_code)
+        except QueueFull:
+            return error_line(index, name, "Too many images are being analyzed", 503)
+        except DetectionError as e:
+            return error_line(index, name, e.detail, e.status_code)
+        except Exception as e:
+            logger.exception("Unexpected error in batch detection")
+            return error_line(index, name, f"Image processing error: {str(e)}", 500)
+        # Splice the cached response body into the line instead of re-encoding it
+        prefix = json.dumps({"index": index, "name": name})[:-1].encode()
+        return prefix + b", " + body[1:] + b"\n"
+
+    pending = set()
+    try:
+        index = 0
+        async for name, contents, error in batch_images(form, archive):
+            if error is not None:
+                yield error_line(index, name, error, 400)
+            else:
+                pending.add(asyncio.ensure_future(run(index, name, contents)))
+            index += 1
+            if len(pending) >= DETECTION_BATCH_WINDOW:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            else:
+                done = {task for task in pending if task.done()}
+                pending -= done
+            for task in done:
+                yield task.result()
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                yield task.result()
+    finally:
+        # Also reached when the client disconnects mid-stream
+        for task in pending:
+            task.cancel()
+        if archive is not None:
+            archive.close()
+        await form.close()
+
+@router.post("/api/detect-objects/batch/")
+async def detect_objects_batch(request: Request, mode: str = Query("boxes")):
+    """
+    Analyze many images in one request: any number of "files" parts and/or a
+    zip of JPEG, PNG and WebP images as "archive". Results stream back as NDJSON,
+    one line per image as soon as it is done, with the image's "index" and
+    "name" and either the fields of a detect-objects response in `mode`
+    (boxes by default; binary isn't available) or an "error" and "status".
+
+    Images are fed to the inference pool a window at a time, where they are
+    batched with each other and with concurrent requests, so memory stays
+    bounded however many are sent.
+    """
+    if mode not in DETECTION_MODES or mode == "binary":
+        modes = ", ".join(m for m in DETECTION_MODES if m != "binary")
+        raise HTTPException(status_code=400, detail=f"Unknown mode: {mode}. Use one of {modes}.")
+
+    # Parsed here rather than as parameters so the uploads stay open while the response streams
+    form = await request.form(max_files=DETECTION_BATCH_MAX_IMAGES + 1)
+    archive = None
+    try:
+        count = len(form.getlist("files"))
+        upload = form.get("archive")
+        if isinstance(upload, str):
+            raise HTTPException(status_code=400, detail="archive must be a file")
+        if upload is not None:
+            try:
+                archive = zipfile.ZipFile(upload.file)
+            except zipfile.BadZipFile:
+                raise HTTPException(status_code=400, detail="archive is not a zip file")
+            count += len(archive_images(archive))
+        if count == 0:
+            raise HTTPException(status_code=400, detail="No images to analyze")
+        if count > DETECTION_BATCH_MAX_IMAGES:
+            raise HTTPException(status_code=400, detail=f"At most {DETECTION_BATCH_MAX_IMAGES} images per request")
+    except BaseException:
+        if archive is not None:
+            archive.close()
+        await form.close()
+        raise
+
+    logger.info("Batch detection of %d images", count)
+    return StreamingResponse(stream_batch_detections(form, archive, mode), media_type="application/x-ndjson")
+
+@router.get("/api/detect-objects/stats")
+async def detection_stats():
+    """Detection cache hit rates and the number of images waiting for the model."""
     return {
-        "x": frame_x,
-        "y": frame_y,
-        "width": frame_width,
-        "height": frame_height
+        "cache": detection_cache.stats(),
+        "pending": batch_scheduler.pending,
+        "model": inference_pool.model_state,
     }
+
+@router.get("/api/admission/stats")
+async def admission_stats():
+    """Running, waiting, admitted and rejected requests per route class, to tune ADMISSION_LIMITS."""
+    return admission.stats()
+
+# Values kept by other modules, read when /metrics is scraped
+metrics.Callback("figart_detection_queue_depth", "Images waiting for or in YOLO inference.", "gauge",
+                 lambda: {(): batch_scheduler.pending})
+metrics.Callback("figart_detection_cache_lookups_total", "Detection cache lookups by result.", "counter",
+                 lambda: {(result,): detection_cache.stats()[result]
+                          for result in ("memory_hits", "disk_hits", "coalesced", "misses")}, ("result",))
+metrics.Callback("figart_photo_cache_lookups_total", "Photo path cache lookups by result.", "counter",
+                 lambda: {("hit",): photo_stat_cache.hits, ("miss",): photo_stat_cache.misses}, ("result",))
+metrics.Callback("figart_admission_requests", "Requests running or waiting per route class.", "gauge",
+                 lambda: {(name, state): stats[state] for name, stats in admission.stats().items()
+                          for state in ("active", "waiting")}, ("route_class", "state"))
+metrics.Callback("figart_admission_rejected_total", "Requests shed per route class.", "counter",
+                 lambda: {(name,): stats["rejected"] + stats["timed_out"] for name, stats in admission.stats().items()},
+                 ("route_class",))
+metrics.Callback("figart_log_records_dropped_total", "Log records dropped because the log queue was full.", "counter",
+                 lambda: {(): dropped_records()})
+
+@router.get("/metrics")
+async def get_metrics():
+    """Request, database, detection and cache metrics in the Prometheus text format."""
+    if not METRICS_ENABLED:
+        raise HTTPException(status_code=404, detail="Not Found")
+    return Response(metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+@contextlib.asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Prepare the database and upload directories on startup and start the
+    background jobs. The model is loaded in the background, so the API starts
+    answering requests before it is ready.
+    """
+    setup_logging()
+    init_db()
+    ensure_upload_dirs()
+    tasks = []
+    if ORPHAN_GC_INTERVAL > 0:
+        tasks.append(asyncio.create_task(run_orphan_gc()))
+    if INFERENCE_WARMUP:
+        tasks.append(asyncio.create_task(inference_pool.warm_up()))
+    try:
+        yield
+    finally:
+        for task in tasks:
+            task.cancel()
+        shutdown_normalize_pool()
+        inference_pool.shutdown()
+        shutdown_logging()
+
+def create_app() -> FastAPI:
+    app = FastAPI(lifespan=lifespan)
+    # Added first so it runs inside CORS and 429s carry CORS headers
+    app.add_middleware(AdmissionMiddleware)
+    app.add_middleware(
+        CORSMiddleware,
+        allow_origins=HOSTS,
+        allow_credentials=True,
+        allow_methods=["*"],
+        allow_headers=["*"],
+    )
+    if METRICS_ENABLED:
+        # Outside admission control, so time spent queueing and 429s are measured
+        app.add_middleware(MetricsMiddleware)
+    # Outermost, so everything the request does is logged under its ID
+    app.add_middleware(RequestIdMiddleware)
+    app.include_router(router)
+    return app
+
+app = create_app()
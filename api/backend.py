@@ -1,11 +1,13 @@
-from sqlalchemy import DateTime, create_engine, Column, Integer, String, JSON, ForeignKey
+from sqlalchemy import DateTime, create_engine, event, Column, Integer, String, JSON, ForeignKey, Float, LargeBinary, inspect, text
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, relationship
 from fastapi import HTTPException
 from werkzeug.security import generate_password_hash, check_password_hash
 from datetime import datetime
+import time
 
 from settings import *
+from metrics import db_query_duration
 
 Base = declarative_base()
 
@@ -36,13 +38,86 @@ class Post(Base):
     created_at = Column(DateTime, default=utcnow)
     updated_at = Column(DateTime, default=utcnow, onupdate=utcnow)
     thumbs_up = Column(Integer, default=0)
+    # Upload size in bytes, and the size after normalization (None until normalized)
+    original_size = Column(Integer, nullable=True)
+    normalized_size = Column(Integer, nullable=True)
+    # Tiny base64 JPEG preview (data URI) shown while the photo loads
+    placeholder = Column(String, nullable=True)
     
     # Add relationship to comments with cascade delete
     comments = relationship("Comment", cascade="all, delete-orphan", backref="post")
+    detection = relationship("PostDetection", cascade="all, delete-orphan", uselist=False, backref="post")
+    frame_heatmap = relationship("FrameHeatmap", cascade="all, delete-orphan", uselist=False, backref="post")
+    frame_contributions = relationship("FrameContribution", cascade="all, delete-orphan", backref="post")
 
     def __repr__(self):
         return f"<Post(id={self.id}, photo_id={self.photo_id}, user_id={self.user_id}, created_at={self.created_at}, thumbs_up={self.thumbs_up})>"
 
+class PhotoBlob(Base):
+    __tablename__ = 'photo_blobs'
+
+    # Uploads are stored once per distinct content; posts share the file
+    digest = Column(String(64), primary_key=True)  # sha256 of the file bytes
+    photo_uuid = Column(String, unique=True, nullable=False)
+    size = Column(Integer, nullable=False)
+    ref_count = Column(Integer, default=0, nullable=False)
+    created_at = Column(DateTime, default=utcnow)
+
+    def __repr__(self):
+        return f"<PhotoBlob(digest={self.digest}, photo_uuid={self.photo_uuid}, size={self.size}, ref_count={self.ref_count})>"
+
+class PostDetection(Base):
+    __tablename__ = 'post_detections'
+
+    # Object detection run once per post in the background after upload
+    post_id = Column(Integer, ForeignKey('posts.id'), primary_key=True)
+    status = Column(String, nullable=False, default="pending")  # pending, done or failed
+    detected_objects = Column(JSON, nullable=True)  # [{"box", "confidence", "class"}]
+    suggested_frame = Column(JSON, nullable=True)
+    image_width = Column(Integer, nullable=True)
+    image_height = Column(Integer, nullable=True)
+    # Saliency grid the suggested frames were scored with: grid_shape(image_width,
+    # image_height) float32s, row-major. None for detections stored before it was kept
+    saliency = Column(LargeBinary, nullable=True)
+    model_version = Column(String, nullable=True)
+    error = Column(String, nullable=True)
+    updated_at = Column(DateTime, default=utcnow, onupdate=utcnow)
+
+    def __repr__(self):
+        return f"<PostDetection(post_id={self.post_id}, status={self.status})>"
+
+class FrameHeatmap(Base):
+    __tablename__ = 'frame_heatmaps'
+
+    # How many community frames of a post's photo cover each cell of its
+    # composition grid, updated as frames are submitted
+    post_id = Column(Integer, ForeignKey('posts.id'), primary_key=True)
+    columns = Column(Integer, nullable=False)
+    rows = Column(Integer, nullable=False)
+    counts = Column(LargeBinary, nullable=False)  # rows x columns unsigned 32-bit ints, row-major
+    frames = Column(Integer, nullable=False, default=0)
+    # Sums of the frames' position and size as fractions of the photo, for the average frame
+    sum_x = Column(Float, nullable=False, default=0.0)
+    sum_y = Column(Float, nullable=False, default=0.0)
+    sum_width = Column(Float, nullable=False, default=0.0)
+    sum_height = Column(Float, nullable=False, default=0.0)
+    updated_at = Column(DateTime, default=utcnow, onupdate=utcnow)
+
+    def __repr__(self):
+        return f"<FrameHeatmap(post_id={self.post_id}, frames={self.frames})>"
+
+class FrameContribution(Base):
+    __tablename__ = 'frame_contributions'
+
+    # Each user adds their frames of a post's photo to its heatmap once
+    post_id = Column(Integer, ForeignKey('posts.id'), primary_key=True)
+    user_id = Column(Integer, ForeignKey('users.id'), primary_key=True)
+    frames = Column(Integer, nullable=False)
+    created_at = Column(DateTime, default=utcnow)
+
+    def __repr__(self):
+        return f"<FrameContribution(post_id={self.post_id}, user_id={self.user_id}, frames={self.frames})>"
+
 class Comment(Base):
     __tablename__ = 'comments'
 
@@ -59,7 +134,39 @@ class Comment(Base):
 if RUN_TESTS:
     DB = "sqlite:///test.db"
 engine = create_engine(DB)
-Base.metadata.create_all(engine)
+
+# Statement types timed separately; anything else counts as "other"
+TIMED_STATEMENTS = {"select", "insert", "update", "delete"}
+
+@event.listens_for(engine, "before_cursor_execute")
+def start_query_timer(conn, cursor, statement, parameters, context, executemany):
+    conn.info["query_start"] = time.perf_counter()
+
+@event.listens_for(engine, "after_cursor_execute")
+def record_query_time(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info["query_start"]
+    kind = statement.lstrip()[:6].lower()
+    db_query_duration.observe(elapsed, kind if kind in TIMED_STATEMENTS else "other")
+
+def add_missing_columns(engine):
+    """
+    create_all() only creates missing tables. Add nullable columns that were
+    introduced on existing tables since the database was created.
+    """
+    inspector = inspect(engine)
+    for table in Base.metadata.sorted_tables:
+        existing = {c['name'] for c in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing or not column.nullable:
+                continue
+            column_type = column.type.compile(engine.dialect)
+            with engine.begin() as conn:
+                conn.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}"))
+
+def init_db():
+    """Create missing tables and columns. Called at API startup and by maintenance scripts."""
+    Base.metadata.create_all(engine)
+    add_missing_columns(engine)
 
 Session = sessionmaker(bind=engine)
 session = Session()
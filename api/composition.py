@@ -0,0 +1,374 @@
+"""
+Composition scoring: where to frame a photo.
+
+An importance map is built on a coarse grid over the photo from the
+detections (class weight times confidence, spread over each box and peaking
+at its center) plus, when the pixels are at hand, a spectral-residual
+saliency map. Every candidate frame of each aspect ratio, at several sizes
+and every grid position, is then scored at once from integral images of the
+map:
+
+- coverage: the share of the photo's importance inside the frame
+- tightness: smaller frames holding the same importance score higher
+- thirds: how close the frame's center of importance is to a rule-of-thirds
+  power point
+- cuts: how much importance sits in subjects the frame's edges cut through
+
+The best few frames per aspect ratio, skipping near-duplicates, are returned
+in photo pixels.
+"""
+
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from settings import (
+    COMPOSITION_ASPECT_RATIOS, COMPOSITION_TOP_K, COMPOSITION_GRID,
+    COMPOSITION_SCALES, COMPOSITION_MIN_SCALE, COMPOSITION_SALIENCY_WEIGHT
+)
+from inference_backends import nms
+
+# Importance of a detection per unit of confidence, by COCO class
+CLASS_WEIGHTS = {
+    "person": 3.0,
+    "dog": 2.0, "cat": 2.0, "bird": 2.0, "horse": 2.0, "sheep": 2.0, "cow": 2.0,
+    "elephant": 2.0, "bear": 2.0, "zebra": 2.0, "giraffe": 2.0,
+}
+DEFAULT_CLASS_WEIGHT = 1.0
+
+# Score terms
+AREA_PENALTY = 0.3
+THIRDS_WEIGHT = 0.2
+CUT_PENALTY = 0.5
+# Cuts are only checked for the most important detections
+CUT_DETECTIONS = 16
+# Frames overlapping a better one by more than this are near-duplicates
+DUPLICATE_IOU = 0.5
+# Only this many best candidates are considered for the top K
+SHORTLIST = 256
+
+# Rule-of-thirds power points, relative to the frame
+POWER_POINTS = np.array([[1 / 3, 1 / 3], [2 / 3, 1 / 3], [1 / 3, 2 / 3], [2 / 3, 2 / 3]], dtype=np.float32)
+# Largest possible distance from a point of the frame to its nearest power point
+MAX_THIRDS_DISTANCE = float(np.hypot(1 / 3, 1 / 3))
+
+
+def parse_ratio(ratio: str) -> float:
+    """Width over height of an aspect ratio given as "W:H"."""
+    width, _, height = ratio.partition(":")
+    try:
+        value = float(width) / float(height)
+    except (ValueError, ZeroDivisionError):
+        raise ValueError(f"Invalid aspect ratio: {ratio}")
+    if not np.isfinite(value) or value <= 0:
+        raise ValueError(f"Invalid aspect ratio: {ratio}")
+    return value
+
+
+def grid_shape(width: int, height: int, cells: int = COMPOSITION_GRID) -> Tuple[int, int]:
+    """(columns, rows) of the scoring grid, with `cells` along the longest side."""
+    cell = max(width, height) / cells
+    return max(1, round(width / cell)), max(1, round(height / cell))
+
+
+def box_profiles(lo: np.ndarray, hi: np.ndarray, n: int) -> np.ndarray:
+    """
+    For boxes spanning [lo, hi) in grid units, (boxes, n) weights over the
+    grid cells along one axis: a parabola peaking at the box center and zero
+    outside it, summing to 1. Boxes thinner than a cell get the cell they're in.
+    """
+    centers = np.arange(n, dtype=np.float32) + 0.5
+    mid = (lo + hi) / 2
+    half = np.maximum((hi - lo) / 2, 0.5)
+    t = (centers[None, :] - mid[:, None]) / half[:, None]
+    profiles = np.clip(1 - t * t, 0, None)
+    sums = profiles.sum(axis=1)
+    empty = sums == 0
+    if empty.any():
+        profiles[empty, np.clip(mid[empty].astype(int), 0, n - 1)] = 1
+        sums[empty] = 1
+    return profiles / sums[:, None]
+
+
+def box_blur(a: np.ndarray, radius: int) -> np.ndarray:
+    """Mean over a (2 * radius + 1) square around each element, edges replicated."""
+    size = 2 * radius + 1
+    padded = np.pad(a, radius, mode="edge")
+    table = integral(padded)
+    h, w = a.shape
+    return (table[size:size + h, size:size + w] - table[:h, size:size + w]
+            - table[size:size + h, :w] + table[:h, :w]) / (size * size)
+
+
+def saliency_map(gray: np.ndarray) -> np.ndarray:
+    """
+    Spectral residual saliency (Hou and Zhang, 2007) of a small grayscale
+    image, normalized to sum to 1. Highlights what stands out from the
+    photo's overall texture, e.g. a subject against sky or sea.
+    """
+    spectrum = np.fft.fft2(gray.astype(np.float32))
+    log_amplitude = np.log(np.abs(spectrum) + 1e-9)
+    residual = log_amplitude - box_blur(log_amplitude, 1)
+    saliency = np.abs(np.fft.ifft2(np.exp(residual + 1j * np.angle(spectrum)))) ** 2
+    saliency = box_blur(saliency.astype(np.float32), 1)
+    total = saliency.sum()
+    return saliency / total if total > 0 else saliency
+
+
+def detection_arrays(detections: List[Dict], width: int, height: int, grid: Tuple[int, int]):
+    """Detection boxes in grid units and their importance weights."""
+    columns, rows = grid
+    boxes = np.array([d["box"] for d in detections], dtype=np.float32).reshape(-1, 4)
+    boxes *= np.array([columns / width, rows / height, columns / width, rows / height], dtype=np.float32)
+    weights = np.array(
+        [CLASS_WEIGHTS.get(d["class"], DEFAULT_CLASS_WEIGHT) * d["confidence"] for d in detections],
+        dtype=np.float32,
+    )
+    return boxes, weights
+
+
+def importance_map(boxes: np.ndarray, weights: np.ndarray, grid: Tuple[int, int],
+                   saliency: Optional[np.ndarray] = None) -> np.ndarray:
+    """
+    (rows, columns) map of how much each grid cell matters. Each detection
+    contributes its weight in total; the saliency map, if given,
+    COMPOSITION_SALIENCY_WEIGHT.
+    """
+    columns, rows = grid
+    importance = np.zeros((rows, columns), dtype=np.float32)
+    if len(boxes):
+        px = box_profiles(boxes[:, 0], boxes[:, 2], columns)
+        py = box_profiles(boxes[:, 1], boxes[:, 3], rows)
+        importance += np.einsum("n,ny,nx->yx", weights, py, px, optimize=True)
+    if saliency is not None:
+        importance += COMPOSITION_SALIENCY_WEIGHT * saliency
+    return importance
+
+
+def integral(a: np.ndarray) -> np.ndarray:
+    """Summed-area table with a leading row and column of zeros, in float64."""
+    table = np.zeros((a.shape[0] + 1, a.shape[1] + 1), dtype=np.float64)
+    np.cumsum(np.cumsum(a, axis=0, dtype=np.float64), axis=1, out=table[1:, 1:])
+    return table
+
+
+def window_sums(table: np.ndarray, x0, y0, x1, y1) -> np.ndarray:
+    """Sums over the windows [x0, x1) x [y0, y1), all at once, of one or a stack of tables."""
+    return table[..., y1, x1] - table[..., y0, x1] - table[..., y1, x0] + table[..., y0, x0]
+
+
+def candidate_windows(ratio: float, width: int, height: int, grid: Tuple[int, int]):
+    """
+    Grid windows (x0, y0, x1, y1) of every size and position for an aspect
+    ratio, and the frame size in photo pixels each one stands for.
+    """
+    columns, rows = grid
+    fit_height = min(height, width / ratio)
+    windows, sizes = [], []
+    for scale in np.linspace(COMPOSITION_MIN_SCALE, 1.0, COMPOSITION_SCALES):
+        frame_w = max(1, min(width, round(fit_height * ratio * scale)))
+        frame_h = max(1, min(height, round(fit_height * scale)))
+        cw = min(columns, max(1, round(frame_w * columns / width)))
+        ch = min(rows, max(1, round(frame_h * rows / height)))
+        y0, x0 = np.mgrid[0:rows - ch + 1, 0:columns - cw + 1]
+        x0, y0 = x0.ravel(), y0.ravel()
+        windows.append(np.stack([x0, y0, x0 + cw, y0 + ch], axis=1))
+        sizes.append(np.tile([frame_w, frame_h], (len(x0), 1)))
+    return np.concatenate(windows), np.concatenate(sizes)
+
+
+def moment_tables(importance: np.ndarray) -> np.ndarray:
+    """
+    Summed-area tables of the importance map and of its first moments in x
+    and y, stacked, so a window's mass and center of importance both come
+    from four lookups.
+    """
+    rows, columns = importance.shape
+    ys, xs = np.mgrid[0:rows, 0:columns].astype(np.float32) + 0.5
+    return np.stack([integral(importance), integral(importance * xs), integral(importance * ys)])
+
+
+def score_windows(windows: np.ndarray, tables: np.ndarray,
+                  boxes: np.ndarray, weights: np.ndarray) -> np.ndarray:
+    """Composition score of each grid window; higher is better."""
+    rows, columns = tables.shape[1] - 1, tables.shape[2] - 1
+    x0, y0, x1, y1 = windows.T
+    fx0, fy0, fx1, fy1 = windows.T.astype(np.float32)
+    area = (fx1 - fx0) * (fy1 - fy0) / (rows * columns)
+    total = tables[0, -1, -1]
+    if total <= 0:
+        # Nothing to go by: prefer the largest, most central frames
+        offset = np.hypot((fx0 + fx1) / 2 / columns - 0.5, (fy0 + fy1) / 2 / rows - 0.5)
+        return area - offset
+
+    mass, moment_x, moment_y = window_sums(tables, x0, y0, x1, y1).astype(np.float32)
+    coverage = mass / np.float32(total)
+    safe_mass = np.where(mass > 0, mass, 1)
+    u = (moment_x / safe_mass - fx0) / (fx1 - fx0)
+    v = (moment_y / safe_mass - fy0) / (fy1 - fy0)
+    du = u[:, None] - POWER_POINTS[:, 0]
+    dv = v[:, None] - POWER_POINTS[:, 1]
+    distance = np.sqrt((du * du + dv * dv).min(axis=1))
+    thirds = np.where(mass > 0, 1 - distance / MAX_THIRDS_DISTANCE, 0)
+
+    score = coverage - AREA_PENALTY * area + THIRDS_WEIGHT * thirds
+    if len(boxes):
+        # Share of each detection inside each window: 0 or 1 is clean, in between a cut
+        if len(boxes) > CUT_DETECTIONS:
+            keep = np.argsort(-weights)[:CUT_DETECTIONS]
+            boxes, weights = boxes[keep], weights[keep]
+        inter_w = np.clip(np.minimum(fx1[:, None], boxes[:, 2]) - np.maximum(fx0[:, None], boxes[:, 0]), 0, None)
+        inter_h = np.clip(np.minimum(fy1[:, None], boxes[:, 3]) - np.maximum(fy0[:, None], boxes[:, 1]), 0, None)
+        box_area = np.maximum((boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1]), 1e-6)
+        inside = np.minimum(inter_w * inter_h / box_area, 1)
+        cut = (4 * inside * (1 - inside)) @ (weights / weights.sum())
+        score -= CUT_PENALTY * cut
+    return score
+
+
+def top_frames(windows: np.ndarray, sizes: np.ndarray, scores: np.ndarray, k: int,
+               width: int, height: int, grid: Tuple[int, int]) -> List[Dict]:
+    """The k best windows that aren't near-duplicates, as frames in photo pixels."""
+    columns, rows = grid
+    shortlist = np.argsort(-scores)[:SHORTLIST]
+    keep = shortlist[nms(windows[shortlist].astype(np.float32), scores[shortlist], DUPLICATE_IOU)[:k]]
+    frames = []
+    for (x0, y0, _, _), (frame_w, frame_h), score in zip(windows[keep], sizes[keep], scores[keep]):
+        x = min(max(0, round(x0 * width / columns)), width - frame_w)
+        y = min(max(0, round(y0 * height / rows)), height - frame_h)
+        frames.append({"x": int(x), "y": int(y), "width": int(frame_w), "height": int(frame_h),
+                       "score": round(float(score), 4)})
+    return frames
+
+
+def scene(detections: List[Dict], width: int, height: int, saliency: Optional[np.ndarray] = None):
+    """Grid, detection arrays and moment tables shared by everything scored on a photo."""
+    grid = grid_shape(width, height)
+    boxes, weights = detection_arrays(detections, width, height, grid)
+    tables = moment_tables(importance_map(boxes, weights, grid, saliency))
+    return grid, boxes, weights, tables
+
+
+def suggest_frames(detections: List[Dict], width: int, height: int,
+                   ratios: Sequence[str] = COMPOSITION_ASPECT_RATIOS, k: int = COMPOSITION_TOP_K,
+                   saliency: Optional[np.ndarray] = None) -> Dict[str, List[Dict]]:
+    """
+    The k best frames for each aspect ratio ("W:H") of a `width` x `height`
+    photo, best first, as {"x", "y", "width", "height", "score"} in photo
+    pixels. `saliency` is an optional map of grid_shape(width, height),
+    e.g. from saliency_map.
+    """
+    grid, boxes, weights, tables = scene(detections, width, height, saliency)
+    frames = {}
+    for ratio in ratios:
+        windows, sizes = candidate_windows(parse_ratio(ratio), width, height, grid)
+        scores = score_windows(windows, tables, boxes, weights)
+        frames[ratio] = top_frames(windows, sizes, scores, k, width, height, grid)
+    return frames
+
+
+def stored_grid(data: Optional[bytes], width: int, height: int) -> Optional[np.ndarray]:
+    """
+    A map of grid_shape(width, height) stored as float32 bytes, e.g. a
+    saliency map kept with a post's detections. None without data, or if the
+    grid has changed since it was stored.
+    """
+    columns, rows = grid_shape(width, height)
+    if data is None or len(data) != columns * rows * 4:
+        return None
+    return np.frombuffer(data, dtype=np.float32).reshape(rows, columns)
+
+
+# User frames
+
+def frame_array(frames: Sequence[Dict], width: int, height: int) -> np.ndarray:
+    """(n, 4) x0, y0, x1, y1 of frames given as {"x", "y", "width", "height"}, clipped to the photo."""
+    rects = np.array([[f["x"], f["y"], f["width"], f["height"]] for f in frames], dtype=np.float32).reshape(-1, 4)
+    rects[:, 2:] += rects[:, :2]
+    np.clip(rects, 0, [width, height, width, height], out=rects)
+    return rects
+
+
+def frame_sums(frames: Sequence[Dict], width: int, height: int) -> Tuple[float, float, float, float]:
+    """Sums of the frames' x, y, width and height, clipped to the photo, as fractions of its size."""
+    rects = frame_array(frames, width, height).astype(np.float64)
+    x, y = rects[:, :2].sum(axis=0) / [width, height]
+    sides = (rects[:, 2:] - rects[:, :2]).sum(axis=0) / [width, height]
+    return float(x), float(y), float(sides[0]), float(sides[1])
+
+
+def grid_windows(rects: np.ndarray, width: int, height: int, grid: Tuple[int, int]) -> np.ndarray:
+    """Frames in photo pixels as grid windows, at least one cell across."""
+    columns, rows = grid
+    scaled = np.rint(rects * [columns / width, rows / height, columns / width, rows / height]).astype(int)
+    x0 = np.clip(scaled[:, 0], 0, columns - 1)
+    y0 = np.clip(scaled[:, 1], 0, rows - 1)
+    x1 = np.clip(scaled[:, 2], x0 + 1, columns)
+    y1 = np.clip(scaled[:, 3], y0 + 1, rows)
+    return np.stack([x0, y0, x1, y1], axis=1)
+
+
+def rect_iou(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """IoU of each pair of rows of two (n, 4) arrays of x0, y0, x1, y1."""
+    width = np.clip(np.minimum(a[:, 2], b[:, 2]) - np.maximum(a[:, 0], b[:, 0]), 0, None)
+    height = np.clip(np.minimum(a[:, 3], b[:, 3]) - np.maximum(a[:, 1], b[:, 1]), 0, None)
+    inter = width * height
+    union = (a[:, 2] - a[:, 0]) * (a[:, 3] - a[:, 1]) + (b[:, 2] - b[:, 0]) * (b[:, 3] - b[:, 1]) - inter
+    return inter / np.maximum(union, 1e-6)
+
+
+def score_frames(frames: Sequence[Dict], detections: List[Dict], width: int, height: int,
+                 ratios: Sequence[str] = COMPOSITION_ASPECT_RATIOS,
+                 saliency: Optional[np.ndarray] = None) -> Tuple[List[Dict], Dict[str, Dict]]:
+    """
+    Score user frames of a photo, in photo pixels, all at once. Each is
+    compared with the best frame of the aspect ratio in `ratios` closest to
+    its own: "score" is its composition score as a percentage of that
+    frame's (0-100), "iou" its overlap with it and "reference" the ratio.
+    Pass the saliency map suggest_frames was given, so that its best frame
+    is the one that scores 100.
+
+    Returns the per-frame results and the best frame of each ratio.
+    """
+    grid, boxes, weights, tables = scene(detections, width, height, saliency)
+    rects = frame_array(frames, width, height)
+    raw = score_windows(grid_windows(rects, width, height, grid), tables, boxes, weights)
+
+    best = {}
+    for ratio in ratios:
+        windows, sizes = candidate_windows(parse_ratio(ratio), width, height, grid)
+        best[ratio] = top_frames(windows, sizes, score_windows(windows, tables, boxes, weights), 1,
+                                 width, height, grid)[0]
+    references = np.array([[b["x"], b["y"], b["x"] + b["width"], b["y"] + b["height"], b["score"]]
+                           for b in best.values()], dtype=np.float32)
+
+    # Closest ratio on a log scale, so 1:2 and 2:1 are as far from 1:1
+    log_ratios = np.log([parse_ratio(ratio) for ratio in ratios])
+    sides = np.maximum(rects[:, 2:] - rects[:, :2], 1)
+    nearest = np.abs(np.log(sides[:, 0] / sides[:, 1])[:, None] - log_ratios).argmin(axis=1)
+    reference = references[nearest]
+
+    percent = np.where(reference[:, 4] > 0, raw / np.maximum(reference[:, 4], 1e-6), 0)
+    percent = np.rint(np.clip(percent, 0, 1) * 100)
+    iou = rect_iou(rects, reference[:, :4])
+    results = [
+        {"score": int(p), "composition": round(float(r), 4), "iou": round(float(i), 4), "reference": ratios[n]}
+        for p, r, i, n in zip(percent, raw, iou, nearest)
+    ]
+    return results, best
+
+
+def frame_coverage(frames: Sequence[Dict], width: int, height: int) -> np.ndarray:
+    """
+    (rows, columns) uint32 counts of how many of the frames cover each cell
+    of the photo's composition grid, from a difference array in one pass.
+    """
+    grid = grid_shape(width, height)
+    columns, rows = grid
+    x0, y0, x1, y1 = grid_windows(frame_array(frames, width, height), width, height, grid).T
+    diff = np.zeros((rows + 1, columns + 1), dtype=np.int64)
+    np.add.at(diff, (y0, x0), 1)
+    np.add.at(diff, (y0, x1), -1)
+    np.add.at(diff, (y1, x0), -1)
+    np.add.at(diff, (y1, x1), 1)
+    return diff.cumsum(axis=0).cumsum(axis=1)[:rows, :columns].astype(np.uint32)
@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+"""
+Migration script to deduplicate the existing uploads directory.
+
+Every file in uploads/ is hashed. Files with identical content are collapsed
+onto a single `<sha256>.<ext>` file, posts are repointed at it and a
+PhotoBlob row is created with the number of posts that reference it.
+
+The script is safe to run while the API is serving: the canonical file is
+created next to the old ones first, the database is updated per batch, and
+duplicates are only removed after their batch is committed. Reference counts
+are recounted by the same UPDATE that stores them, after the batch's posts
+were repointed, so uploads and deletes committed meanwhile are not lost. Running it again
+is a no-op. Files that no post references are reported but left for the
+orphan collector.
+"""
+
+import argparse
+import os
+import sys
+from collections import defaultdict
+
+from sqlalchemy import func, select
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from backend import init_db, session, Post, PhotoBlob
+from storage import (
+    UPLOAD_DIR, iter_stored_photos, locate_photo, place_photo,
+    hash_file, clean_extension, discard
+)
+
+
+def scan_uploads():
+    """Hash every stored photo and group the names by digest."""
+    groups = defaultdict(list)
+    sizes = {}
+    previous = None
+    for name, path in iter_stored_photos():
+        # A file being resharded can briefly exist in both layouts
+        if name == previous:
+            continue
+        previous = name
+        digest, size = hash_file(path)
+        groups[digest].append(name)
+        sizes[digest] = size
+    return groups, sizes
+
+
+def canonical_name(digest, names):
+    """Pick the name a group of identical files should be stored under."""
+    blob = session.query(PhotoBlob).filter_by(digest=digest).first()
+    if blob is not None:
+        return blob.photo_uuid
+    for name in names:
+        if name.startswith(digest + "."):
+            return name
+    return f"{digest}.{clean_extension(names[0])}"
+
+
+def materialize(source, target, dry_run):
+    """Make sure `target` exists with the content of `source`."""
+    if locate_photo(target) or dry_run:
+        return
+    place_photo(locate_photo(source), target, link=True)
+
+
+def dedupe_uploads(batch_size=100, dry_run=False):
+    print(f"Scanning {UPLOAD_DIR}/ ...")
+    groups, sizes = scan_uploads()
+    print(f"Found {sum(len(n) for n in groups.values())} files with {len(groups)} distinct contents")
+
+    removed_files = 0
+    reclaimed_bytes = 0
+    unreferenced = 0
+    pending_removal = []
+
+    def flush():
+        nonlocal removed_files, reclaimed_bytes
+        if dry_run:
+            session.rollback()
+        else:
+            session.commit()
+        for name, size in pending_removal:
+            if not dry_run:
+                discard(locate_photo(name))
+            removed_files += 1
+            reclaimed_bytes += size
+        pending_removal.clear()
+
+    for i, (digest, names) in enumerate(groups.items(), 1):
+        canonical = canonical_name(digest, names)
+        ref_count = session.query(Post).filter(Post.photo_uuid.in_(names + [canonical])).count()
+        if ref_count == 0:
+            unreferenced += len(names)
+            continue
+
+        materialize(names[0], canonical, dry_run)
+        session.query(Post).filter(Post.photo_uuid.in_(names)).update(
+            {Post.photo_uuid: canonical}, synchronize_session=False
+        )
+
+        if session.query(PhotoBlob).filter_by(digest=digest).first() is None:
+            session.add(PhotoBlob(digest=digest, photo_uuid=canonical, size=sizes[digest], ref_count=0))
+            session.flush()
+        # Counted in the UPDATE itself, which runs under the write lock the
+        # repointing above took, rather than from the count read earlier
+        references = select(func.count()).select_from(Post).where(Post.photo_uuid == canonical).scalar_subquery()
+        session.query(PhotoBlob).filter_by(digest=digest).update(
+            {PhotoBlob.ref_count: references}, synchronize_session=False
+        )
+
+        pending_removal.extend((name, sizes[digest]) for name in names if name != canonical)
+
+        if i % batch_size == 0:
+            flush()
+            print(f"Processed {i}/{len(groups)} distinct files")
+
+    flush()
+
+    verb = "Would remove" if dry_run else "Removed"
+    print(f"{verb} {removed_files} duplicate files, reclaiming {reclaimed_bytes} bytes")
+    if unreferenced:
+        print(f"{unreferenced} files are not referenced by any post and were left in place")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Deduplicate the uploads directory")
+    parser.add_argument("--batch-size", type=int, default=100, help="Distinct files per database commit")
+    parser.add_argument("--dry-run", action="store_true", help="Report what would change without touching anything")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    init_db()
+    dedupe_uploads(batch_size=args.batch_size, dry_run=args.dry_run)
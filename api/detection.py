@@ -0,0 +1,356 @@
+"""
+YOLO object detection for the AI page.
+
+Decoding, inference, drawing and encoding are CPU-bound and would freeze the
+event loop if run inside the request handler. They are plain synchronous
+functions in vision.py, and InferencePool runs them on a dedicated thread or
+process pool with a bounded number of pending jobs, so feed, photo and login
+requests keep flowing while an image is analyzed.
+
+vision.py imports OpenCV and NumPy and is only imported by pool workers, so
+importing this module is cheap. warm_up() loads the model in the background
+at startup; model_state tracks whether it is ready for readiness probes.
+
+Concurrent requests are micro-batched: BatchScheduler collects uploads for up
+to INFERENCE_BATCH_WAIT_MS or INFERENCE_BATCH_SIZE images, and a single pool
+job decodes them, letterboxes them to a common INFERENCE_IMGSZ square, runs
+one batched forward pass and renders each response. Only the uploaded bytes
+and finished responses cross the executor boundary.
+
+With INFERENCE_SOCKET set, every API worker sends its batches to a single
+inference server process (inference_server.py) through InferenceClient, so
+torch and the model are loaded once per machine rather than once per worker.
+"""
+
+import asyncio
+import base64
+import contextlib
+import contextvars
+import json
+import logging
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from multiprocessing import shared_memory
+from typing import Dict, List, Optional, Union
+
+from image_probe import ImageInfo
+from logs import setup_logging
+
+from settings import (
+    INFERENCE_EXECUTOR, INFERENCE_WORKERS, INFERENCE_TORCH_THREADS,
+    INFERENCE_QUEUE_SIZE, INFERENCE_BATCH_SIZE, INFERENCE_BATCH_WAIT_MS,
+    INFERENCE_SOCKET, INFERENCE_MESSAGE_LIMIT, INFERENCE_SERVER_TIMEOUT
+)
+
+
+logger = logging.getLogger(__name__)
+
+# "full": boxes drawn on the image, base64 in the JSON (the default)
+# "boxes": detections only, no image work at all
+# "preview": a downscaled boxed image
+# "binary": the full boxed image as a separate JPEG part
+DETECTION_MODES = ("full", "boxes", "preview", "binary")
+# Not offered to clients: "boxes" plus the saliency grid the frames were
+# scored with, so a post's later frame scoring uses the same map
+POST_MODE = "post"
+
+
+class DetectionError(Exception):
+    """An error to report to the client with the given HTTP status."""
+
+    def __init__(self, status_code: int, detail: str):
+        super().__init__(status_code, detail)
+        self.status_code = status_code
+        self.detail = detail
+
+
+class QueueFull(Exception):
+    pass
+
+
+# The pipeline lives in vision.py, which imports OpenCV and NumPy. These
+# wrappers are what the pool runs, so only worker threads/processes import it.
+
+def init_worker(torch_threads: int = INFERENCE_TORCH_THREADS):
+    # Worker processes log through their own queue and listener
+    setup_logging()
+    from vision import init_worker
+    init_worker(torch_threads)
+
+
+def warm_up():
+    from vision import warm_up
+    warm_up()
+
+
+def run_detection_batch(uploads: List[bytes], modes: List[str],
+                        infos: Optional[List[Optional[ImageInfo]]] = None) -> List[Union[Dict, DetectionError]]:
+    from vision import run_detection_batch
+    return run_detection_batch(uploads, modes, infos)
+
+
+class InferencePool:
+    """
+    Executor for detection work, each worker with its own model.
+
+    It does not limit its backlog itself: requests reach it through a
+    BatchScheduler, which turns images away with QueueFull once too many are
+    waiting.
+    """
+
+    def __init__(self, kind: str = INFERENCE_EXECUTOR, workers: int = INFERENCE_WORKERS,
+                 torch_threads: int = INFERENCE_TORCH_THREADS):
+        self.kind = kind
+        self.workers = workers
+        self.torch_threads = torch_threads
+        # "unloaded", "loading", "ready" or "failed"
+        self.model_state = "unloaded"
+        self.model_error = None
+        self._executor = None
+
+    @property
+    def executor(self):
+        if self._executor is None:
+            executor_class = ProcessPoolExecutor if self.kind == "process" else ThreadPoolExecutor
+            self._executor = executor_class(
+                max_workers=self.workers,
+                initializer=init_worker,
+                initargs=(self.torch_threads,),
+            )
+        return self._executor
+
+    async def run(self, fn, *args):
+        loop = asyncio.get_running_loop()
+        if self.kind == "process":
+            return await loop.run_in_executor(self.executor, fn, *args)
+        # Threads run in a copy of the caller's context, so they log its request ID
+        return await loop.run_in_executor(self.executor, contextvars.copy_context().run, fn, *args)
+
+    async def detect_batch(self, uploads: List[bytes], modes: List[str],
+                           infos: Optional[List[Optional[ImageInfo]]] = None) -> List[Union[Dict, Exception]]:
+        return await self.run(run_detection_batch, uploads, modes, infos)
+
+    async def warm_up(self):
+        """Load the model in every worker without blocking startup."""
+        if self.model_state == "ready":
+            return
+        self.model_state = "loading"
+        try:
+            # One job per worker; each blocks its worker until its model is loaded
+            await asyncio.gather(*[self.run(warm_up) for _ in range(self.workers)])
+        except Exception as e:
+            logger.error("Error warming up the YOLOv8 model: %s", e)
+            self.model_failed(e)
+        else:
+            self.model_state = "ready"
+
+    def model_failed(self, error: Exception):
+        self.model_state = "failed"
+        self.model_error = getattr(error, "detail", None) or str(error)
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+class BatchScheduler:
+    """
+    Groups concurrent detection requests into batches.
+
+    A batch is dispatched to the pool as soon as it holds `max_batch` images
+    or `max_wait_ms` after its first image arrived, whichever comes first.
+    At most `queue_size` images may be waiting or in flight; detect() raises
+    QueueFull beyond that.
+    """
+
+    def __init__(self, pool: Union[InferencePool, "InferenceClient"], max_batch: int = INFERENCE_BATCH_SIZE,
+                 max_wait_ms: float = INFERENCE_BATCH_WAIT_MS, queue_size: int = INFERENCE_QUEUE_SIZE):
+        self.pool = pool
+        self.max_batch = max(1, max_batch)
+        self.max_wait = max_wait_ms / 1000
+        self.queue_size = queue_size
+        self.pending = 0
+        self._waiting = []
+        self._timer = None
+
+    async def detect(self, contents: bytes, mode: str = "full", info: Optional[ImageInfo] = None) -> Dict:
+        """
+        Queue an uploaded image and return its detect-objects response body
+        in the given mode (one of DETECTION_MODES). `info` is the image's
+        probed header (see image_probe.check_image), if the caller has it.
+        """
+        if self.pending >= self.queue_size:
+            raise QueueFull()
+        self.pending += 1
+        try:
+            future = asyncio.get_running_loop().create_future()
+            self._waiting.append((contents, mode, info, future))
+            if len(self._waiting) >= self.max_batch:
+                self._flush()
+            elif self._timer is None:
+                self._timer = asyncio.get_running_loop().call_later(self.max_wait, self._flush)
+            result = await future
+        finally:
+            self.pending -= 1
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._waiting = self._waiting[:self.max_batch], self._waiting[self.max_batch:]
+        if self._waiting:
+            self._timer = asyncio.get_running_loop().call_later(self.max_wait, self._flush)
+        if batch:
+            asyncio.ensure_future(self._run(batch))
+
+    async def _run(self, batch):
+        if self.pool.model_state == "unloaded":
+            self.pool.model_state = "loading"
+        try:
+            results = await self.pool.detect_batch(
+                [contents for contents, _, _, _ in batch], [mode for _, mode, _, _ in batch],
+                [info for _, _, info, _ in batch]
+            )
+        except Exception as e:
+            # A DetectionError here is the inference server being slow or
+            # unreachable: it fails these requests, not the model
+            if not isinstance(e, (QueueFull, DetectionError)):
+                self.pool.model_failed(e)
+            for *_, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        if any(not isinstance(result, Exception) for result in results):
+            self.pool.model_state = "ready"
+            self.pool.model_error = None
+        for (*_, future), result in zip(batch, results):
+            if not future.done():
+                future.set_result(result)
+
+
+def attach_shared_memory(name: str) -> shared_memory.SharedMemory:
+    """
+    Open a segment created by another process. Python < 3.13 registers it
+    with this process's resource tracker, which would unlink it at exit;
+    its creator is responsible for that.
+    """
+    segment = shared_memory.SharedMemory(name=name)
+    with contextlib.suppress(Exception):
+        from multiprocessing import resource_tracker
+        resource_tracker.unregister(segment._name, "shared_memory")
+    return segment
+
+
+def encode_result(result: Union[Dict, Exception]) -> Dict:
+    """A detection result as sent by the inference server."""
+    if isinstance(result, QueueFull):
+        return {"error": {"queue_full": True}}
+    if isinstance(result, DetectionError):
+        return {"error": {"status_code": result.status_code, "detail": result.detail}}
+    if isinstance(result, Exception):
+        return {"error": {"status_code": 500, "detail": f"Image processing error: {str(result)}"}}
+    if "boxed_jpeg" in result:
+        result = dict(result, boxed_jpeg=base64.b64encode(result["boxed_jpeg"]).decode("ascii"))
+    return {"result": result}
+
+
+def decode_result(message: Dict) -> Union[Dict, Exception]:
+    error = message.get("error")
+    if error is None:
+        result = message["result"]
+        if "boxed_jpeg" in result:
+            result["boxed_jpeg"] = base64.b64decode(result["boxed_jpeg"])
+        return result
+    if error.get("queue_full"):
+        return QueueFull()
+    return DetectionError(error["status_code"], error["detail"])
+
+
+class InferenceClient:
+    """
+    Sends detection batches to the shared inference server
+    (inference_server.py) instead of running a model in this process.
+
+    The uploads of a batch are copied once into a shared-memory segment that
+    the server decodes from directly; only a small JSON header crosses the
+    Unix socket, and the response bodies come back over it. Provides the
+    parts of InferencePool's interface the API uses.
+    """
+
+    def __init__(self, socket_path: str = INFERENCE_SOCKET, workers: int = INFERENCE_WORKERS):
+        self.socket_path = socket_path
+        self.workers = workers
+        self.model_state = "unloaded"
+        self.model_error = None
+
+    async def _request(self, header: Dict) -> Dict:
+        try:
+            reader, writer = await asyncio.open_unix_connection(self.socket_path, limit=INFERENCE_MESSAGE_LIMIT)
+        except OSError as e:
+            logger.warning("Inference server unavailable at %s: %s", self.socket_path, e)
+            raise DetectionError(503, "Image analysis is temporarily unavailable. Please try again later.")
+        try:
+            line = await asyncio.wait_for(self._exchange(reader, writer, header), INFERENCE_SERVER_TIMEOUT)
+        except asyncio.TimeoutError:
+            logger.warning("Inference server at %s did not reply within %ss", self.socket_path,
+                           INFERENCE_SERVER_TIMEOUT)
+            raise DetectionError(503, "Image analysis is temporarily unavailable. Please try again later.")
+        finally:
+            writer.close()
+        if not line:
+            raise DetectionError(503, "Image analysis is temporarily unavailable. Please try again later.")
+        return json.loads(line)
+
+    @staticmethod
+    async def _exchange(reader: asyncio.StreamReader, writer: asyncio.StreamWriter, header: Dict) -> bytes:
+        writer.write(json.dumps(header).encode() + b"\n")
+        await writer.drain()
+        return await reader.readline()
+
+    async def detect_batch(self, uploads: List[bytes], modes: List[str],
+                           infos: Optional[List[Optional[ImageInfo]]] = None) -> List[Union[Dict, Exception]]:
+        segment = shared_memory.SharedMemory(create=True, size=max(1, sum(len(u) for u in uploads)))
+        try:
+            offset = 0
+            for contents in uploads:
+                segment.buf[offset:offset + len(contents)] = contents
+                offset += len(contents)
+            reply = await self._request({
+                "op": "detect",
+                "shm": segment.name,
+                "sizes": [len(contents) for contents in uploads],
+                "modes": modes,
+                "infos": infos and [info and list(info) for info in infos],
+            })
+        finally:
+            segment.close()
+            segment.unlink()
+        return [decode_result(message) for message in reply["results"]]
+
+    async def warm_up(self):
+        """Follow the server's model state until its model is ready."""
+        while True:
+            try:
+                status = await self._request({"op": "status"})
+                self.model_state = status["model"]
+                self.model_error = status["model_error"]
+            except (DetectionError, OSError, ValueError) as e:
+                self.model_failed(e)
+            if self.model_state == "ready":
+                return
+            await asyncio.sleep(1)
+
+    def model_failed(self, error: Exception):
+        self.model_state = "failed"
+        self.model_error = getattr(error, "detail", None) or str(error)
+
+    def shutdown(self):
+        pass
+
+
+# Workers share one model through the inference server when it is configured
+inference_pool = InferenceClient() if INFERENCE_SOCKET else InferencePool()
+batch_scheduler = BatchScheduler(inference_pool)
@@ -0,0 +1,258 @@
+"""
+Cache of detect-objects responses keyed by the content of the upload.
+
+Tutorial scenes and re-uploads send the same bytes over and over, and every
+time the full pipeline (decode, inference, drawing, JPEG and base64
+encoding) would run again. Responses are cached under the sha256 of the
+upload combined with everything that changes the output: the backend and
+model file, the inference and decode sizes, the framing settings, the
+response mode and DETECTION_CACHE_VERSION, which is bumped whenever the
+pipeline's output changes.
+
+Entries are the serialized response bodies, so a hit is returned without
+re-encoding. They live in a memory LRU bounded in bytes and, when
+DETECTION_CACHE_DIR is set, in files shared by all API workers and kept
+across restarts. Concurrent misses for the same key wait for a single
+computation, which runs as its own task: a caller that is cancelled stops
+waiting for it without affecting the others, and it is only cancelled once
+nobody is waiting any more.
+"""
+
+import asyncio
+import contextlib
+import hashlib
+import logging
+import os
+import struct
+import tempfile
+import threading
+import zlib
+from collections import OrderedDict
+from typing import Awaitable, Callable, Optional
+
+from settings import (
+    YOLO_MODEL_PATH, INFERENCE_BACKEND, INFERENCE_ONNX_PATH, INFERENCE_IMGSZ, INFERENCE_DECODE_SIZE,
+    DETECTION_PREVIEW_SIZE, DETECTION_PREVIEW_QUALITY, COMPOSITION_ASPECT_RATIOS, COMPOSITION_TOP_K,
+    COMPOSITION_GRID, COMPOSITION_SCALES, COMPOSITION_MIN_SCALE, COMPOSITION_SALIENCY_WEIGHT,
+    DETECTION_CACHE_VERSION,
+    DETECTION_CACHE_MAX_BYTES, DETECTION_CACHE_DIR, DETECTION_CACHE_DISK_MAX_BYTES
+)
+
+logger = logging.getLogger(__name__)
+
+# Disk entries start with a magic number, the body's length and its CRC-32,
+# so a damaged file is noticed and treated as a miss
+DISK_HEADER = struct.Struct("<4sII")
+DISK_MAGIC = b"FDC1"
+
+
+def config_version() -> str:
+    model = YOLO_MODEL_PATH if INFERENCE_BACKEND == "torch" else INFERENCE_ONNX_PATH
+    return (f"{DETECTION_CACHE_VERSION}:{INFERENCE_BACKEND}:{os.path.basename(model)}:"
+            f"{INFERENCE_IMGSZ}:{INFERENCE_DECODE_SIZE}:"
+            f"{DETECTION_PREVIEW_SIZE}:{DETECTION_PREVIEW_QUALITY}:"
+            f"{','.join(COMPOSITION_ASPECT_RATIOS)}:{COMPOSITION_TOP_K}:{COMPOSITION_GRID}:"
+            f"{COMPOSITION_SCALES}:{COMPOSITION_MIN_SCALE}:{COMPOSITION_SALIENCY_WEIGHT}")
+
+
+def cache_key(contents: bytes, mode: str = "full", version: Optional[str] = None) -> str:
+    """Key of the response to `contents` in the given response mode."""
+    digest = hashlib.sha256(contents)
+    digest.update(f"\0{version or config_version()}\0{mode}".encode())
+    return digest.hexdigest()
+
+
+class DetectionCache:
+    """Two-tier cache of serialized detect-objects responses with hit counters."""
+
+    def __init__(self, max_bytes: int = DETECTION_CACHE_MAX_BYTES, directory: Optional[str] = DETECTION_CACHE_DIR,
+                 disk_max_bytes: int = DETECTION_CACHE_DISK_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.directory = directory
+        self.disk_max_bytes = disk_max_bytes
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        # Key -> [task computing it, number of callers waiting for it]
+        self._inflight = {}
+        self._disk_writes = 0
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.coalesced = 0
+        self.misses = 0
+
+    # Memory tier
+
+    def _get_memory(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            body = self._entries.get(key)
+            if body is not None:
+                self._entries.move_to_end(key)
+            return body
+
+    def _put_memory(self, key: str, body: bytes) -> None:
+        if len(body) > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._bytes -= len(previous)
+            self._entries[key] = body
+            self._bytes += len(body)
+            while self._bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= len(evicted)
+
+    # Disk tier
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], f"{key}.body")
+
+    def _get_disk(self, key: str) -> Optional[bytes]:
+        """The body stored for `key`, or None if there is none or it can't be read back intact."""
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            return None
+        except OSError as e:
+            logger.warning("Error reading detection cache entry %s: %s", key, e)
+            return None
+        if len(data) >= DISK_HEADER.size:
+            magic, length, crc = DISK_HEADER.unpack_from(data)
+            body = data[DISK_HEADER.size:]
+            if magic == DISK_MAGIC and length == len(body) and crc == zlib.crc32(body):
+                return body
+        logger.warning("Discarding corrupt detection cache entry %s", key)
+        with contextlib.suppress(OSError):
+            os.remove(path)
+        return None
+
+    def _put_disk(self, key: str, body: bytes) -> None:
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(DISK_HEADER.pack(DISK_MAGIC, len(body), zlib.crc32(body)))
+                f.write(body)
+            os.replace(tmp_path, path)
+        except BaseException:
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(tmp_path)
+            raise
+        self._disk_writes += 1
+        if self._disk_writes % 100 == 0:
+            self.prune_disk()
+
+    def prune_disk(self) -> int:
+        """Remove the least recently written files beyond disk_max_bytes. Returns bytes freed."""
+        if not self.directory or not os.path.isdir(self.directory):
+            return 0
+        files = []
+        for root, _, names in os.walk(self.directory):
+            for name in names:
+                path = os.path.join(root, name)
+                with contextlib.suppress(FileNotFoundError):
+                    st = os.stat(path)
+                    files.append((st.st_mtime, st.st_size, path))
+        total = sum(size for _, size, _ in files)
+        freed = 0
+        for _, size, path in sorted(files):
+            if total - freed <= self.disk_max_bytes:
+                break
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(path)
+                freed += size
+        return freed
+
+    # Lookup
+
+    async def get(self, key: str) -> Optional[bytes]:
+        body = self._get_memory(key)
+        if body is not None:
+            self.memory_hits += 1
+            return body
+        return await self._get_disk_async(key)
+
+    async def _get_disk_async(self, key: str) -> Optional[bytes]:
+        if not self.directory:
+            return None
+        body = await asyncio.to_thread(self._get_disk, key)
+        if body is not None:
+            self.disk_hits += 1
+            self._put_memory(key, body)
+        return body
+
+    async def put(self, key: str, body: bytes) -> None:
+        self._put_memory(key, body)
+        if self.directory:
+            try:
+                await asyncio.to_thread(self._put_disk, key, body)
+            except OSError as e:
+                logger.warning("Error writing detection cache entry: %s", e)
+
+    async def get_or_compute(self, key: str, compute: Callable[[], Awaitable[bytes]]) -> bytes:
+        """
+        The cached body for `key`, or the result of `compute()`, which is
+        then cached. Callers asking for a key that is being computed share
+        the result; errors are not cached.
+        """
+        body = self._get_memory(key)
+        if body is not None:
+            self.memory_hits += 1
+            return body
+        inflight = self._inflight.get(key)
+        if inflight is None:
+            task = asyncio.ensure_future(self._compute(key, compute))
+            inflight = self._inflight[key] = [task, 0]
+            task.add_done_callback(lambda done: self._finished(key, done))
+        else:
+            self.coalesced += 1
+        task = inflight[0]
+        inflight[1] += 1
+        try:
+            # Shielded, so cancelling one caller doesn't cancel the others
+            return await asyncio.shield(task)
+        finally:
+            inflight[1] -= 1
+            if inflight[1] == 0 and not task.done():
+                # Everybody gave up waiting
+                task.cancel()
+
+    async def _compute(self, key: str, compute: Callable[[], Awaitable[bytes]]) -> bytes:
+        body = await self._get_disk_async(key)
+        if body is None:
+            self.misses += 1
+            body = await compute()
+            await self.put(key, body)
+        return body
+
+    def _finished(self, key: str, task: asyncio.Future) -> None:
+        if self._inflight.get(key, [None])[0] is task:
+            del self._inflight[key]
+        if not task.cancelled():
+            # Mark a failure as seen even if every caller was cancelled before it
+            task.exception()
+
+    def stats(self) -> dict:
+        hits = self.memory_hits + self.disk_hits + self.coalesced
+        lookups = hits + self.misses
+        return {
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "coalesced": self.coalesced,
+            "misses": self.misses,
+            "hit_rate": hits / lookups if lookups else 0.0,
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+        }
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+
+detection_cache = DetectionCache()
@@ -0,0 +1,355 @@
+"""
+Read image dimensions from file headers without decoding any pixels.
+
+The decoder needs to know how large an upload is before choosing how far to
+reduce it, and a 48 MP phone photo shouldn't be decoded just to find out.
+Neither should a small file that would decode to a gigapixel image:
+check_image rejects uploads over the IMAGE_MAX_* limits before any decoder
+sees them, and the ImageInfo it returns is passed on so the pipeline doesn't
+parse the header again.
+
+JPEG, PNG (including APNG frame counts), WebP, GIF, TIFF and BMP are
+understood. Only the bytes up to the frame header are looked at, except for
+animated WebP and GIF, whose frames are counted by skipping from chunk to
+chunk, and multi-page TIFF, whose pages are counted from directory to
+directory. HEIC and AVIF uploads are recognized only to be refused by name:
+neither OpenCV nor Pillow can decode them here, and most browsers can't
+display them.
+"""
+
+import mmap
+import os
+from typing import NamedTuple, Optional, Tuple
+
+from settings import IMAGE_MAX_BYTES, IMAGE_MAX_PIXELS, IMAGE_MAX_FRAMES
+
+ORIENTATION_TAG = 0x0112
+# EXIF orientations that swap width and height when applied
+TRANSPOSED_ORIENTATIONS = {5, 6, 7, 8}
+# Start-of-frame markers; C4, C8 and CC share the range but aren't frames
+SOF_MARKERS = set(range(0xC0, 0xD0)) - {0xC4, 0xC8, 0xCC}
+# Markers without a length field
+STANDALONE_MARKERS = {0x01} | set(range(0xD0, 0xD8))
+
+# Leading bytes of the formats probe() understands
+SIGNATURES = (b"\xff\xd8", b"\x89PNG\r\n\x1a\n", b"RIFF", b"GIF8", b"II*\0", b"MM\0*", b"BM")
+SUPPORTED_FORMATS = "JPEG, PNG, WebP, GIF, TIFF or BMP"
+# ISO base media file type brands of formats we recognize but can't decode,
+# most specific first: AVIF files often list the generic HEIF brands too
+UNSUPPORTED_BRANDS = (
+    ("AVIF", {b"avif", b"avis"}),
+    ("HEIC", {b"heic", b"heix", b"heim", b"heis", b"hevc", b"hevx"}),
+    ("HEIF", {b"mif1", b"msf1"}),
+)
+
+TIFF_WIDTH, TIFF_HEIGHT = 0x0100, 0x0101
+TIFF_TAGS = {TIFF_WIDTH, TIFF_HEIGHT, ORIENTATION_TAG}
+# Pages counted before giving up on a directory chain
+TIFF_MAX_PAGES = 10_000
+
+
+def exif_orientation(tiff) -> int:
+    """The orientation tag of an EXIF (TIFF) block, 1 if absent or unreadable."""
+    if len(tiff) < 8:
+        return 1
+    order = "little" if bytes(tiff[:2]) == b"II" else "big"
+    offset = int.from_bytes(tiff[4:8], order)
+    if offset + 2 > len(tiff):
+        return 1
+    for i in range(int.from_bytes(tiff[offset:offset + 2], order)):
+        entry = offset + 2 + 12 * i
+        if entry + 12 > len(tiff):
+            break
+        if int.from_bytes(tiff[entry:entry + 2], order) == ORIENTATION_TAG:
+            # A single SHORT, stored in the first half of the value field
+            return int.from_bytes(tiff[entry + 8:entry + 10], order)
+    return 1
+
+
+def read_jpeg_header(data) -> Optional[Tuple[int, int, int]]:
+    """
+    (width, height, EXIF orientation) of a JPEG as stored, or None if `data`
+    isn't a JPEG or its header is truncated. Accepts bytes or a memoryview.
+    """
+    if bytes(data[:2]) != b"\xff\xd8":
+        return None
+    orientation = 1
+    pos = 2
+    while pos + 4 <= len(data):
+        if data[pos] != 0xFF:
+            return None
+        marker = data[pos + 1]
+        if marker == 0xFF:
+            # Fill byte before a marker
+            pos += 1
+            continue
+        if marker in STANDALONE_MARKERS:
+            pos += 2
+            continue
+        length = int.from_bytes(data[pos + 2:pos + 4], "big")
+        segment = data[pos + 4:pos + 2 + length]
+        if marker == 0xE1 and bytes(segment[:6]) == b"Exif\0\0":
+            orientation = exif_orientation(segment[6:])
+        elif marker in SOF_MARKERS:
+            if len(segment) < 5:
+                return None
+            height = int.from_bytes(segment[1:3], "big")
+            width = int.from_bytes(segment[3:5], "big")
+            return width, height, orientation
+        elif marker == 0xDA:
+            # Start of scan without a frame header
+            return None
+        pos += 2 + length
+    return None
+
+
+def displayed_size(width: int, height: int, orientation: int) -> Tuple[int, int]:
+    """(width, height) after applying an EXIF orientation."""
+    if orientation in TRANSPOSED_ORIENTATIONS:
+        return height, width
+    return width, height
+
+
+class ImageInfo(NamedTuple):
+    format: str  # "jpeg", "png", "webp", "gif", "tiff" or "bmp"
+    width: int  # As stored, before the EXIF orientation is applied
+    height: int
+    orientation: int = 1
+    frames: int = 1
+
+    @property
+    def display_size(self) -> Tuple[int, int]:
+        return displayed_size(self.width, self.height, self.orientation)
+
+
+def read_png_header(data) -> Optional[Tuple[int, int, int]]:
+    """(width, height, frames) of a PNG or APNG, or None if it isn't one."""
+    if bytes(data[:8]) != b"\x89PNG\r\n\x1a\n" or bytes(data[12:16]) != b"IHDR" or len(data) < 24:
+        return None
+    width = int.from_bytes(data[16:20], "big")
+    height = int.from_bytes(data[20:24], "big")
+    # An animation control chunk, if any, comes before the image data
+    pos = 8
+    while pos + 12 <= len(data):
+        length = int.from_bytes(data[pos:pos + 4], "big")
+        kind = bytes(data[pos + 4:pos + 8])
+        if kind == b"acTL":
+            return width, height, int.from_bytes(data[pos + 8:pos + 12], "big")
+        if kind in (b"IDAT", b"IEND"):
+            break
+        pos += 12 + length
+    return width, height, 1
+
+
+def read_webp_header(data) -> Optional[Tuple[int, int, int, int]]:
+    """(width, height, EXIF orientation, frames) of a WebP, or None if it isn't one."""
+    if bytes(data[:4]) != b"RIFF" or bytes(data[8:12]) != b"WEBP" or len(data) < 30:
+        return None
+    kind = bytes(data[12:16])
+    payload = data[20:]
+    if kind == b"VP8 ":
+        # Lossy: 3-byte frame tag, start code, then 14-bit dimensions
+        if bytes(payload[3:6]) != b"\x9d\x01\x2a":
+            return None
+        width = int.from_bytes(payload[6:8], "little") & 0x3FFF
+        height = int.from_bytes(payload[8:10], "little") & 0x3FFF
+        return width, height, 1, 1
+    if kind == b"VP8L":
+        # Lossless: signature byte, then 14-bit width - 1 and height - 1
+        if payload[0] != 0x2F:
+            return None
+        bits = int.from_bytes(payload[1:5], "little")
+        return (bits & 0x3FFF) + 1, ((bits >> 14) & 0x3FFF) + 1, 1, 1
+    if kind != b"VP8X":
+        return None
+
+    # Extended: canvas size, then chunks for animation frames and EXIF
+    width = int.from_bytes(payload[4:7], "little") + 1
+    height = int.from_bytes(payload[7:10], "little") + 1
+    orientation, frames = 1, 0
+    pos = 12
+    while pos + 8 <= len(data):
+        kind = bytes(data[pos:pos + 4])
+        length = int.from_bytes(data[pos + 4:pos + 8], "little")
+        if kind == b"ANMF":
+            frames += 1
+        elif kind == b"EXIF":
+            exif = data[pos + 8:pos + 8 + length]
+            if bytes(exif[:6]) == b"Exif\0\0":
+                exif = exif[6:]
+            orientation = exif_orientation(exif)
+        # Chunks are padded to an even length
+        pos += 8 + length + (length & 1)
+    return width, height, orientation, max(frames, 1)
+
+
+def skip_gif_blocks(data, pos: int) -> int:
+    """Position after a sequence of GIF data sub-blocks starting at `pos`."""
+    while pos < len(data):
+        size = data[pos]
+        pos += 1 + size
+        if size == 0:
+            break
+    return pos
+
+
+def read_gif_header(data) -> Optional[Tuple[int, int, int]]:
+    """(width, height, frames) of a GIF, or None if it isn't one."""
+    if bytes(data[:6]) not in (b"GIF87a", b"GIF89a") or len(data) < 13:
+        return None
+    width = int.from_bytes(data[6:8], "little")
+    height = int.from_bytes(data[8:10], "little")
+    pos = 13
+    if data[10] & 0x80:
+        pos += 3 << ((data[10] & 0x07) + 1)
+    frames = 0
+    while pos < len(data):
+        block = data[pos]
+        if block == 0x2C:
+            # Image descriptor, optional local color table, LZW code size, image data
+            frames += 1
+            if pos + 10 > len(data):
+                break
+            flags = data[pos + 9]
+            pos += 10
+            if flags & 0x80:
+                pos += 3 << ((flags & 0x07) + 1)
+            pos = skip_gif_blocks(data, pos + 1)
+        elif block == 0x21:
+            pos = skip_gif_blocks(data, pos + 2)
+        else:
+            # Trailer, or something we don't understand
+            break
+    return width, height, max(frames, 1)
+
+
+def read_tiff_header(data) -> Optional[Tuple[int, int, int, int]]:
+    """(width, height, orientation, pages) of a TIFF, or None if it isn't one or is truncated."""
+    if bytes(data[:4]) not in (b"II*\0", b"MM\0*") or len(data) < 8:
+        return None
+    order = "little" if bytes(data[:2]) == b"II" else "big"
+    offset = int.from_bytes(data[4:8], order)
+    tags = {}
+    pages = 0
+    # Follow the chain of image directories, one per page; bounded against loops
+    while offset and offset + 2 <= len(data) and pages < TIFF_MAX_PAGES:
+        count = int.from_bytes(data[offset:offset + 2], order)
+        end = offset + 2 + 12 * count
+        if end + 4 > len(data):
+            break
+        if pages == 0:
+            for entry in range(offset + 2, end, 12):
+                tag = int.from_bytes(data[entry:entry + 2], order)
+                if tag in TIFF_TAGS:
+                    kind = int.from_bytes(data[entry + 2:entry + 4], order)
+                    # A SHORT is stored in the first half of the value field, a LONG in all of it
+                    size = 2 if kind == 3 else 4
+                    tags[tag] = int.from_bytes(data[entry + 8:entry + 8 + size], order)
+        pages += 1
+        offset = int.from_bytes(data[end:end + 4], order)
+    if TIFF_WIDTH not in tags or TIFF_HEIGHT not in tags:
+        return None
+    return tags[TIFF_WIDTH], tags[TIFF_HEIGHT], tags.get(ORIENTATION_TAG, 1), pages
+
+
+def read_bmp_header(data) -> Optional[Tuple[int, int]]:
+    """(width, height) of a BMP, or None if it isn't one."""
+    if bytes(data[:2]) != b"BM" or len(data) < 26:
+        return None
+    header_size = int.from_bytes(data[14:18], "little")
+    if header_size == 12:
+        # OS/2 BITMAPCOREHEADER: 16-bit dimensions
+        return int.from_bytes(data[18:20], "little"), int.from_bytes(data[20:22], "little")
+    # A negative height means the rows are stored top-down
+    width = int.from_bytes(data[18:22], "little", signed=True)
+    height = int.from_bytes(data[22:26], "little", signed=True)
+    return abs(width), abs(height)
+
+
+def unsupported_format(data) -> Optional[str]:
+    """Name of a known image format we can't handle (AVIF, HEIC, HEIF), or None."""
+    if bytes(data[4:8]) != b"ftyp":
+        return None
+    # Major brand, minor version, then compatible brands up to the end of the box
+    box = bytes(data[8:min(int.from_bytes(data[:4], "big"), 256)])
+    brands = {box[i:i + 4] for i in range(0, len(box) - 3, 4)}
+    for name, family in UNSUPPORTED_BRANDS:
+        if brands & family:
+            return name
+    return None
+
+
+def probe(data) -> Optional[ImageInfo]:
+    """Format, dimensions, orientation and frame count of an image, or None if unrecognized or truncated."""
+    header = read_jpeg_header(data)
+    if header is not None:
+        return ImageInfo("jpeg", *header)
+    header = read_png_header(data)
+    if header is not None:
+        width, height, frames = header
+        return ImageInfo("png", width, height, 1, frames)
+    header = read_webp_header(data)
+    if header is not None:
+        return ImageInfo("webp", *header)
+    header = read_gif_header(data)
+    if header is not None:
+        width, height, frames = header
+        return ImageInfo("gif", width, height, 1, frames)
+    header = read_tiff_header(data)
+    if header is not None:
+        return ImageInfo("tiff", *header)
+    header = read_bmp_header(data)
+    if header is not None:
+        return ImageInfo("bmp", *header)
+    return None
+
+
+class ImageRejected(Exception):
+    """An upload refused before decoding, with the HTTP status to answer."""
+
+    def __init__(self, status_code: int, detail: str):
+        super().__init__(status_code, detail)
+        self.status_code = status_code
+        self.detail = detail
+
+
+def check_image(data, size: Optional[int] = None, max_pixels: int = IMAGE_MAX_PIXELS,
+                max_bytes: int = IMAGE_MAX_BYTES, max_frames: int = IMAGE_MAX_FRAMES) -> ImageInfo:
+    """
+    Probe an upload and enforce the limits on its size in bytes (`size`, or
+    the length of `data` if only a header prefix is given), pixels over all
+    frames and number of frames. Raises ImageRejected.
+    """
+    size = len(data) if size is None else size
+    if size > max_bytes:
+        raise ImageRejected(413, f"Image is larger than {max_bytes // (1024 * 1024)} MB")
+    if size == 0:
+        raise ImageRejected(400, "The image file is empty.")
+    info = probe(data)
+    if info is None:
+        unsupported = unsupported_format(data)
+        if unsupported is not None:
+            raise ImageRejected(415, f"{unsupported} images are not supported. Please use a {SUPPORTED_FORMATS} image.")
+        if any(bytes(data[:len(signature)]) == signature for signature in SIGNATURES):
+            raise ImageRejected(400, "The image is damaged or truncated.")
+        raise ImageRejected(415, f"Unsupported image format. Please use a {SUPPORTED_FORMATS} image.")
+    if info.width == 0 or info.height == 0:
+        raise ImageRejected(400, "Image has no pixels")
+    if info.frames > max_frames:
+        raise ImageRejected(400, f"Images with more than {max_frames} frames are not supported")
+    if info.width * info.height * info.frames > max_pixels:
+        raise ImageRejected(
+            413, f"Image is too large ({info.width}x{info.height}"
+                 f"{f' x {info.frames} frames' if info.frames > 1 else ''}); "
+                 f"the limit is {max_pixels // 1_000_000} megapixels"
+        )
+    return info
+
+
+def check_file(path: str) -> ImageInfo:
+    """check_image for a file on disk, mapped rather than read into memory."""
+    size = os.path.getsize(path)
+    if size == 0 or size > IMAGE_MAX_BYTES:
+        return check_image(b"", size)
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        return check_image(data, size)
@@ -0,0 +1,289 @@
+#!/usr/bin/env python3
+"""
+Inference backends for YOLO detection.
+
+All backends take letterboxed BGR canvases and return, per image, the boxes
+(x1, y1, x2, y2 in canvas pixels), confidences and class ids as NumPy
+arrays, plus the class names, so vision.py maps and formats their output the
+same way whichever one runs.
+
+- "torch": the ultralytics model at YOLO_MODEL_PATH.
+- "onnxruntime" / "openvino": the same network exported to ONNX at
+  INFERENCE_ONNX_PATH. Pre- and post-processing (confidence filter and
+  class-aware NMS) are done here in NumPy with ultralytics' defaults, which
+  avoids loading torch at all and lets the ONNX model be quantized to INT8.
+
+Export, and optionally quantize with a directory of calibration photos:
+
+    python inference_backends.py export
+    python inference_backends.py export --int8 --calibration uploads/ --output yolov8n-int8.onnx
+"""
+
+import argparse
+import ast
+import os
+import sys
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from settings import (
+    YOLO_MODEL_PATH, INFERENCE_ONNX_PATH, INFERENCE_IMGSZ, INFERENCE_TORCH_THREADS, INFERENCE_BATCH_SIZE,
+    INFERENCE_CONF_THRESHOLD, INFERENCE_IOU_THRESHOLD, INFERENCE_MAX_DETECTIONS
+)
+
+# Per image: boxes (N, 4), confidences (N,), class ids (N,)
+Detections = Tuple[np.ndarray, np.ndarray, np.ndarray]
+
+# Offset that keeps boxes of different classes apart in class-aware NMS
+MAX_WH = 7680
+
+
+class TorchDetector:
+    def __init__(self, model_path: str = YOLO_MODEL_PATH, threads: int = INFERENCE_TORCH_THREADS):
+        from ultralytics import YOLO
+        self.model = YOLO(model_path)
+        self.names = self.model.names
+
+    def predict(self, canvases: List[np.ndarray], size: int = INFERENCE_IMGSZ) -> List[Detections]:
+        results = self.model(canvases, imgsz=size, verbose=False,
+                             conf=INFERENCE_CONF_THRESHOLD, iou=INFERENCE_IOU_THRESHOLD,
+                             max_det=INFERENCE_MAX_DETECTIONS)
+        detections = []
+        for r in results:
+            # x1, y1, x2, y2, confidence, class: one transfer out of torch per image
+            data = r.boxes.data.cpu().numpy()
+            detections.append((data[:, :4], data[:, 4], data[:, 5].astype(int)))
+        return detections
+
+
+def input_buffer(buffer: Optional[np.ndarray], count: int, size: int) -> np.ndarray:
+    """`buffer` if it can hold a batch of `count` inputs of `size`, else a new one to keep."""
+    if buffer is None or len(buffer) < count or buffer.shape[2] != size:
+        buffer = np.empty((max(count, INFERENCE_BATCH_SIZE), 3, size, size), np.float32)
+    return buffer
+
+
+def preprocess(canvases: List[np.ndarray], out: Optional[np.ndarray] = None) -> np.ndarray:
+    """
+    Letterboxed BGR uint8 canvases to the NCHW float32 RGB batch the network
+    expects, written into the first images of `out` if given.
+    """
+    height, width = canvases[0].shape[:2]
+    batch = np.empty((len(canvases), 3, height, width), np.float32) if out is None else out[:len(canvases)]
+    for image, canvas in zip(batch, canvases):
+        # Channel swap, transpose and conversion in one pass, without temporaries
+        image[...] = canvas[..., ::-1].transpose(2, 0, 1)
+    batch /= 255
+    return batch
+
+
+def nms(boxes: np.ndarray, scores: np.ndarray, iou_threshold: float) -> np.ndarray:
+    """Indices of the boxes kept by greedy non-maximum suppression, best first."""
+    x1, y1, x2, y2 = boxes.T
+    areas = (x2 - x1) * (y2 - y1)
+    order = scores.argsort()[::-1]
+    keep = []
+    while order.size:
+        i = order[0]
+        keep.append(i)
+        rest = order[1:]
+        width = np.clip(np.minimum(x2[i], x2[rest]) - np.maximum(x1[i], x1[rest]), 0, None)
+        height = np.clip(np.minimum(y2[i], y2[rest]) - np.maximum(y1[i], y1[rest]), 0, None)
+        inter = width * height
+        iou = inter / (areas[i] + areas[rest] - inter + 1e-9)
+        order = rest[iou <= iou_threshold]
+    return np.array(keep, dtype=int)
+
+
+def postprocess(output: np.ndarray, conf_threshold: float = INFERENCE_CONF_THRESHOLD,
+                iou_threshold: float = INFERENCE_IOU_THRESHOLD,
+                max_det: int = INFERENCE_MAX_DETECTIONS) -> List[Detections]:
+    """
+    Decode raw YOLOv8 output of shape (batch, 4 + classes, anchors), with
+    boxes as center x, center y, width, height, into per-image detections.
+    """
+    detections = []
+    for pred in output:
+        pred = pred.T
+        scores = pred[:, 4:]
+        cls = scores.argmax(axis=1)
+        conf = scores[np.arange(len(cls)), cls]
+        mask = conf > conf_threshold
+        boxes, conf, cls = pred[mask, :4], conf[mask], cls[mask]
+
+        xyxy = np.empty_like(boxes)
+        xyxy[:, :2] = boxes[:, :2] - boxes[:, 2:] / 2
+        xyxy[:, 2:] = boxes[:, :2] + boxes[:, 2:] / 2
+
+        keep = nms(xyxy + (cls * MAX_WH)[:, None], conf, iou_threshold)[:max_det]
+        detections.append((xyxy[keep], conf[keep], cls[keep]))
+    return detections
+
+
+def read_names(onnx_path: str) -> Dict[int, str]:
+    """Class names stored in the model metadata by the ultralytics exporter."""
+    import onnx
+    model = onnx.load(onnx_path, load_external_data=False)
+    metadata = {prop.key: prop.value for prop in model.metadata_props}
+    return ast.literal_eval(metadata["names"])
+
+
+class OnnxRuntimeDetector:
+    def __init__(self, onnx_path: str = INFERENCE_ONNX_PATH, threads: int = INFERENCE_TORCH_THREADS):
+        import onnxruntime as ort
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = threads
+        options.inter_op_num_threads = 1
+        options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = ort.InferenceSession(onnx_path, options, providers=["CPUExecutionProvider"])
+        self.input_name = self.session.get_inputs()[0].name
+        names = self.session.get_modelmeta().custom_metadata_map.get("names")
+        self.names = ast.literal_eval(names) if names else read_names(onnx_path)
+        # Input batch, reused from call to call
+        self._input = None
+
+    def predict(self, canvases: List[np.ndarray], size: int = INFERENCE_IMGSZ) -> List[Detections]:
+        self._input = input_buffer(self._input, len(canvases), size)
+        output = self.session.run(None, {self.input_name: preprocess(canvases, self._input)})[0]
+        return postprocess(output)
+
+
+class OpenVinoDetector:
+    def __init__(self, onnx_path: str = INFERENCE_ONNX_PATH, threads: int = INFERENCE_TORCH_THREADS):
+        import openvino as ov
+        core = ov.Core()
+        self.model = core.compile_model(onnx_path, "CPU", {
+            "INFERENCE_NUM_THREADS": threads,
+            "PERFORMANCE_HINT": "LATENCY",
+        })
+        self.output = self.model.output(0)
+        self.names = read_names(onnx_path)
+        self._input = None
+
+    def predict(self, canvases: List[np.ndarray], size: int = INFERENCE_IMGSZ) -> List[Detections]:
+        self._input = input_buffer(self._input, len(canvases), size)
+        output = self.model(preprocess(canvases, self._input))[self.output]
+        return postprocess(output)
+
+
+BACKENDS = {
+    "torch": TorchDetector,
+    "onnxruntime": OnnxRuntimeDetector,
+    "openvino": OpenVinoDetector,
+}
+
+
+def load_detector(backend: str, path: str = None, threads: int = INFERENCE_TORCH_THREADS):
+    """A detector for `backend`, loading `path` or the configured model."""
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown inference backend: {backend}")
+    if path is None:
+        path = YOLO_MODEL_PATH if backend == "torch" else INFERENCE_ONNX_PATH
+    return BACKENDS[backend](path, threads)
+
+
+# Export and quantization
+
+def export_onnx(model_path: str = YOLO_MODEL_PATH, output: str = INFERENCE_ONNX_PATH,
+                size: int = INFERENCE_IMGSZ) -> str:
+    """Export the ultralytics model to ONNX with a dynamic batch dimension."""
+    from ultralytics import YOLO
+    exported = YOLO(model_path).export(format="onnx", imgsz=size, dynamic=True, simplify=True)
+    if os.path.abspath(exported) != os.path.abspath(output):
+        os.replace(exported, output)
+    return output
+
+
+def calibration_batches(directory: str, input_name: str, size: int, limit: int):
+    """Letterboxed photos from `directory`, one per batch, for INT8 calibration."""
+    import cv2
+    from vision import letterbox
+
+    count = 0
+    for root, _, names in os.walk(directory):
+        for name in sorted(names):
+            if count >= limit:
+                return
+            if not name.lower().endswith((".jpg", ".jpeg", ".png", ".webp")):
+                continue
+            img = cv2.imread(os.path.join(root, name), cv2.IMREAD_COLOR)
+            if img is None:
+                continue
+            canvas, _, _ = letterbox(img, size)
+            count += 1
+            yield {input_name: preprocess([canvas])}
+
+
+def quantize_int8(onnx_path: str, output: str, calibration_dir: str,
+                  size: int = INFERENCE_IMGSZ, limit: int = 200) -> str:
+    """
+    Statically quantize the network to INT8 (QDQ, per-channel weights). The
+    box decoding at the end of the detect head is left in float: quantizing
+    it costs far more accuracy than it saves time.
+    """
+    import onnx
+    from onnxruntime.quantization import (
+        CalibrationDataReader, QuantFormat, QuantType, quantize_static
+    )
+    from onnxruntime.quantization.shape_inference import quant_pre_process
+
+    prepared = output + ".prep.onnx"
+    quant_pre_process(onnx_path, prepared)
+    model = onnx.load(prepared)
+    input_name = model.graph.input[0].name
+
+    # The detect head is the last module; keep everything but its convolutions in float
+    head = max(int(node.name.split("/")[1].split(".")[1]) for node in model.graph.node
+               if node.name.startswith("/model."))
+    excluded = [node.name for node in model.graph.node
+                if node.name.startswith(f"/model.{head}/") and "/cv" not in node.name]
+
+    class Reader(CalibrationDataReader):
+        def __init__(self):
+            self.batches = calibration_batches(calibration_dir, input_name, size, limit)
+
+        def get_next(self):
+            return next(self.batches, None)
+
+    try:
+        quantize_static(
+            prepared, output, Reader(),
+            quant_format=QuantFormat.QDQ,
+            per_channel=True,
+            activation_type=QuantType.QUInt8,
+            weight_type=QuantType.QInt8,
+            nodes_to_exclude=excluded,
+        )
+    finally:
+        os.remove(prepared)
+    return output
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Export the YOLO model for the ONNX Runtime and OpenVINO backends")
+    parser.add_argument("command", choices=["export"])
+    parser.add_argument("--model", default=YOLO_MODEL_PATH, help="ultralytics model to export")
+    parser.add_argument("--output", default=INFERENCE_ONNX_PATH, help="Where to write the ONNX model")
+    parser.add_argument("--imgsz", type=int, default=INFERENCE_IMGSZ, help="Inference size")
+    parser.add_argument("--int8", action="store_true", help="Quantize the exported model to INT8")
+    parser.add_argument("--calibration", help="Directory of photos to calibrate INT8 quantization with")
+    parser.add_argument("--calibration-size", type=int, default=200, help="Photos to calibrate with")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    if args.int8 and not args.calibration:
+        sys.exit("--int8 needs --calibration")
+    if args.int8:
+        float_path = os.path.splitext(args.output)[0] + "-fp32.onnx"
+        export_onnx(args.model, float_path, args.imgsz)
+        quantize_int8(float_path, args.output, args.calibration, args.imgsz, args.calibration_size)
+        print(f"Exported {float_path} and quantized it to {args.output}")
+    else:
+        export_onnx(args.model, args.output, args.imgsz)
+        print(f"Exported {args.output}")
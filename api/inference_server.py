@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+"""
+Shared inference server for the API workers.
+
+Run one of these per machine and point the API at it with INFERENCE_SOCKET.
+It owns the only copy of torch and the YOLO model; API workers send it
+batches through detection.InferenceClient instead of loading their own.
+
+Each request is one JSON line on the Unix socket:
+
+    {"op": "detect", "shm": "<segment name>", "sizes": [n1, ...], "modes": ["full", ...],
+     "infos": [[format, width, height, orientation, frames] or null, ...]}
+    {"op": "status"}
+
+For "detect", the uploaded images lie back to back in the named
+shared-memory segment, which the client creates and removes. The server
+decodes straight from it, feeds the images to its own BatchScheduler, so
+batches from different workers are batched together, and answers with one
+JSON line holding each image's response body or error.
+"""
+
+import argparse
+import asyncio
+import contextlib
+import json
+import logging
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from settings import (
+    INFERENCE_SOCKET, INFERENCE_WORKERS, INFERENCE_TORCH_THREADS,
+    INFERENCE_QUEUE_SIZE, INFERENCE_BATCH_SIZE, INFERENCE_BATCH_WAIT_MS,
+    INFERENCE_MESSAGE_LIMIT
+)
+from detection import (
+    InferencePool, BatchScheduler, attach_shared_memory, encode_result
+)
+from image_probe import ImageInfo
+from logs import setup_logging, shutdown_logging
+
+logger = logging.getLogger(__name__)
+
+
+class InferenceServer:
+    def __init__(self, workers: int = INFERENCE_WORKERS, torch_threads: int = INFERENCE_TORCH_THREADS,
+                 queue_size: int = INFERENCE_QUEUE_SIZE):
+        # Jobs read the shared-memory segment in place, so workers must be threads
+        self.pool = InferencePool(kind="thread", workers=workers, torch_threads=torch_threads)
+        self.scheduler = BatchScheduler(self.pool, max_batch=INFERENCE_BATCH_SIZE,
+                                        max_wait_ms=INFERENCE_BATCH_WAIT_MS, queue_size=queue_size)
+
+    async def detect(self, request: dict) -> dict:
+        segment = attach_shared_memory(request["shm"])
+        views = []
+        try:
+            offset = 0
+            for size in request["sizes"]:
+                views.append(segment.buf[offset:offset + size])
+                offset += size
+            modes = request.get("modes") or ["full"] * len(views)
+            infos = [info and ImageInfo(*info) for info in request.get("infos") or [None] * len(views)]
+            results = await asyncio.gather(
+                *[self.scheduler.detect(view, mode, info) for view, mode, info in zip(views, modes, infos)],
+                return_exceptions=True
+            )
+        finally:
+            # Jobs abandoned by a cancelled request may still hold a view;
+            # the mapping is then released when they finish
+            with contextlib.suppress(BufferError):
+                for view in views:
+                    view.release()
+                segment.close()
+        return {"results": [encode_result(result) for result in results]}
+
+    def status(self) -> dict:
+        return {"model": self.pool.model_state, "model_error": self.pool.model_error}
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                request = json.loads(line)
+                if request.get("op") == "detect":
+                    reply = await self.detect(request)
+                else:
+                    reply = self.status()
+                writer.write(json.dumps(reply).encode() + b"\n")
+                await writer.drain()
+        except (ConnectionError, ValueError) as e:
+            logger.warning("Dropping inference client: %s", e)
+        finally:
+            writer.close()
+
+    async def serve(self, socket_path: str):
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        server = await asyncio.start_unix_server(self.handle, path=socket_path, limit=INFERENCE_MESSAGE_LIMIT)
+        logger.info("Inference server listening on %s", socket_path)
+        asyncio.create_task(self.pool.warm_up())
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            self.pool.shutdown()
+            if os.path.exists(socket_path):
+                os.remove(socket_path)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Serve YOLO detection to the API workers over a Unix socket")
+    parser.add_argument("--socket", default=INFERENCE_SOCKET or "/tmp/figart-inference.sock",
+                        help="Path of the Unix socket to listen on")
+    parser.add_argument("--workers", type=int, default=INFERENCE_WORKERS, help="Inference threads")
+    parser.add_argument("--torch-threads", type=int, default=INFERENCE_TORCH_THREADS,
+                        help="Threads each inference worker may use")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    setup_logging()
+    server = InferenceServer(workers=args.workers, torch_threads=args.torch_threads)
+    try:
+        asyncio.run(server.serve(args.socket))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        shutdown_logging()
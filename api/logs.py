@@ -0,0 +1,172 @@
+"""
+Logging for the API, the inference workers and the inference server.
+
+Modules log through `logging.getLogger(__name__)`; setup_logging() routes
+every record through a bounded queue to a listener thread that formats it,
+as text or one JSON object per line (LOG_FORMAT), and writes it to stderr.
+Request handlers only pay for putting a record on the queue, never for
+console I/O, and when the queue is full records are dropped and counted
+rather than blocking the event loop.
+
+Each HTTP request gets an ID, taken from its X-Request-ID header or
+generated, which is returned in the response header and attached to every
+record logged while handling it. It lives in a context variable, so it also
+reaches background tasks and the threads of asyncio.to_thread() and of a
+"thread" inference pool, which run in a copy of the request's context.
+Records from process pools (normalization, a "process" inference pool) and
+the inference server have none. DEBUG records are sampled by request: only
+LOG_SAMPLE_RATE of requests log them, but those log all of them.
+"""
+
+import contextvars
+import json
+import logging
+import logging.handlers
+import queue
+import random
+import re
+import sys
+import uuid
+import zlib
+from datetime import datetime, timezone
+
+from settings import LOG_LEVEL, LOG_FORMAT, LOG_SAMPLE_RATE, LOG_QUEUE_SIZE
+
+request_id = contextvars.ContextVar("request_id", default=None)
+
+# Client-supplied request IDs are used as given only if they look like one
+REQUEST_ID_PATTERN = re.compile(r"^[A-Za-z0-9._-]{1,64}$")
+# Attributes every LogRecord has; anything else was passed with extra=
+RECORD_ATTRIBUTES = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "request_id"}
+
+_listener = None
+
+
+class RequestContext(logging.Filter):
+    """Attaches the current request ID and drops DEBUG records of unsampled requests."""
+
+    def __init__(self, sample_rate: float = LOG_SAMPLE_RATE):
+        super().__init__()
+        self.sample_rate = sample_rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        current = request_id.get()
+        record.request_id = current
+        if record.levelno > logging.DEBUG or self.sample_rate >= 1:
+            return True
+        if current is None:
+            return random.random() < self.sample_rate
+        # The same decision for every record of a request
+        return zlib.crc32(current.encode()) % 10000 < self.sample_rate * 10000
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """A QueueHandler that drops records instead of blocking when the queue is full."""
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Merge the arguments and render the traceback here, where they are
+        # still valid, but leave formatting to the listener thread
+        record = logging.makeLogRecord(vars(record))
+        record.message = record.getMessage()
+        record.msg, record.args = record.message, None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per record, with any fields passed with extra=."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        if getattr(record, "request_id", None):
+            entry["request_id"] = record.request_id
+        for key, value in vars(record).items():
+            if key not in RECORD_ATTRIBUTES:
+                entry[key] = value
+        if record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    def __init__(self):
+        super().__init__("%(asctime)s %(levelname)s %(name)s%(request)s: %(message)s")
+
+    def format(self, record: logging.LogRecord) -> str:
+        current = getattr(record, "request_id", None)
+        record.request = f" [{current}]" if current else ""
+        return super().format(record)
+
+
+def setup_logging(level: str = LOG_LEVEL, fmt: str = LOG_FORMAT) -> None:
+    """Send all records through the queue to stderr. Safe to call more than once per process."""
+    global _listener
+    if _listener is not None:
+        return
+    output = logging.StreamHandler(sys.stderr)
+    output.setFormatter(JsonFormatter() if fmt == "json" else TextFormatter())
+    log_queue = queue.Queue(LOG_QUEUE_SIZE)
+    handler = DroppingQueueHandler(log_queue)
+    handler.addFilter(RequestContext())
+
+    root = logging.getLogger()
+    root.handlers = [handler]
+    root.setLevel(level)
+    _listener = logging.handlers.QueueListener(log_queue, output, respect_handler_level=True)
+    _listener.start()
+
+
+def shutdown_logging() -> None:
+    """Write out the records still queued and stop the listener thread."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def dropped_records() -> int:
+    handlers = [h for h in logging.getLogger().handlers if isinstance(h, DroppingQueueHandler)]
+    return sum(h.dropped for h in handlers)
+
+
+class RequestIdMiddleware:
+    """ASGI middleware that gives each HTTP request an ID for its log records."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        current = dict(scope["headers"]).get(b"x-request-id", b"").decode("latin-1")
+        if not REQUEST_ID_PATTERN.match(current):
+            current = uuid.uuid4().hex[:16]
+        token = request_id.set(current)
+
+        async def send_with_id(message):
+            if message["type"] == "http.response.start":
+                message["headers"] = list(message.get("headers", [])) + [(b"x-request-id", current.encode())]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_id)
+        finally:
+            request_id.reset(token)
@@ -0,0 +1,194 @@
+"""
+Metrics exposed in the Prometheus text format at /metrics.
+
+Counters and histograms are recorded on hot paths (every request, every DB
+query, every pipeline stage), so they take no lock there: each thread
+updates its own shard of the values, and a scrape adds the shards up. Only
+the first update from a new thread registers its shard under a lock.
+
+Values that already exist elsewhere, like queue depths and cache hit
+counters, aren't recorded at all; Callback metrics read them when scraped.
+
+Metrics are per process. The pipeline stages are recorded where the
+pipeline runs, which is the API process with the default thread executor;
+with the process executor or a shared inference server they stay in those
+processes.
+"""
+
+import bisect
+import threading
+import time
+from typing import Callable, Dict, List, Sequence, Tuple
+
+from settings import METRICS_LATENCY_BUCKETS
+
+registry = []
+
+
+def escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def format_labels(names: Sequence[str], values: Sequence, extra: str = "") -> str:
+    pairs = [f'{name}="{escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._shards = []
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        registry.append(self)
+
+    def _shard(self) -> dict:
+        """This thread's values, by label values."""
+        try:
+            return self._local.values
+        except AttributeError:
+            values = self._local.values = {}
+            with self._lock:
+                self._shards.append(values)
+            return values
+
+    def _snapshots(self) -> List[List[Tuple[tuple, object]]]:
+        # list() of a dict's items is a single step under the GIL, so a
+        # thread adding a label set meanwhile can't break the iteration
+        with self._lock:
+            shards = list(self._shards)
+        return [list(shard.items()) for shard in shards]
+
+    def header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, *labels, amount: float = 1) -> None:
+        values = self._shard()
+        values[labels] = values.get(labels, 0) + amount
+
+    def collect(self) -> List[str]:
+        totals = {}
+        for snapshot in self._snapshots():
+            for labels, value in snapshot:
+                totals[labels] = totals.get(labels, 0) + value
+        return self.header() + [
+            f"{self.name}{format_labels(self.labelnames, labels)} {format_value(value)}"
+            for labels, value in sorted(totals.items())
+        ]
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = METRICS_LATENCY_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, *labels) -> None:
+        values = self._shard()
+        counts = values.get(labels)
+        if counts is None:
+            # One count per bucket and one for +Inf, then the sum
+            counts = values[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+        counts[bisect.bisect_left(self.buckets, value)] += 1
+        counts[-1] += value
+
+    def collect(self) -> List[str]:
+        totals = {}
+        for snapshot in self._snapshots():
+            for labels, counts in snapshot:
+                total = totals.setdefault(labels, [0] * len(counts[:-1]) + [0.0])
+                for i, count in enumerate(counts):
+                    total[i] += count
+        lines = self.header()
+        for labels, counts in sorted(totals.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = f'le="{format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{format_labels(self.labelnames, labels, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{format_labels(self.labelnames, labels)} {format_value(counts[-1])}")
+            lines.append(f"{self.name}_count{format_labels(self.labelnames, labels)} {cumulative}")
+        return lines
+
+
+class Callback(Metric):
+    """A gauge or counter whose values are read from `read()`, a dict by label values, when scraped."""
+
+    def __init__(self, name: str, help: str, kind: str, read: Callable[[], Dict[tuple, float]],
+                 labelnames: Sequence[str] = ()):
+        super().__init__(name, help, labelnames)
+        self.kind = kind
+        self.read = read
+
+    def collect(self) -> List[str]:
+        return self.header() + [
+            f"{self.name}{format_labels(self.labelnames, labels)} {format_value(value)}"
+            for labels, value in sorted(self.read().items())
+        ]
+
+
+def render() -> str:
+    """Every registered metric in the Prometheus text exposition format."""
+    lines = []
+    for metric in registry:
+        lines.extend(metric.collect())
+    return "\n".join(lines) + "\n"
+
+
+http_requests = Counter("figart_http_requests_total", "HTTP requests by route and status.",
+                        ("method", "route", "status"))
+http_request_duration = Histogram("figart_http_request_duration_seconds",
+                                  "Time to handle HTTP requests, including sending the body.", ("method", "route"))
+db_query_duration = Histogram("figart_db_query_duration_seconds", "Time spent in database queries.",
+                              ("statement",))
+detection_stage_duration = Histogram("figart_detection_stage_duration_seconds",
+                                     "Time spent in each stage of the detection pipeline.", ("stage",))
+upload_bytes = Counter("figart_upload_bytes_total", "Bytes of uploaded images received.", ("route",))
+
+
+class MetricsMiddleware:
+    """ASGI middleware that counts and times HTTP requests by route template."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        start = time.perf_counter()
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            # The router leaves the matched route in the scope; labelling by
+            # its template keeps /posts/1/ and /posts/2/ in one series
+            route = getattr(scope.get("route"), "path", None) or "unmatched"
+            method = scope["method"]
+            http_requests.inc(method, route, status)
+            http_request_duration.observe(time.perf_counter() - start, method, route)
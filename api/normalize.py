@@ -0,0 +1,121 @@
+"""
+Image processing that runs after an upload, off the request path.
+
+Phone photos arrive with large EXIF/XMP blocks, sideways pixel data that
+relies on the EXIF orientation tag, and dimensions far beyond anything the
+site displays. normalize_image() fixes all of that and re-encodes the photo;
+make_placeholder() renders the tiny preview feeds show while the photo
+loads. Both run in a process pool so the CPU work stays off the event loop,
+and only import Pillow so worker processes start quickly.
+"""
+
+import base64
+import hashlib
+import io
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional
+
+from settings import (
+    NORMALIZE_WORKERS, NORMALIZE_MAX_DIMENSION,
+    NORMALIZE_FORMAT, NORMALIZE_QUALITY,
+    PLACEHOLDER_SIZE, PLACEHOLDER_QUALITY
+)
+
+EXTENSIONS = {"jpeg": "jpg", "webp": "webp"}
+ORIENTATION_TAG = 0x0112
+
+_pool = None
+
+
+def get_pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(max_workers=NORMALIZE_WORKERS)
+    return _pool
+
+
+def shutdown_pool():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+
+def normalize_image(src_path: str, dst_path: str, max_dimension: int = NORMALIZE_MAX_DIMENSION,
+                    fmt: str = NORMALIZE_FORMAT, quality: int = NORMALIZE_QUALITY) -> Optional[dict]:
+    """
+    Re-encode `src_path` into `dst_path`.
+
+    Applies the EXIF orientation, drops EXIF/XMP metadata (the ICC profile is
+    kept so colors don't shift), caps the longest side at `max_dimension` and
+    saves a progressive JPEG or a WebP. Returns None for images that are left
+    alone (animations), otherwise a dict with the sha256 digest and sizes of
+    the result and whether it is worth keeping over the original.
+    """
+    from PIL import Image, ImageOps
+
+    original_size = os.path.getsize(src_path)
+    with Image.open(src_path) as im:
+        if getattr(im, "n_frames", 1) > 1:
+            return None
+
+        has_metadata = any(key in im.info for key in ("exif", "xmp", "XML:com.adobe.xmp", "comment"))
+        icc_profile = im.info.get("icc_profile")
+        rotated = im.getexif().get(ORIENTATION_TAG, 1) != 1
+        oriented = ImageOps.exif_transpose(im)
+        resized = max(oriented.size) > max_dimension
+        if resized:
+            oriented.thumbnail((max_dimension, max_dimension), Image.LANCZOS)
+
+        if fmt == "jpeg" and oriented.mode != "RGB":
+            # JPEG has no alpha channel; flatten onto white
+            background = Image.new("RGB", oriented.size, (255, 255, 255))
+            converted = oriented.convert("RGBA")
+            background.paste(converted, mask=converted.getchannel("A"))
+            oriented = background
+        elif fmt == "webp" and oriented.mode not in ("RGB", "RGBA"):
+            oriented = oriented.convert("RGBA" if "A" in oriented.getbands() else "RGB")
+
+        options = {"quality": quality}
+        if icc_profile:
+            options["icc_profile"] = icc_profile
+        if fmt == "jpeg":
+            options.update(progressive=True, optimize=True)
+        else:
+            options.update(method=4)
+        oriented.save(dst_path, format=fmt.upper(), **options)
+
+    digest = hashlib.sha256()
+    with open(dst_path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    normalized_size = os.path.getsize(dst_path)
+
+    return {
+        "digest": digest.hexdigest(),
+        "extension": EXTENSIONS[fmt],
+        "original_size": original_size,
+        "normalized_size": normalized_size,
+        # A smaller file is always worth it; a larger one only when the
+        # original needed fixing or leaked metadata
+        "keep": normalized_size < original_size or rotated or resized or has_metadata,
+    }
+
+
+def make_placeholder(src_path: str, size: int = PLACEHOLDER_SIZE, quality: int = PLACEHOLDER_QUALITY) -> str:
+    """
+    Return a `data:image/jpeg;base64,...` preview of `src_path` whose longest
+    side is `size` pixels, typically well under a kilobyte.
+    """
+    from PIL import Image, ImageOps
+
+    with Image.open(src_path) as im:
+        # draft() lets the JPEG decoder skip most of the pixels
+        im.draft("RGB", (size * 4, size * 4))
+        preview = ImageOps.exif_transpose(im)
+        preview.thumbnail((size, size), Image.BILINEAR)
+        preview = preview.convert("RGB")
+        buffer = io.BytesIO()
+        preview.save(buffer, format="JPEG", quality=quality, optimize=True)
+    return "data:image/jpeg;base64," + base64.b64encode(buffer.getvalue()).decode("ascii")
@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+"""
+Garbage collector for photos that no post references.
+
+Stored photos and referenced names are both streamed in sorted order and
+merge-joined, so memory stays flat no matter how many photos there are: the
+photo store is walked one shard directory (or name prefix of the flat legacy
+directory, or index page) at a time and names are read from the database in
+keyset-paginated batches. Orphans older than
+the grace period are moved to uploads/.quarantine (or deleted), along with
+temporary files left behind by interrupted uploads. The pack store has no
+quarantine, so orphans there are deleted.
+
+Run it from cron, or set ORPHAN_GC_INTERVAL to let the API run it.
+"""
+
+import argparse
+import heapq
+import os
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from backend import init_db, Session, Post, PhotoBlob
+from settings import ORPHAN_GC_GRACE, ORPHAN_GC_QUARANTINE, ORPHAN_GC_BATCH_SIZE
+from storage import TMP_DIR, QUARANTINE_DIR, photo_store, discard
+
+
+def iter_referenced(session, column, batch_size):
+    """Yield the distinct non-null values of `column` in sorted order, a batch at a time."""
+    last = ""
+    while True:
+        rows = (
+            session.query(column)
+            .filter(column > last)
+            .distinct()
+            .order_by(column)
+            .limit(batch_size)
+            .all()
+        )
+        if not rows:
+            return
+        for (name,) in rows:
+            yield name
+        last = rows[-1][0]
+
+
+def iter_orphans(session, batch_size=ORPHAN_GC_BATCH_SIZE, stats=None):
+    """
+    Yield (photo_uuid, size, mtime) of stored photos that no post or blob row
+    references. When given, stats["scanned"] counts every photo looked at.
+    """
+    referenced = heapq.merge(
+        iter_referenced(session, Post.photo_uuid, batch_size),
+        iter_referenced(session, PhotoBlob.photo_uuid, batch_size),
+    )
+    ref = next(referenced, None)
+    for name, size, mtime in photo_store.iter_photos():
+        if stats is not None:
+            stats["scanned"] += 1
+        while ref is not None and ref < name:
+            ref = next(referenced, None)
+        if ref != name:
+            yield name, size, mtime
+
+
+def _iter_old_files(directory, cutoff):
+    """Yield (path, size) of files in `directory` last modified before `cutoff`."""
+    try:
+        entries = list(os.scandir(directory))
+    except FileNotFoundError:
+        return
+    for entry in entries:
+        if not entry.is_file():
+            continue
+        st = entry.stat()
+        if st.st_mtime <= cutoff:
+            yield entry.path, st.st_size
+
+
+def collect_orphans(grace=ORPHAN_GC_GRACE, dry_run=False, quarantine=ORPHAN_GC_QUARANTINE,
+                    batch_size=ORPHAN_GC_BATCH_SIZE, on_removed=None):
+    """
+    Quarantine or delete unreferenced photos older than `grace` seconds.
+
+    Quarantined files are deleted on a later run once they have sat in
+    quarantine for another grace period, so a mistake can still be undone
+    by moving the file back. `on_removed` is called with the name of every
+    photo taken out of service, which lets the API drop it from its stat
+    cache. Returns a report of what was (or, with `dry_run`, would be) done.
+    """
+    now = time.time()
+    cutoff = now - grace
+    report = {
+        "scanned": 0,
+        "orphans": 0,
+        "orphan_bytes": 0,
+        "skipped_recent": 0,
+        "quarantined": 0,
+        "deleted": 0,
+        "reclaimed_bytes": 0,
+    }
+
+    def reclaim(path, size):
+        report["deleted"] += 1
+        report["reclaimed_bytes"] += size
+        if not dry_run:
+            discard(path)
+
+    session = Session()
+    try:
+        for name, size, mtime in iter_orphans(session, batch_size, stats=report):
+            if mtime > cutoff:
+                report["skipped_recent"] += 1
+                continue
+            report["orphans"] += 1
+            report["orphan_bytes"] += size
+            if dry_run:
+                removed = True
+            elif quarantine:
+                removed = photo_store.quarantine(name, now)
+            else:
+                photo_store.delete(name)
+                removed = True
+            if not removed:
+                continue
+            if quarantine:
+                report["quarantined"] += 1
+            else:
+                report["deleted"] += 1
+                report["reclaimed_bytes"] += size
+            if on_removed is not None and not dry_run:
+                on_removed(name)
+    finally:
+        session.close()
+
+    # Files that served their time in quarantine, and uploads that never
+    # made it out of the temporary directory
+    for directory in (QUARANTINE_DIR, TMP_DIR):
+        for path, size in _iter_old_files(directory, cutoff):
+            reclaim(path, size)
+
+    return report
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Collect photos that no post references")
+    parser.add_argument("--grace", type=float, default=ORPHAN_GC_GRACE,
+                        help="Only collect files older than this many seconds")
+    parser.add_argument("--delete", action="store_true", help="Delete orphans instead of quarantining them")
+    parser.add_argument("--batch-size", type=int, default=ORPHAN_GC_BATCH_SIZE,
+                        help="Referenced names read from the database per query")
+    parser.add_argument("--dry-run", action="store_true", help="Report what would be collected without touching anything")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    init_db()
+    report = collect_orphans(
+        grace=args.grace,
+        dry_run=args.dry_run,
+        quarantine=ORPHAN_GC_QUARANTINE and not args.delete,
+        batch_size=args.batch_size,
+    )
+    print(f"Scanned {report['scanned']} photos and found {report['orphans']} orphans "
+          f"({report['orphan_bytes']} bytes), skipping {report['skipped_recent']} within the grace period")
+    verb = "Would quarantine" if args.dry_run else "Quarantined"
+    print(f"{verb} {report['quarantined']} files and delete{'' if args.dry_run else 'd'} {report['deleted']}, "
+          f"reclaiming {report['reclaimed_bytes']} bytes")
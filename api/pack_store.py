@@ -0,0 +1,350 @@
+"""
+Append-only pack-file photo store.
+
+Instead of one file per photo, blobs are appended to large segment files and
+located through an offset index kept in a SQLite file next to them. Reading a
+photo is an indexed lookup plus a slice of a memory-mapped segment, with no
+per-photo open/stat. Deleting a blob only drops its index row; compact()
+later rewrites segments that are mostly dead space.
+
+Layout of PHOTO_PACK_DIR:
+
+    index.sqlite3          name -> (segment, offset, length), segment sizes
+    segment-000001.pack    concatenated blob bytes
+    write.lock             serializes writers across API worker processes
+
+Several processes may read and write the same store: writers take an
+exclusive flock on write.lock and readers only trust offsets found in the
+index, which is committed only after the bytes are on disk.
+"""
+
+import contextlib
+import fcntl
+import mmap
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from typing import Iterator, Optional, Tuple
+
+from settings import PHOTO_PACK_DIR, PHOTO_PACK_SEGMENT_SIZE, PHOTO_PACK_COMPACT_RATIO
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS blobs (
+    name TEXT PRIMARY KEY,
+    segment INTEGER NOT NULL,
+    offset INTEGER NOT NULL,
+    length INTEGER NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS blobs_segment ON blobs (segment, offset);
+CREATE TABLE IF NOT EXISTS segments (
+    id INTEGER PRIMARY KEY,
+    live_bytes INTEGER NOT NULL DEFAULT 0
+);
+"""
+
+
+class PackedPhoto:
+    """Index entry of a blob in the pack store."""
+
+    __slots__ = ("name", "segment", "offset", "size", "created_at", "etag")
+
+    def __init__(self, name: str, segment: int, offset: int, size: int, created_at: float):
+        self.name = name
+        self.segment = segment
+        self.offset = offset
+        self.size = size
+        self.created_at = created_at
+        self.etag = f'"{segment:x}-{offset:x}-{size:x}"'
+
+
+class PackFileStore:
+    """Photo store backed by append-only segment files and an offset index."""
+
+    def __init__(self, directory: str = PHOTO_PACK_DIR, segment_size: int = PHOTO_PACK_SEGMENT_SIZE):
+        self.directory = directory
+        self.segment_size = segment_size
+        os.makedirs(directory, exist_ok=True)
+        self._local = threading.local()
+        self._thread_lock = threading.Lock()
+        self._maps = {}
+        self._maps_lock = threading.Lock()
+        with self._connection() as db:
+            db.executescript(SCHEMA)
+
+    # Index access
+
+    def _connection(self) -> sqlite3.Connection:
+        db = getattr(self._local, "db", None)
+        if db is None:
+            db = sqlite3.connect(os.path.join(self.directory, "index.sqlite3"), timeout=30)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            self._local.db = db
+        return db
+
+    @contextlib.contextmanager
+    def _writing(self):
+        """Exclusive write access across threads and processes."""
+        with self._thread_lock:
+            with open(os.path.join(self.directory, "write.lock"), "a") as lock:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+                db = self._connection()
+                try:
+                    yield db
+                except BaseException:
+                    # Don't leave a half-done change pending on this thread's connection
+                    db.rollback()
+                    raise
+                finally:
+                    fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def segment_path(self, segment: int) -> str:
+        return os.path.join(self.directory, f"segment-{segment:06d}.pack")
+
+    def lookup(self, name: str) -> Optional[PackedPhoto]:
+        row = self._connection().execute(
+            "SELECT segment, offset, length, created_at FROM blobs WHERE name = ?", (name,)
+        ).fetchone()
+        return PackedPhoto(name, *row) if row else None
+
+    def exists(self, name: str) -> bool:
+        return self.lookup(name) is not None
+
+    # Reading
+
+    def _map(self, segment: int, end: int) -> mmap.mmap:
+        """Memory map of `segment` covering at least `end` bytes."""
+        with self._maps_lock:
+            mapped = self._maps.get(segment)
+            if mapped is None or len(mapped) < end:
+                # Segments only grow, so a stale map is simply replaced. Old
+                # maps may still back memoryviews handed out earlier and are
+                # released once those are gone.
+                with open(self.segment_path(segment), "rb") as f:
+                    mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                if segment not in self._maps:
+                    self._prune_maps()
+                self._maps[segment] = mapped
+            return mapped
+
+    def _prune_maps(self):
+        """Drop maps of segments another process compacted away, so their disk space is freed."""
+        live = {row[0] for row in self._connection().execute("SELECT id FROM segments")}
+        for segment in [s for s in self._maps if s not in live]:
+            del self._maps[segment]
+
+    def read(self, photo: PackedPhoto) -> memoryview:
+        """Zero-copy view of a blob's bytes."""
+        try:
+            mapped = self._map(photo.segment, photo.offset + photo.size)
+        except FileNotFoundError:
+            # The segment was compacted away since `photo` was looked up
+            current = self.lookup(photo.name)
+            if current is None:
+                raise
+            photo = current
+            mapped = self._map(photo.segment, photo.offset + photo.size)
+        return memoryview(mapped)[photo.offset:photo.offset + photo.size]
+
+    def read_bytes(self, name: str) -> Optional[bytes]:
+        photo = self.lookup(name)
+        return bytes(self.read(photo)) if photo else None
+
+    @contextlib.contextmanager
+    def local_path(self, name: str):
+        """Copy of a blob in a temporary file for code that needs a path, or None."""
+        photo = self.lookup(name)
+        if photo is None:
+            yield None
+            return
+        fd, path = tempfile.mkstemp(prefix="figart-pack-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(self.read(photo))
+            yield path
+        finally:
+            os.remove(path)
+
+    # Writing
+
+    def _active_segment(self, db: sqlite3.Connection, incoming: int) -> Tuple[int, int]:
+        """
+        (segment id, current size) of the segment the next blob goes to. A new
+        segment's row is added in the caller's transaction.
+        """
+        row = db.execute("SELECT MAX(id) FROM segments").fetchone()
+        segment = row[0]
+        if segment is not None:
+            try:
+                size = os.path.getsize(self.segment_path(segment))
+            except FileNotFoundError:
+                size = 0
+            if size == 0 or size + incoming <= self.segment_size:
+                return segment, size
+        segment = (segment or 0) + 1
+        db.execute("INSERT INTO segments (id, live_bytes) VALUES (?, 0)", (segment,))
+        return segment, 0
+
+    def _write(self, db: sqlite3.Connection, data, sync: bool = True) -> Tuple[int, int]:
+        """Append `data` to the active segment; returns (segment, offset)."""
+        segment, _ = self._active_segment(db, len(data))
+        with open(self.segment_path(segment), "ab") as f:
+            offset = f.tell()
+            f.write(data)
+            if sync:
+                f.flush()
+                os.fsync(f.fileno())
+        return segment, offset
+
+    def _sync(self, segment: int) -> None:
+        with open(self.segment_path(segment), "ab") as f:
+            os.fsync(f.fileno())
+
+    def _index(self, db: sqlite3.Connection, name: str, segment: int, offset: int, length: int,
+               created_at: float) -> None:
+        db.execute(
+            "INSERT OR REPLACE INTO blobs (name, segment, offset, length, created_at) VALUES (?, ?, ?, ?, ?)",
+            (name, segment, offset, length, created_at),
+        )
+        db.execute("UPDATE segments SET live_bytes = live_bytes + ? WHERE id = ?", (length, segment))
+
+    def put_bytes(self, name: str, data: bytes) -> None:
+        """Store `data` under `name`; existing names are left untouched."""
+        with self._writing() as db:
+            if db.execute("SELECT 1 FROM blobs WHERE name = ?", (name,)).fetchone():
+                return
+            # The index row is committed only once the bytes are on disk
+            segment, offset = self._write(db, data)
+            self._index(db, name, segment, offset, len(data), time.time())
+            db.commit()
+
+    def put(self, tmp_path: str, name: str) -> None:
+        """Move the file at `tmp_path` into the store under `name`."""
+        with open(tmp_path, "rb") as f:
+            data = f.read()
+        self.put_bytes(name, data)
+        os.remove(tmp_path)
+
+    def delete(self, name: str) -> None:
+        with self._writing() as db:
+            row = db.execute("SELECT segment, length FROM blobs WHERE name = ?", (name,)).fetchone()
+            if row is None:
+                return
+            segment, length = row
+            db.execute("DELETE FROM blobs WHERE name = ?", (name,))
+            db.execute("UPDATE segments SET live_bytes = live_bytes - ? WHERE id = ?", (length, segment))
+            db.commit()
+
+    def quarantine(self, name: str, now: float) -> bool:
+        """
+        Blobs can't be set aside inside a pack, so quarantining a blob deletes
+        it; compaction reclaims the bytes later. Returns False if it was gone.
+        """
+        if not self.exists(name):
+            return False
+        self.delete(name)
+        return True
+
+    # Maintenance
+
+    def iter_photos(self, batch_size: int = 1000) -> Iterator[Tuple[str, int, float]]:
+        """Yield (name, size, created_at) of every blob, sorted by name."""
+        last = ""
+        while True:
+            rows = self._connection().execute(
+                "SELECT name, length, created_at FROM blobs WHERE name > ? ORDER BY name LIMIT ?",
+                (last, batch_size),
+            ).fetchall()
+            if not rows:
+                return
+            yield from rows
+            last = rows[-1][0]
+
+    def compact(self, min_dead_ratio: float = PHOTO_PACK_COMPACT_RATIO) -> dict:
+        """
+        Rewrite segments whose dead space is at least `min_dead_ratio` of
+        their size, copying live blobs to the active segment and removing the
+        old file. Returns the number of segments rewritten and bytes freed.
+        """
+        report = {"segments": 0, "moved_blobs": 0, "reclaimed_bytes": 0}
+        db = self._connection()
+        newest = db.execute("SELECT MAX(id) FROM segments").fetchone()[0]
+        candidates = db.execute("SELECT id, live_bytes FROM segments WHERE id < ?", (newest or 0,)).fetchall()
+
+        for segment, live_bytes in candidates:
+            path = self.segment_path(segment)
+            try:
+                size = os.path.getsize(path)
+            except FileNotFoundError:
+                size = 0
+            if size and (size - live_bytes) / size < min_dead_ratio:
+                continue
+
+            with self._writing() as db:
+                blobs = db.execute(
+                    "SELECT name, offset, length, created_at FROM blobs WHERE segment = ? ORDER BY offset",
+                    (segment,),
+                ).fetchall()
+                # Copy every live blob first and sync the segments they went
+                # to, then repoint the index and drop the old segment in one
+                # transaction. A crash before the commit leaves the index on
+                # the old segment, which is still intact, and the copies as
+                # dead space; the old file is only removed after the commit.
+                moved, written = [], set()
+                if blobs:
+                    with open(path, "rb") as f:
+                        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                    try:
+                        for name, offset, length, created_at in blobs:
+                            target, target_offset = self._write(db, mapped[offset:offset + length], sync=False)
+                            written.add(target)
+                            moved.append((name, target, target_offset, length, created_at))
+                    finally:
+                        mapped.close()
+                for target in written:
+                    self._sync(target)
+                for entry in moved:
+                    self._index(db, *entry)
+                db.execute("DELETE FROM segments WHERE id = ?", (segment,))
+                db.commit()
+                # Readers that mapped the old file keep a valid view of it
+                # until they drop the map; new reads follow the index.
+                with contextlib.suppress(FileNotFoundError):
+                    os.remove(path)
+                with self._maps_lock:
+                    self._maps.pop(segment, None)
+
+            report["segments"] += 1
+            report["moved_blobs"] += len(blobs)
+            report["reclaimed_bytes"] += size - live_bytes
+        return report
+
+    def stats(self) -> dict:
+        db = self._connection()
+        blobs, live = db.execute("SELECT COUNT(*), COALESCE(SUM(length), 0) FROM blobs").fetchone()
+        segments = [row[0] for row in db.execute("SELECT id FROM segments")]
+        on_disk = sum(
+            os.path.getsize(self.segment_path(s)) for s in segments if os.path.exists(self.segment_path(s))
+        )
+        return {"blobs": blobs, "segments": len(segments), "live_bytes": live, "disk_bytes": on_disk}
+
+
+def parse_args():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Maintain the pack-file photo store")
+    parser.add_argument("command", choices=["stats", "compact"])
+    parser.add_argument("--min-dead-ratio", type=float, default=PHOTO_PACK_COMPACT_RATIO,
+                        help="Rewrite segments with at least this fraction of deleted bytes")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    store = PackFileStore()
+    if args.command == "compact":
+        print(store.compact(args.min_dead_ratio))
+    print(store.stats())
@@ -0,0 +1,135 @@
+"""
+Helpers for serving uploaded photos with as few syscalls as possible.
+
+Photo names are unique per upload and the bytes behind a name never change,
+so the result of a photo store lookup (a stat() or an index query) can be
+reused for a while and browsers can be told to cache the response forever.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Optional, Tuple
+
+from settings import PHOTO_STAT_CACHE_SIZE, PHOTO_STAT_CACHE_TTL
+
+
+class PhotoStatCache:
+    """
+    Bounded LRU of photo name -> lookup result from the photo store.
+
+    Only hits are cached; a missing photo is looked up again on the next
+    request so a freshly uploaded file shows up immediately.
+    """
+
+    def __init__(self, maxsize: int = PHOTO_STAT_CACHE_SIZE, ttl: float = PHOTO_STAT_CACHE_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, photoname: str, lookup: Callable[[str], Any]) -> Any:
+        """
+        Return the cached lookup result for `photoname`, calling `lookup` on
+        a miss, or None if the photo doesn't exist.
+        """
+        now = time.monotonic()
+        with self._lock:
+            cached = self._entries.get(photoname)
+            if cached is not None and cached[1] > now:
+                self._entries.move_to_end(photoname)
+                self.hits += 1
+                return cached[0]
+
+        self.misses += 1
+        entry = lookup(photoname)
+        if entry is None:
+            self.invalidate(photoname)
+            return None
+
+        with self._lock:
+            self._entries[photoname] = (entry, now + self.ttl)
+            self._entries.move_to_end(photoname)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+        return entry
+
+    def invalidate(self, photoname: str) -> None:
+        """Forget a photo, e.g. after its file was removed."""
+        with self._lock:
+            self._entries.pop(photoname, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+
+def etag_matches(header: Optional[str], etag: str) -> bool:
+    """Weak comparison of an If-None-Match header against our ETag."""
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    for candidate in header.split(","):
+        candidate = candidate.strip()
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate == etag:
+            return True
+    return False
+
+
+class RangeNotSatisfiable(Exception):
+    pass
+
+
+def parse_range(header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    """
+    Parse a `Range: bytes=...` header into an inclusive (start, end) pair.
+
+    Returns None when the whole file should be sent: no header, a unit other
+    than bytes, a malformed value or a multi-range request (which we are
+    allowed to ignore). Raises RangeNotSatisfiable for ranges past the end.
+    """
+    if not header:
+        return None
+    unit, _, spec = header.partition("=")
+    if unit.strip().lower() != "bytes" or "," in spec:
+        return None
+    first, sep, last = spec.strip().partition("-")
+    if not sep:
+        return None
+    try:
+        if first == "":
+            # Suffix range: the last N bytes
+            length = int(last)
+            if length <= 0 or size == 0:
+                raise RangeNotSatisfiable()
+            return max(0, size - length), size - 1
+        start = int(first)
+        end = int(last) if last else size - 1
+    except ValueError:
+        return None
+    if start >= size:
+        raise RangeNotSatisfiable()
+    if end < start:
+        return None
+    return start, min(end, size - 1)
+
+
+def iter_file_range(path: str, start: int, end: int, chunk_size: int = 64 * 1024):
+    """Yield the bytes of `path` between start and end (inclusive)."""
+    remaining = end - start + 1
+    with open(path, "rb") as f:
+        f.seek(start)
+        while remaining > 0:
+            chunk = f.read(min(chunk_size, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+
+photo_stat_cache = PhotoStatCache()
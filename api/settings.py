@@ -30,4 +30,156 @@ RUN_TESTS = False
 
 RUNNING_ON_PROD = False
 if RUNNING_ON_PROD:
-    DB = "postgres:///localhost:5432"
\ No newline at end of file
+    DB = "postgres:///localhost:5432"
+
+# Uploads are stored under their sha256 digest, hashed while streaming
+UPLOAD_DIR = "uploads"
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+# Photos are fanned out as uploads/ab/cd/<name>; a depth of 0 keeps them flat
+UPLOAD_SHARD_DEPTH = 2
+UPLOAD_SHARD_WIDTH = 2
+
+# Where photos are kept: "files" (the uploads/ directory above) or "pack",
+# which appends them to large segment files with an offset index
+PHOTO_STORE = "files"
+PHOTO_PACK_DIR = "uploads/.packs"
+PHOTO_PACK_SEGMENT_SIZE = 256 * 1024 * 1024
+# Segments with at least this fraction of deleted bytes are rewritten by compaction
+PHOTO_PACK_COMPACT_RATIO = 0.5
+
+# Limits checked from the image header before anything decodes an upload.
+# Pixels are counted over all frames of animated images.
+IMAGE_MAX_BYTES = 32 * 1024 * 1024
+IMAGE_MAX_PIXELS = 64_000_000
+IMAGE_MAX_FRAMES = 100
+
+# Upload normalization: after a post is created its photo is re-encoded in a
+# process pool with EXIF orientation applied, metadata stripped and the
+# longest side capped. NORMALIZE_FORMAT is "jpeg" (progressive) or "webp".
+NORMALIZE_UPLOADS = False
+NORMALIZE_WORKERS = 2
+NORMALIZE_MAX_DIMENSION = 2048
+NORMALIZE_FORMAT = "jpeg"
+NORMALIZE_QUALITY = 85
+
+# Placeholders: a tiny blurred preview returned with every post as a data URI
+# so feeds can paint before the photo arrives
+PLACEHOLDER_SIZE = 32
+PLACEHOLDER_QUALITY = 40
+
+# Object detection runs off the event loop on a "thread" or "process" pool.
+# Each worker loads its own model and uses INFERENCE_TORCH_THREADS threads;
+# requests beyond INFERENCE_QUEUE_SIZE pending images are rejected with 503.
+# Concurrent requests are batched: up to INFERENCE_BATCH_SIZE images that
+# arrive within INFERENCE_BATCH_WAIT_MS share one forward pass at
+# INFERENCE_IMGSZ pixels.
+YOLO_MODEL_PATH = "yolov8n.pt"  # Using the nano model for faster processing
+INFERENCE_EXECUTOR = "thread"
+INFERENCE_WORKERS = 1
+INFERENCE_TORCH_THREADS = 2
+INFERENCE_QUEUE_SIZE = 32
+INFERENCE_RETRY_AFTER = 2
+INFERENCE_IMGSZ = 640
+INFERENCE_BATCH_SIZE = 8
+INFERENCE_BATCH_WAIT_MS = 5
+# Detection backend: "torch" runs YOLO_MODEL_PATH with ultralytics;
+# "onnxruntime" and "openvino" run INFERENCE_ONNX_PATH, exported (and
+# optionally quantized to INT8) with `python inference_backends.py export`.
+INFERENCE_BACKEND = "torch"
+INFERENCE_ONNX_PATH = "yolov8n.onnx"
+INFERENCE_CONF_THRESHOLD = 0.25
+INFERENCE_IOU_THRESHOLD = 0.7
+INFERENCE_MAX_DETECTIONS = 300
+# JPEGs are decoded at 1/2, 1/4 or 1/8 scale as long as their longest side
+# stays at least INFERENCE_DECODE_SIZE pixels; boxed images are drawn at that
+# resolution. 0 always decodes at full resolution.
+INFERENCE_DECODE_SIZE = 1600
+# Longest side and JPEG quality of the boxed image in mode=preview responses
+DETECTION_PREVIEW_SIZE = 1024
+DETECTION_PREVIEW_QUALITY = 75
+# Composition scoring (composition.py) ranks candidate frames on a grid of
+# COMPOSITION_GRID cells along the photo's longest side, at COMPOSITION_SCALES
+# sizes from COMPOSITION_MIN_SCALE of the largest frame that fits up to all of
+# it. Responses include the COMPOSITION_TOP_K best frames per aspect ratio;
+# suggested_frame is the best one for the first ratio.
+COMPOSITION_ASPECT_RATIOS = ("9:16", "4:5", "1:1", "16:9")
+COMPOSITION_TOP_K = 3
+COMPOSITION_GRID = 64
+COMPOSITION_SCALES = 8
+COMPOSITION_MIN_SCALE = 0.4
+# Weight of the saliency map relative to one full-confidence detection
+COMPOSITION_SALIENCY_WEIGHT = 0.5
+# Most user frames scored (and added to a post's community heatmap) per request
+FRAME_SCORE_MAX_FRAMES = 1000
+# Load the model in the background at startup. When False it is loaded by the
+# first detection request, which suits workers that only serve feeds/photos.
+INFERENCE_WARMUP = True
+# Unix socket of a shared inference server (python inference_server.py) that
+# owns the model for all API workers. None runs inference in each worker.
+INFERENCE_SOCKET = None
+INFERENCE_MESSAGE_LIMIT = 64 * 1024 * 1024  # Largest server response in bytes
+# Seconds to wait for the server to accept a request and reply to it before
+# the request fails with 503
+INFERENCE_SERVER_TIMEOUT = 30
+
+# Detection responses are cached by upload digest in memory and, if
+# DETECTION_CACHE_DIR is set, on disk. Bump DETECTION_CACHE_VERSION whenever
+# the detection output changes so stale entries are no longer used.
+DETECTION_CACHE_VERSION = 5
+DETECTION_CACHE_MAX_BYTES = 64 * 1024 * 1024
+DETECTION_CACHE_DIR = None
+DETECTION_CACHE_DISK_MAX_BYTES = 1024 * 1024 * 1024
+
+# Community posts are analyzed once, in the background after upload, and the
+# result is stored in post_detections. Jobs that find the inference queue full
+# wait INFERENCE_RETRY_AFTER seconds and try again up to DETECT_ON_UPLOAD_RETRIES times.
+DETECT_ON_UPLOAD = True
+DETECT_ON_UPLOAD_RETRIES = 5
+
+# Batch detection (POST /api/detect-objects/batch/) keeps at most
+# DETECTION_BATCH_WINDOW images of a request in memory and in flight, however
+# many are sent. Images larger than DETECTION_BATCH_MAX_IMAGE_BYTES are skipped.
+DETECTION_BATCH_WINDOW = 16
+DETECTION_BATCH_MAX_IMAGES = 500
+DETECTION_BATCH_MAX_IMAGE_BYTES = IMAGE_MAX_BYTES
+
+# Admission control (admission.py): per route class, how many requests run at
+# once and how many more may wait, for up to ADMISSION_QUEUE_TIMEOUT seconds.
+# Requests beyond that are answered 429 with Retry-After.
+ADMISSION_CONTROL = True
+ADMISSION_LIMITS = {
+    "inference": (8, 16),  # Detection and frame scoring
+    "uploads": (4, 16),  # Post creation
+    "writes": (32, 64),  # Likes, comments, login and other small writes
+    "reads": (128, 512),  # Feeds, posts, photos and comments
+}
+ADMISSION_QUEUE_TIMEOUT = 10
+ADMISSION_RETRY_AFTER = 2
+
+# Logging (logs.py): LOG_FORMAT is "text" or "json". DEBUG records are kept
+# for a LOG_SAMPLE_RATE fraction of requests; LOG_POSTS_DUMP additionally
+# logs every post on each /posts/changed poll at DEBUG level.
+LOG_LEVEL = "INFO"
+LOG_FORMAT = "text"
+LOG_SAMPLE_RATE = 0.01
+LOG_QUEUE_SIZE = 10000
+LOG_POSTS_DUMP = False
+
+# Metrics (metrics.py), served in the Prometheus text format at /metrics.
+# Buckets in seconds for the request, query and pipeline stage histograms.
+METRICS_ENABLED = True
+METRICS_LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+# Orphaned photo collection: files no post references are moved to
+# uploads/.quarantine (or deleted) once they are older than the grace period.
+# An interval of 0 disables the in-process job; orphan_gc.py can run from cron.
+ORPHAN_GC_INTERVAL = 0
+ORPHAN_GC_GRACE = 24 * 3600
+ORPHAN_GC_QUARANTINE = True
+ORPHAN_GC_BATCH_SIZE = 1000
+
+# Photo serving: uploaded photo names never change, so browsers may keep them
+# for a year. The stat cache avoids re-validating paths on every request.
+PHOTO_CACHE_MAX_AGE = 31536000
+PHOTO_STAT_CACHE_SIZE = 4096
+PHOTO_STAT_CACHE_TTL = 60
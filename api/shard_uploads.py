@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+"""
+Migration script to move flat uploads into the sharded layout.
+
+Photos stored directly in uploads/ are moved to uploads/ab/cd/<name>. The
+migration runs online in two phases:
+
+1. Every flat file is hard-linked into its shard, in batches with a pause in
+   between, so both locations are readable.
+2. After a grace period longer than the API's photo stat cache TTL, the flat
+   names are removed, again in batches.
+
+Readers try the sharded path first and fall back to the flat one, so photos
+stay available throughout. The script can be interrupted and re-run.
+"""
+
+import argparse
+import itertools
+import os
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from settings import PHOTO_STAT_CACHE_TTL
+from storage import UPLOAD_DIR, iter_legacy_photos, shard_parts, place_photo, discard
+
+
+def batches(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        batch = list(itertools.islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+def shard_uploads(batch_size=500, pause=0.1, grace=PHOTO_STAT_CACHE_TTL + 1, dry_run=False):
+    print(f"Sharding flat files in {UPLOAD_DIR}/ ...")
+    movable = [(name, path) for name, path in iter_legacy_photos() if shard_parts(name)]
+    print(f"Found {len(movable)} files to move")
+    if dry_run or not movable:
+        return
+
+    # Phase 1: make every file readable from its shard
+    for done, batch in enumerate(batches(movable, batch_size), 1):
+        for name, path in batch:
+            place_photo(path, name, link=True)
+        print(f"Linked {min(done * batch_size, len(movable))}/{len(movable)} files")
+        time.sleep(pause)
+
+    # Let API workers drop cached flat paths before they disappear
+    print(f"Waiting {grace}s for cached photo paths to expire...")
+    time.sleep(grace)
+
+    # Phase 2: drop the flat names
+    for done, batch in enumerate(batches(movable, batch_size), 1):
+        for _, path in batch:
+            discard(path)
+        print(f"Removed {min(done * batch_size, len(movable))}/{len(movable)} flat files")
+        time.sleep(pause)
+
+    print("Migration completed successfully!")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Move flat uploads into the sharded layout")
+    parser.add_argument("--batch-size", type=int, default=500, help="Files per batch")
+    parser.add_argument("--pause", type=float, default=0.1, help="Seconds to sleep between batches")
+    parser.add_argument("--grace", type=float, default=PHOTO_STAT_CACHE_TTL + 1,
+                        help="Seconds to wait between linking and removing flat files")
+    parser.add_argument("--dry-run", action="store_true", help="Only count the files that would move")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    shard_uploads(batch_size=args.batch_size, pause=args.pause, grace=args.grace, dry_run=args.dry_run)
@@ -0,0 +1,345 @@
+"""
+Content-addressed storage for uploaded photos.
+
+Uploads are hashed while they stream to a temporary file and stored as
+`<sha256>.<ext>`. A PhotoBlob row counts how many posts use each file, so
+identical uploads share one copy and the file is removed only when the last
+post referencing it is deleted.
+
+Where the bytes live is up to the photo store selected by PHOTO_STORE. The
+default FileSystemStore keeps one file per photo in a fan-out layout,
+`uploads/ab/cd/<name>`, derived from the name itself so no lookup table is
+needed. Photos written before sharding may still sit directly in `uploads/`;
+every reader falls back to that flat location, which lets shard_uploads.py
+move files while the API keeps serving them. The alternative PackFileStore
+(see pack_store.py) appends photos to large segment files.
+"""
+
+import contextlib
+import hashlib
+import heapq
+import os
+import shutil
+import re
+import uuid
+from typing import Iterator, List, Optional, Tuple
+
+from backend import PhotoBlob
+from settings import (
+    UPLOAD_DIR, UPLOAD_CHUNK_SIZE, UPLOAD_SHARD_DEPTH,
+    UPLOAD_SHARD_WIDTH, PHOTO_STORE
+)
+
+TMP_DIR = os.path.join(UPLOAD_DIR, ".tmp")
+QUARANTINE_DIR = os.path.join(UPLOAD_DIR, ".quarantine")
+DEFAULT_EXTENSION = "jpg"
+# Leading characters the flat upload directory is listed by; see iter_legacy_photos
+LEGACY_LIST_PREFIX = 1
+
+_extension_re = re.compile(r"^[a-z0-9]{1,5}$")
+
+
+def ensure_upload_dirs():
+    os.makedirs(TMP_DIR, exist_ok=True)
+
+
+def temp_path() -> str:
+    """A fresh path in TMP_DIR to write a file to before it is stored."""
+    ensure_upload_dirs()
+    return os.path.join(TMP_DIR, uuid.uuid4().hex)
+
+
+def shard_parts(photo_uuid: str) -> List[str]:
+    """Directory components a photo is fanned out under, empty if it stays flat."""
+    parts = [
+        photo_uuid[i * UPLOAD_SHARD_WIDTH:(i + 1) * UPLOAD_SHARD_WIDTH]
+        for i in range(UPLOAD_SHARD_DEPTH)
+    ]
+    # Short or oddly named files can't be sharded by prefix
+    if len(photo_uuid) <= UPLOAD_SHARD_DEPTH * UPLOAD_SHARD_WIDTH or not all(p.isalnum() for p in parts):
+        return []
+    return parts
+
+
+def photo_path(photo_uuid: str) -> str:
+    """Location a photo is written to."""
+    return os.path.join(UPLOAD_DIR, *shard_parts(photo_uuid), photo_uuid)
+
+
+def legacy_photo_path(photo_uuid: str) -> str:
+    """Location of a photo stored before the sharded layout."""
+    return os.path.join(UPLOAD_DIR, photo_uuid)
+
+
+def candidate_paths(photo_uuid: str) -> Tuple[str, ...]:
+    """
+    Paths to probe, in order, when reading a photo.
+
+    The sharded path is probed again last so a file moved by the migration
+    between the first two checks is still found.
+    """
+    sharded, flat = photo_path(photo_uuid), legacy_photo_path(photo_uuid)
+    if sharded == flat:
+        return (flat,)
+    return (sharded, flat, sharded)
+
+
+def locate_photo(photo_uuid: str) -> Optional[str]:
+    """Path of a stored photo in either layout, or None if it doesn't exist."""
+    for path in candidate_paths(photo_uuid):
+        if os.path.exists(path):
+            return path
+    return None
+
+
+def place_photo(source: str, photo_uuid: str, link: bool = False) -> str:
+    """
+    Put `source` at the storage location of `photo_uuid`.
+
+    The file is moved unless `link` is set, in which case it is hard-linked
+    (or copied where links aren't supported) and `source` stays readable.
+    """
+    target = photo_path(photo_uuid)
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    if not link:
+        os.replace(source, target)
+        return target
+    try:
+        os.link(source, target)
+    except FileExistsError:
+        pass
+    except OSError:
+        shutil.copy2(source, target)
+    return target
+
+
+def _iter_flat_names(prefix: Optional[str] = None, prefix_length: int = 0) -> Iterator[str]:
+    """Names of photos directly in UPLOAD_DIR, in directory order, optionally only those under `prefix`."""
+    try:
+        with os.scandir(UPLOAD_DIR) as entries:
+            for entry in entries:
+                if entry.name.startswith(".") or not entry.is_file():
+                    continue
+                if prefix is None or entry.name[:prefix_length] == prefix:
+                    yield entry.name
+    except FileNotFoundError:
+        return
+
+
+def iter_legacy_photos(prefix_length: int = LEGACY_LIST_PREFIX) -> Iterator[Tuple[str, str]]:
+    """
+    Yield (photo_uuid, path) for photos stored directly in UPLOAD_DIR, sorted by name.
+
+    A directory can't be listed in order, and sorting a large flat one would
+    hold all of its names at once. Instead it is listed once to find the
+    name prefixes in use, then once per prefix, sorting only the names under
+    that prefix: with hex digests that keeps 1/16 of them in memory per
+    character of `prefix_length`.
+    """
+    prefixes = sorted({name[:prefix_length] for name in _iter_flat_names()})
+    for prefix in prefixes:
+        for name in sorted(_iter_flat_names(prefix, prefix_length)):
+            yield name, os.path.join(UPLOAD_DIR, name)
+
+
+def _iter_sharded(directory: str, depth: int) -> Iterator[Tuple[str, str]]:
+    try:
+        with os.scandir(directory) as listing:
+            entries = sorted(listing, key=lambda e: e.name)
+    except FileNotFoundError:
+        return
+    for entry in entries:
+        if depth == 0:
+            if entry.is_file() and not entry.name.startswith("."):
+                yield entry.name, entry.path
+        elif entry.is_dir() and len(entry.name) == UPLOAD_SHARD_WIDTH and entry.name.isalnum():
+            yield from _iter_sharded(entry.path, depth - 1)
+
+
+def iter_stored_photos() -> Iterator[Tuple[str, str]]:
+    """
+    Yield (photo_uuid, path) for every stored photo, sorted by name.
+
+    Shards are named after name prefixes, so walking them in order already
+    yields sorted names; only one shard directory, or one name prefix of
+    the flat directory, is held in memory at a time.
+    """
+    if UPLOAD_SHARD_DEPTH == 0:
+        return iter_legacy_photos()
+    return heapq.merge(iter_legacy_photos(), _iter_sharded(UPLOAD_DIR, UPLOAD_SHARD_DEPTH))
+
+
+def clean_extension(filename: Optional[str]) -> str:
+    """Extension to store an upload under, restricted to short alphanumerics."""
+    _, dot, ext = (filename or "").rpartition(".")
+    ext = ext.lower() if dot else ""
+    return ext if _extension_re.match(ext) else DEFAULT_EXTENSION
+
+
+def hash_file(path: str) -> Tuple[str, int]:
+    """Return (sha256 hex digest, size) of a file on disk."""
+    digest = hashlib.sha256()
+    size = 0
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(UPLOAD_CHUNK_SIZE), b""):
+            digest.update(chunk)
+            size += len(chunk)
+    return digest.hexdigest(), size
+
+
+async def receive_upload(file) -> Tuple[str, str, int]:
+    """
+    Stream an UploadFile into TMP_DIR, hashing it on the way.
+
+    Returns (digest, temporary path, size). The caller is responsible for
+    passing the result to store_blob or removing the temporary file.
+    """
+    tmp_path = temp_path()
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        with open(tmp_path, "wb") as buffer:
+            while True:
+                chunk = await file.read(UPLOAD_CHUNK_SIZE)
+                if not chunk:
+                    break
+                digest.update(chunk)
+                buffer.write(chunk)
+                size += len(chunk)
+    except BaseException:
+        discard(tmp_path)
+        raise
+    return digest.hexdigest(), tmp_path, size
+
+
+class PhotoStat:
+    """Result of looking up a photo in the FileSystemStore."""
+
+    __slots__ = ("path", "stat_result", "size", "etag")
+
+    def __init__(self, path: str, stat_result: os.stat_result):
+        self.path = path
+        self.stat_result = stat_result
+        self.size = stat_result.st_size
+        self.etag = f'"{stat_result.st_mtime_ns:x}-{stat_result.st_size:x}"'
+
+
+class FileSystemStore:
+    """One file per photo in UPLOAD_DIR, using the sharded layout."""
+
+    def lookup(self, photo_uuid: str) -> Optional[PhotoStat]:
+        for path in candidate_paths(photo_uuid):
+            try:
+                return PhotoStat(path, os.stat(path))
+            except OSError:
+                continue
+        return None
+
+    def exists(self, photo_uuid: str) -> bool:
+        return locate_photo(photo_uuid) is not None
+
+    def put(self, tmp_path: str, photo_uuid: str) -> None:
+        place_photo(tmp_path, photo_uuid)
+
+    def delete(self, photo_uuid: str) -> None:
+        discard(locate_photo(photo_uuid))
+
+    @contextlib.contextmanager
+    def local_path(self, photo_uuid: str):
+        """Path of the photo on disk, or None if it doesn't exist."""
+        yield locate_photo(photo_uuid)
+
+    def iter_photos(self) -> Iterator[Tuple[str, int, float]]:
+        """Yield (photo_uuid, size, mtime) of every stored photo, sorted by name."""
+        for name, path in iter_stored_photos():
+            try:
+                st = os.stat(path)
+            except FileNotFoundError:
+                continue
+            yield name, st.st_size, st.st_mtime
+
+    def quarantine(self, photo_uuid: str, now: float) -> bool:
+        """Move a photo aside into QUARANTINE_DIR. Returns False if it was already gone."""
+        path = locate_photo(photo_uuid)
+        if path is None:
+            return False
+        os.makedirs(QUARANTINE_DIR, exist_ok=True)
+        target = os.path.join(QUARANTINE_DIR, photo_uuid)
+        try:
+            shutil.move(path, target)
+        except FileNotFoundError:
+            # Another worker got to it first
+            return False
+        # Start the quarantine clock now
+        os.utime(target, (now, now))
+        return True
+
+
+def make_photo_store(kind: str = PHOTO_STORE):
+    if kind == "pack":
+        from pack_store import PackFileStore
+        return PackFileStore()
+    if kind != "files":
+        raise ValueError(f"Unknown photo store: {kind}")
+    return FileSystemStore()
+
+
+photo_store = make_photo_store()
+
+
+def store_blob(session, digest: str, tmp_path: str, size: int, filename: Optional[str]) -> Tuple[str, bool]:
+    """
+    Move a received upload into place and take a reference on it.
+
+    If a blob with the same digest already exists the temporary file is
+    dropped and the existing name is reused. Returns (photo_uuid, created)
+    where `created` tells whether a new file was written, so the caller can
+    remove it again if its transaction fails. The session is not committed.
+    """
+    blob = session.query(PhotoBlob).filter_by(digest=digest).first()
+    if blob is not None:
+        # Incremented in SQL, so concurrent writers (other API workers,
+        # dedupe_uploads.py) don't overwrite each other's counts
+        blob.ref_count = PhotoBlob.ref_count + 1
+        session.flush()
+        if photo_store.exists(blob.photo_uuid):
+            discard(tmp_path)
+            return blob.photo_uuid, False
+        # The row survived but the file didn't; restore it from this upload
+        photo_store.put(tmp_path, blob.photo_uuid)
+        return blob.photo_uuid, True
+
+    photo_uuid = f"{digest}.{clean_extension(filename)}"
+    photo_store.put(tmp_path, photo_uuid)
+    session.add(PhotoBlob(digest=digest, photo_uuid=photo_uuid, size=size, ref_count=1))
+    return photo_uuid, True
+
+
+def release_blob(session, photo_uuid: str) -> Optional[str]:
+    """
+    Drop one reference to a stored photo.
+
+    Returns the photo to remove from the photo store once the session is
+    committed when this was the last reference, otherwise None. Photos that predate content
+    addressing have no PhotoBlob row and are left alone.
+    """
+    blob = session.query(PhotoBlob).filter_by(photo_uuid=photo_uuid).first()
+    if blob is None:
+        return None
+    blob.ref_count = PhotoBlob.ref_count - 1
+    session.flush()
+    # Read back after the decrement, which now holds the row's write lock
+    if blob.ref_count > 0:
+        return None
+    session.delete(blob)
+    return photo_uuid
+
+
+def discard(path: Optional[str]):
+    """Remove a file if it exists."""
+    if not path:
+        return
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
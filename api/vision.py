@@ -0,0 +1,381 @@
+"""
+The YOLO detection pipeline: decoding, letterboxing, batched inference,
+framing (see composition.py), drawing and encoding.
+
+Phone photos are 12-48 MP while the model looks at INFERENCE_IMGSZ pixels,
+so JPEGs are decoded at a reduced resolution (see decode_image) and
+detections are mapped back to the pixel coordinates of the original.
+
+This module imports OpenCV, NumPy and (on first use) the inference backend,
+which together take seconds to load. Only inference workers import it, through
+the wrappers in detection.py, so API processes that never analyze an image
+don't pay for the vision stack.
+
+Every worker loads its own model (ultralytics models are not safe to share
+between threads) and pins torch/OpenCV to INFERENCE_TORCH_THREADS threads so
+several workers don't oversubscribe the CPU.
+"""
+
+import base64
+import logging
+import threading
+import time
+from typing import Dict, List, Optional, Tuple, Union
+
+import cv2
+import numpy as np
+
+from composition import grid_shape, saliency_map, suggest_frames
+from detection import DetectionError, POST_MODE
+from image_probe import ImageInfo, ImageRejected, check_image
+from metrics import detection_stage_duration
+from settings import (
+    INFERENCE_BACKEND, INFERENCE_TORCH_THREADS, INFERENCE_IMGSZ, INFERENCE_DECODE_SIZE, INFERENCE_BATCH_SIZE,
+    DETECTION_PREVIEW_SIZE, DETECTION_PREVIEW_QUALITY, COMPOSITION_ASPECT_RATIOS
+)
+
+logger = logging.getLogger(__name__)
+
+LETTERBOX_COLOR = (114, 114, 114)
+# (factor, flag) from the strongest reduction down
+REDUCED_DECODES = (
+    (8, cv2.IMREAD_REDUCED_COLOR_8),
+    (4, cv2.IMREAD_REDUCED_COLOR_4),
+    (2, cv2.IMREAD_REDUCED_COLOR_2),
+)
+
+
+_local = threading.local()
+
+
+def init_worker(torch_threads: int = INFERENCE_TORCH_THREADS):
+    """Executor initializer: pin thread counts and load this worker's model."""
+    if INFERENCE_BACKEND == "torch":
+        try:
+            import torch
+            torch.set_num_threads(torch_threads)
+        except ImportError:
+            pass
+    cv2.setNumThreads(torch_threads)
+    _local.threads = torch_threads
+    try:
+        get_model()
+    except DetectionError:
+        # Retried, and reported to the client, on first use
+        pass
+
+
+def get_model():
+    """This worker's YOLO detector (see inference_backends.py), loaded on first use."""
+    model = getattr(_local, "model", None)
+    if model is None:
+        try:
+            from inference_backends import load_detector
+            logger.info("Initializing YOLOv8 model (%s backend)...", INFERENCE_BACKEND)
+            model = load_detector(INFERENCE_BACKEND, threads=getattr(_local, "threads", INFERENCE_TORCH_THREADS))
+            logger.info("YOLOv8 model initialized successfully")
+        except Exception as e:
+            logger.exception("Error initializing YOLOv8 model")
+            raise DetectionError(500, "YOLOv8 model could not be initialized. Please try again later.")
+        _local.model = model
+    return model
+
+
+def warm_up(size: int = INFERENCE_IMGSZ) -> None:
+    """Load this worker's model and run it once, so the first real request doesn't pay for either."""
+    get_model().predict([np.full((size, size, 3), LETTERBOX_COLOR, np.uint8)], size)
+
+
+class DecodedImage:
+    """
+    An uploaded image decoded for detection, possibly at reduced resolution,
+    with the size of the original in pixels (after EXIF orientation).
+    """
+
+    __slots__ = ("pixels", "width", "height")
+
+    def __init__(self, pixels: np.ndarray, width: int, height: int):
+        self.pixels = pixels
+        self.width = width
+        self.height = height
+
+    @property
+    def scale(self) -> Tuple[float, float]:
+        """Factors from decoded to original x and y coordinates."""
+        decoded_height, decoded_width = self.pixels.shape[:2]
+        return self.width / decoded_width, self.height / decoded_height
+
+
+def reduced_decode_flag(width: int, height: int, min_side: int = INFERENCE_DECODE_SIZE) -> int:
+    """
+    The strongest IMREAD_REDUCED_COLOR_* reduction that keeps the longest
+    side at `min_side` pixels or more (and never below the inference size).
+    """
+    if min_side <= 0:
+        return cv2.IMREAD_COLOR
+    target = max(min_side, INFERENCE_IMGSZ)
+    for factor, flag in REDUCED_DECODES:
+        if max(width, height) // factor >= target:
+            return flag
+    return cv2.IMREAD_COLOR
+
+
+def decode_image(contents: bytes, min_side: int = INFERENCE_DECODE_SIZE,
+                 info: Optional[ImageInfo] = None) -> DecodedImage:
+    """
+    Decode an upload. JPEGs, whose decoder can scale by 1/2, 1/4 or 1/8 while
+    decoding, are decoded close to the size detection and drawing need
+    instead of at the full resolution of the photo.
+
+    `info` is the header already probed by the API; without it the header is
+    probed and checked against the IMAGE_MAX_* limits here, so nothing
+    oversized or unrecognized reaches the decoder either way.
+    """
+    start = time.perf_counter()
+    nparr = np.frombuffer(contents, np.uint8)
+    if len(nparr) == 0:
+        raise DetectionError(400, "Empty image file received")
+    if info is None:
+        try:
+            info = check_image(contents)
+        except ImageRejected as e:
+            raise DetectionError(e.status_code, e.detail)
+
+    flag = cv2.IMREAD_COLOR
+    width, height = info.display_size
+    if info.format == "jpeg":
+        flag = reduced_decode_flag(width, height, min_side)
+    img = cv2.imdecode(nparr, flag)
+    if img is None:
+        logger.debug("Failed to decode image")
+        raise DetectionError(400, "Could not decode image. Please try a different image format.")
+    if flag == cv2.IMREAD_COLOR:
+        # OpenCV applies the EXIF orientation, so this is the displayed size
+        height, width = img.shape[:2]
+    logger.debug("Decoded image of shape: %s (original %dx%d)", img.shape, width, height)
+    detection_stage_duration.observe(time.perf_counter() - start, "decode")
+    return DecodedImage(img, width, height)
+
+
+def letterbox(img: np.ndarray, size: int = INFERENCE_IMGSZ,
+              out: Optional[np.ndarray] = None) -> Tuple[np.ndarray, float, Tuple[int, int]]:
+    """
+    Scale `img` to fit a `size` x `size` square, keeping its aspect ratio,
+    and pad the rest. Returns the square image, the scale factor and the
+    (x, y) padding needed to map coordinates back.
+
+    The square is drawn into `out` if given, so batches can reuse one buffer.
+    """
+    height, width = img.shape[:2]
+    scale = min(size / height, size / width)
+    new_width, new_height = round(width * scale), round(height * scale)
+    pad_x, pad_y = (size - new_width) // 2, (size - new_height) // 2
+    canvas = np.empty((size, size, 3), np.uint8) if out is None else out
+    canvas[:pad_y] = LETTERBOX_COLOR
+    canvas[pad_y + new_height:] = LETTERBOX_COLOR
+    canvas[:, :pad_x] = LETTERBOX_COLOR
+    canvas[:, pad_x + new_width:] = LETTERBOX_COLOR
+    inner = canvas[pad_y:pad_y + new_height, pad_x:pad_x + new_width]
+    if (new_width, new_height) != (width, height):
+        cv2.resize(img, (new_width, new_height), dst=inner, interpolation=cv2.INTER_LINEAR)
+    else:
+        inner[...] = img
+    return canvas, scale, (pad_x, pad_y)
+
+
+def canvas_buffer(count: int, size: int = INFERENCE_IMGSZ) -> np.ndarray:
+    """Letterbox squares for a batch of `count` images, reused by this worker from batch to batch."""
+    canvases = getattr(_local, "canvases", None)
+    if canvases is None or len(canvases) < count or canvases.shape[1] != size:
+        canvases = np.empty((max(count, INFERENCE_BATCH_SIZE), size, size, 3), np.uint8)
+        _local.canvases = canvases
+    return canvases[:count]
+
+
+def to_original(xyxy: np.ndarray, img: DecodedImage, scale: float, pad: Tuple[int, int]) -> np.ndarray:
+    """Boxes on a letterbox square to integer pixel coordinates of the original image."""
+    # Undo the letterbox, then the reduced decode
+    scale_x, scale_y = img.scale
+    scale_x, scale_y = scale_x / scale, scale_y / scale
+    pad_x, pad_y = pad
+    boxes = (xyxy - (pad_x, pad_y, pad_x, pad_y)) * (scale_x, scale_y, scale_x, scale_y)
+    np.clip(boxes, 0, (img.width, img.height, img.width, img.height), out=boxes)
+    return boxes.astype(int)
+
+
+def infer_batch(imgs: List[DecodedImage], size: int = INFERENCE_IMGSZ) -> List[List[Dict]]:
+    """
+    Run YOLO on several decoded images in one forward pass and return each
+    one's detections, in the pixel coordinates of the original images.
+    """
+    start = time.perf_counter()
+    canvases = canvas_buffer(len(imgs), size)
+    boxed = [letterbox(img.pixels, size, canvas)[1:] for img, canvas in zip(imgs, canvases)]
+    try:
+        model = get_model()
+        results = model.predict(list(canvases), size)
+    except DetectionError:
+        raise
+    except Exception as yolo_err:
+        logger.exception("YOLOv8 inference error")
+        raise DetectionError(500, f"YOLOv8 processing error: {str(yolo_err)}")
+
+    names = model.names
+    batch_detections = []
+    for (xyxy, confidences, classes), (scale, pad), img in zip(results, boxed, imgs):
+        # One conversion to Python objects per array instead of per box
+        boxes = to_original(xyxy, img, scale, pad).tolist()
+        batch_detections.append([
+            {"box": box, "confidence": confidence, "class": names[cls]}
+            for box, confidence, cls in zip(boxes, confidences.tolist(), classes.tolist())
+        ])
+    detection_stage_duration.observe(time.perf_counter() - start, "infer")
+    return batch_detections
+
+
+def infer(img: DecodedImage) -> List[Dict]:
+    """Run YOLO on a single decoded image and return its detections."""
+    return infer_batch([img])[0]
+
+
+def draw(img: DecodedImage, detections: List[Dict], max_side: Optional[int] = None) -> np.ndarray:
+    """
+    Draw the detections onto the decoded pixels, in place, or onto a copy
+    scaled down to `max_side` pixels if the decoded image is larger.
+    """
+    start = time.perf_counter()
+    pixels = img.pixels
+    if max_side and max(pixels.shape[:2]) > max_side:
+        factor = max_side / max(pixels.shape[:2])
+        size = (max(1, round(pixels.shape[1] * factor)), max(1, round(pixels.shape[0] * factor)))
+        pixels = cv2.resize(pixels, size, interpolation=cv2.INTER_AREA)
+    # From original coordinates to the pixels drawn on
+    scale_x, scale_y = pixels.shape[1] / img.width, pixels.shape[0] / img.height
+    for det in detections:
+        x1, y1, x2, y2 = det["box"]
+        x1, x2 = round(x1 * scale_x), round(x2 * scale_x)
+        y1, y2 = round(y1 * scale_y), round(y2 * scale_y)
+        cv2.rectangle(pixels, (x1, y1), (x2, y2), (0, 255, 0), 2)
+        cv2.putText(pixels, f"{det['class']} {det['confidence']:.2f}",
+                    (x1, y1 - 5), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 0), 2)
+    detection_stage_duration.observe(time.perf_counter() - start, "draw")
+    return pixels
+
+
+def jpeg_buffer(pixels: np.ndarray, quality: Optional[int] = None) -> np.ndarray:
+    """The JPEG encoding of `pixels` in OpenCV's output array, which base64 can read without a copy."""
+    start = time.perf_counter()
+    params = [cv2.IMWRITE_JPEG_QUALITY, quality] if quality else []
+    try:
+        ok, buffer = cv2.imencode('.jpg', pixels, params)
+        if not ok:
+            raise ValueError("imencode failed")
+        detection_stage_duration.observe(time.perf_counter() - start, "encode")
+        return buffer
+    except Exception as enc_err:
+        logger.exception("Error encoding image")
+        raise DetectionError(500, f"Image encoding error: {str(enc_err)}")
+
+
+def encode_jpeg(pixels: np.ndarray, quality: Optional[int] = None) -> bytes:
+    return jpeg_buffer(pixels, quality).tobytes()
+
+
+def render(pixels: np.ndarray, quality: Optional[int] = None) -> str:
+    """The image as a base64 JPEG."""
+    return base64.b64encode(jpeg_buffer(pixels, quality)).decode('ascii')
+
+
+def saliency(img: DecodedImage) -> np.ndarray:
+    """Saliency map of the image on the composition scoring grid."""
+    # Shrink first, so the grayscale copy is grid-sized rather than photo-sized
+    small = cv2.resize(img.pixels, grid_shape(img.width, img.height), interpolation=cv2.INTER_AREA)
+    # float32, as stored with posts, so later scoring uses exactly this map
+    return saliency_map(cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)).astype(np.float32)
+
+
+def build_response(img: DecodedImage, detections: List[Dict], mode: str = "full") -> Dict:
+    """
+    The detect-objects response body for a decoded image and its detections.
+
+    "full" includes the boxed image as base64, "preview" a downscaled one,
+    "boxes" no image at all and "binary" the boxed JPEG as raw bytes under
+    "boxed_jpeg", for the API to send outside the JSON. POST_MODE is "boxes"
+    plus the saliency grid as base64 float32 under "saliency", to store
+    with a post.
+
+    Boxes and frames are in the pixels of the original photo, whose size is
+    "image_size". The boxed image is drawn on the decoded pixels, which may
+    be smaller (reduced decode, preview), so its own size is given as
+    "boxed_image_size".
+    """
+    logger.debug("Processed %d detections", len(detections))
+    start = time.perf_counter()
+    salient = saliency(img)
+    frames = suggest_frames(detections, img.width, img.height, saliency=salient)
+    detection_stage_duration.observe(time.perf_counter() - start, "frame")
+    response = {
+        "detected_objects": detections,
+        # Best frame of the first aspect ratio, for clients that want just one
+        "suggested_frame": frames[COMPOSITION_ASPECT_RATIOS[0]][0],
+        "suggested_frames": frames,
+        "image_size": {"width": img.width, "height": img.height},
+    }
+    if mode == POST_MODE:
+        response["saliency"] = base64.b64encode(salient.tobytes()).decode('ascii')
+    if mode in ("boxes", POST_MODE):
+        return response
+    pixels = draw(img, detections, DETECTION_PREVIEW_SIZE if mode == "preview" else None)
+    response["boxed_image_size"] = {"width": pixels.shape[1], "height": pixels.shape[0]}
+    if mode == "full":
+        response["boxed_image"] = render(pixels)
+    elif mode == "preview":
+        response["boxed_image"] = render(pixels, DETECTION_PREVIEW_QUALITY)
+    elif mode == "binary":
+        response["boxed_jpeg"] = encode_jpeg(pixels)
+    return response
+
+
+def run_detection_batch(uploads: List[bytes], modes: Optional[List[str]] = None,
+                        infos: Optional[List[Optional[ImageInfo]]] = None) -> List[Union[Dict, DetectionError]]:
+    """
+    Full pipeline for a batch of uploaded images, each with its response
+    mode (see build_response) and probed header, if known. Returns, in
+    order, each image's response body or the DetectionError it failed with,
+    so one bad image doesn't fail the rest of its batch.
+    """
+    modes = modes or ["full"] * len(uploads)
+    infos = infos or [None] * len(uploads)
+    outputs = [None] * len(uploads)
+    decoded = []
+    for i, contents in enumerate(uploads):
+        try:
+            decoded.append((i, decode_image(contents, info=infos[i])))
+        except DetectionError as e:
+            outputs[i] = e
+
+    if decoded:
+        try:
+            batch_detections = infer_batch([img for _, img in decoded])
+        except DetectionError as e:
+            for i, _ in decoded:
+                outputs[i] = e
+            return outputs
+        for j, detections in enumerate(batch_detections):
+            i, img = decoded[j]
+            # Drop each image as soon as its response is built, so a batch
+            # doesn't hold on to all of its decoded photos until the end
+            decoded[j] = None
+            try:
+                outputs[i] = build_response(img, detections, modes[i])
+            except DetectionError as e:
+                outputs[i] = e
+    return outputs
+
+
+def run_detection(contents: bytes, mode: str = "full") -> Dict:
+    """Full pipeline for one uploaded image; returns the detect-objects response body."""
+    result = run_detection_batch([contents], [mode])[0]
+    if isinstance(result, DetectionError):
+        raise result
+    return result
@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+"""
+Compare inference backends for accuracy and latency.
+
+Runs every photo in a directory through each backend and reports per-image
+latency percentiles, batched throughput and agreement with the PyTorch
+backend: the share of its detections found (recall) and of the backend's
+detections it confirms (precision) at IoU >= 0.5 with the same class, and
+the mean IoU of matched boxes.
+
+A backend is given as NAME or NAME:MODEL_PATH, so float and INT8 exports can
+be compared side by side.
+
+Usage:
+    python benchmarks/bench_backends.py --images uploads/ \\
+        --backends torch onnxruntime:yolov8n.onnx onnxruntime:yolov8n-int8.onnx openvino:yolov8n.onnx
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "api"))
+
+import cv2
+import numpy as np
+
+from settings import INFERENCE_IMGSZ, INFERENCE_TORCH_THREADS
+from inference_backends import load_detector
+from vision import letterbox
+
+
+def load_canvases(directory, size, limit):
+    canvases = []
+    for root, _, names in os.walk(directory):
+        for name in sorted(names):
+            if len(canvases) >= limit:
+                return canvases
+            if not name.lower().endswith((".jpg", ".jpeg", ".png", ".webp")):
+                continue
+            img = cv2.imread(os.path.join(root, name), cv2.IMREAD_COLOR)
+            if img is not None:
+                canvases.append(letterbox(img, size)[0])
+    return canvases
+
+
+def iou(box, boxes):
+    width = np.clip(np.minimum(box[2], boxes[:, 2]) - np.maximum(box[0], boxes[:, 0]), 0, None)
+    height = np.clip(np.minimum(box[3], boxes[:, 3]) - np.maximum(box[1], boxes[:, 1]), 0, None)
+    inter = width * height
+    areas = (box[2] - box[0]) * (box[3] - box[1]) + (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+    return inter / (areas - inter + 1e-9)
+
+
+def agreement(reference, candidate, threshold=0.5):
+    """(matched, reference count, candidate count, IoUs of matches) for one image."""
+    ref_boxes, _, ref_cls = reference
+    boxes, conf, cls = candidate
+    used = np.zeros(len(ref_boxes), dtype=bool)
+    ious = []
+    for i in np.argsort(-conf):
+        candidates = np.flatnonzero((ref_cls == cls[i]) & ~used)
+        if not len(candidates):
+            continue
+        overlaps = iou(boxes[i], ref_boxes[candidates])
+        best = overlaps.argmax()
+        if overlaps[best] >= threshold:
+            used[candidates[best]] = True
+            ious.append(float(overlaps[best]))
+    return len(ious), len(ref_boxes), len(boxes), ious
+
+
+def run_backend(spec, canvases, size, threads, batch_size):
+    name, _, path = spec.partition(":")
+    detector = load_detector(name, path or None, threads)
+    detector.predict(canvases[:1], size)
+
+    outputs, latencies = [], []
+    for canvas in canvases:
+        start = time.perf_counter()
+        outputs.extend(detector.predict([canvas], size))
+        latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    for i in range(0, len(canvases), batch_size):
+        detector.predict(canvases[i:i + batch_size], size)
+    throughput = len(canvases) / (time.perf_counter() - start)
+    return outputs, latencies, throughput
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+def main(args):
+    canvases = load_canvases(args.images, args.imgsz, args.limit)
+    if not canvases:
+        sys.exit(f"No images found in {args.images}")
+    print(f"{len(canvases)} images at {args.imgsz}px, {args.threads} threads")
+
+    reference, _, _ = run_backend("torch", canvases, args.imgsz, args.threads, args.batch_size)
+
+    print(f"{'backend':>36} {'p50 ms':>8} {'p95 ms':>8} {'img/s':>7} {'recall':>7} {'precision':>9} {'IoU':>6}")
+    for spec in args.backends:
+        outputs, latencies, throughput = run_backend(spec, canvases, args.imgsz, args.threads, args.batch_size)
+        matched = ref_total = cand_total = 0
+        ious = []
+        for ref, out in zip(reference, outputs):
+            m, r, c, i = agreement(ref, out)
+            matched, ref_total, cand_total = matched + m, ref_total + r, cand_total + c
+            ious.extend(i)
+        recall = matched / ref_total if ref_total else 1.0
+        precision = matched / cand_total if cand_total else 1.0
+        mean_iou = statistics.fmean(ious) if ious else 0.0
+        print(f"{spec:>36} {percentile(latencies, 50) * 1000:>8.1f} {percentile(latencies, 95) * 1000:>8.1f} "
+              f"{throughput:>7.1f} {recall:>7.3f} {precision:>9.3f} {mean_iou:>6.3f}")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Compare inference backends for accuracy and latency")
+    parser.add_argument("--images", required=True, help="Directory of photos")
+    parser.add_argument("--backends", nargs="+", default=["torch", "onnxruntime", "openvino"])
+    parser.add_argument("--imgsz", type=int, default=INFERENCE_IMGSZ)
+    parser.add_argument("--threads", type=int, default=INFERENCE_TORCH_THREADS)
+    parser.add_argument("--batch-size", type=int, default=8, help="Batch size for the throughput run")
+    parser.add_argument("--limit", type=int, default=200, help="Maximum number of images")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    main(parse_args())
@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""
+Benchmark composition scoring.
+
+Scores frames for synthetic detections on photos of several sizes and
+reports the number of candidate windows per aspect ratio and the median time
+to rank them, with and without a saliency map.
+
+Usage:
+    python benchmarks/bench_composition.py --detections 1 10 50 --ratios 9:16 4:5 1:1 16:9
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "api"))
+
+import numpy as np
+
+from settings import COMPOSITION_ASPECT_RATIOS, COMPOSITION_TOP_K
+import composition
+
+SIZES = ((4032, 3024), (3024, 4032), (1920, 1080))
+
+
+def synthetic_detections(count, width, height, rng):
+    detections = []
+    for _ in range(count):
+        w, h = rng.uniform(0.05, 0.4) * width, rng.uniform(0.05, 0.6) * height
+        x, y = rng.uniform(0, width - w), rng.uniform(0, height - h)
+        detections.append({
+            "box": [round(x), round(y), round(x + w), round(y + h)],
+            "confidence": round(float(rng.uniform(0.3, 1.0)), 2),
+            "class": "person" if rng.random() < 0.5 else "chair",
+        })
+    return detections
+
+
+def timed(fn, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return statistics.median(times) * 1000
+
+
+def main(args):
+    rng = np.random.default_rng(0)
+    print(f"{'photo':>10} {'detections':>10} {'windows/ratio':>14} {'ms':>7} {'ms saliency':>12}")
+    for width, height in SIZES:
+        grid = composition.grid_shape(width, height)
+        windows = statistics.mean(
+            len(composition.candidate_windows(composition.parse_ratio(r), width, height, grid)[0])
+            for r in args.ratios
+        )
+        gray = rng.integers(0, 256, grid[::-1]).astype(np.uint8)
+        for count in args.detections:
+            detections = synthetic_detections(count, width, height, rng)
+            plain = timed(lambda: composition.suggest_frames(detections, width, height, args.ratios, args.k),
+                          args.repeat)
+            salient = timed(lambda: composition.suggest_frames(
+                detections, width, height, args.ratios, args.k, composition.saliency_map(gray)), args.repeat)
+            print(f"{width}x{height:<5} {count:>10} {windows:>14.0f} {plain:>7.2f} {salient:>12.2f}")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark composition scoring")
+    parser.add_argument("--detections", type=int, nargs="+", default=[0, 1, 10, 50])
+    parser.add_argument("--ratios", nargs="+", default=list(COMPOSITION_ASPECT_RATIOS))
+    parser.add_argument("--k", type=int, default=COMPOSITION_TOP_K, help="Frames per aspect ratio")
+    parser.add_argument("--repeat", type=int, default=20, help="Runs per configuration")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    main(parse_args())
@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""
+Benchmark reduced-resolution decoding for detection.
+
+Decodes, letterboxes and renders a large JPEG with several decode sizes
+(0 means full resolution) and reports latency and the peak memory NumPy and
+OpenCV allocated per image. Uses a synthetic photo of the requested size
+unless --image is given; pass --model to include inference.
+
+Usage:
+    python benchmarks/bench_decode.py --megapixels 12 48 --decode-sizes 0 1600 800
+    python benchmarks/bench_decode.py --image photo.jpg --model
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "api"))
+
+import cv2
+import numpy as np
+
+from settings import INFERENCE_IMGSZ
+import vision
+
+
+def synthetic_jpeg(megapixels: float) -> bytes:
+    """A noisy gradient photo of about `megapixels` MP in 4:3."""
+    height = int((megapixels * 1e6 * 3 / 4) ** 0.5)
+    width = height * 4 // 3
+    rng = np.random.default_rng(0)
+    gradient = np.linspace(0, 255, width, dtype=np.float32)[None, :, None]
+    img = np.clip(gradient + rng.normal(0, 25, (height, width, 3)), 0, 255).astype(np.uint8)
+    ok, buffer = cv2.imencode(".jpg", img, [cv2.IMWRITE_JPEG_QUALITY, 90])
+    return buffer.tobytes()
+
+
+def run_once(contents: bytes, decode_size: int, with_model: bool):
+    tracemalloc.start()
+    start = time.perf_counter()
+    img = vision.decode_image(contents, min_side=decode_size)
+    decoded = time.perf_counter()
+    if with_model:
+        detections = vision.infer(img)
+    else:
+        vision.letterbox(img.pixels, INFERENCE_IMGSZ)
+        detections = []
+    inferred = time.perf_counter()
+    vision.build_response(img, detections)
+    done = time.perf_counter()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        "decode_ms": (decoded - start) * 1000,
+        "infer_ms": (inferred - decoded) * 1000,
+        "render_ms": (done - inferred) * 1000,
+        "total_ms": (done - start) * 1000,
+        "peak_mb": peak / 1e6,
+        "decoded": f"{img.pixels.shape[1]}x{img.pixels.shape[0]}",
+    }
+
+
+def main(args):
+    if args.model:
+        vision.warm_up()
+    if args.image:
+        with open(args.image, "rb") as f:
+            images = [(os.path.basename(args.image), f.read())]
+    else:
+        images = [(f"{mp:g} MP", synthetic_jpeg(mp)) for mp in args.megapixels]
+
+    stage = "infer" if args.model else "letterbox"
+    print(f"{'image':>10} {'decode':>7} {'decoded':>11} {'decode ms':>10} {stage + ' ms':>13} "
+          f"{'render ms':>10} {'total ms':>9} {'peak MB':>8}")
+    for label, contents in images:
+        for decode_size in args.decode_sizes:
+            runs = [run_once(contents, decode_size, args.model) for _ in range(args.repeat)]
+            median = {key: statistics.median(r[key] for r in runs) for key in runs[0] if key != "decoded"}
+            print(f"{label:>10} {decode_size or 'full':>7} {runs[0]['decoded']:>11} {median['decode_ms']:>10.1f} "
+                  f"{median['infer_ms']:>13.1f} {median['render_ms']:>10.1f} {median['total_ms']:>9.1f} "
+                  f"{median['peak_mb']:>8.1f}")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark reduced-resolution decoding")
+    parser.add_argument("--image", help="JPEG to use instead of synthetic photos")
+    parser.add_argument("--megapixels", type=float, nargs="+", default=[12, 48])
+    parser.add_argument("--decode-sizes", type=int, nargs="+", default=[0, 1600, 800])
+    parser.add_argument("--repeat", type=int, default=5, help="Runs per configuration")
+    parser.add_argument("--model", action="store_true", help="Include YOLO inference")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    main(parse_args())
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""
+Benchmark micro-batched YOLO detection.
+
+Sends concurrent detection requests through a BatchScheduler for several
+batch sizes and wait times and reports images per second and latency
+percentiles. Batch size 1 is the unbatched baseline.
+
+Usage:
+    python benchmarks/bench_detection_batching.py --image tests/test_image.jpg \\
+        --batch-sizes 1 4 8 --wait-ms 2 5 10 --requests 64 --concurrency 16
+"""
+
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "api"))
+
+from detection import InferencePool, BatchScheduler
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+async def run_config(contents, batch_size, wait_ms, requests, concurrency, executor, workers):
+    pool = InferencePool(kind=executor, workers=workers)
+    scheduler = BatchScheduler(pool, max_batch=batch_size, max_wait_ms=wait_ms, queue_size=requests)
+    try:
+        # Warm up: load the model in every worker
+        await asyncio.gather(*[scheduler.detect(contents) for _ in range(workers * batch_size)])
+
+        latencies = []
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def one():
+            async with semaphore:
+                start = time.perf_counter()
+                await scheduler.detect(contents)
+                latencies.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        await asyncio.gather(*[one() for _ in range(requests)])
+        elapsed = time.perf_counter() - start
+    finally:
+        pool.shutdown()
+
+    return {
+        "images_per_second": requests / elapsed,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+        "mean_ms": statistics.fmean(latencies) * 1000,
+    }
+
+
+async def main(args):
+    with open(args.image, "rb") as f:
+        contents = f.read()
+
+    print(f"{'batch':>6} {'wait ms':>8} {'img/s':>8} {'p50 ms':>8} {'p99 ms':>8}")
+    for batch_size in args.batch_sizes:
+        waits = [0] if batch_size == 1 else args.wait_ms
+        for wait_ms in waits:
+            result = await run_config(
+                contents, batch_size, wait_ms, args.requests,
+                args.concurrency, args.executor, args.workers
+            )
+            print(f"{batch_size:>6} {wait_ms:>8} {result['images_per_second']:>8.1f} "
+                  f"{result['p50_ms']:>8.1f} {result['p99_ms']:>8.1f}")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark micro-batched detection")
+    parser.add_argument("--image", default="tests/test_image.jpg", help="Image to send")
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 4, 8])
+    parser.add_argument("--wait-ms", type=float, nargs="+", default=[2, 5, 10])
+    parser.add_argument("--requests", type=int, default=64, help="Requests per configuration")
+    parser.add_argument("--concurrency", type=int, default=16, help="Requests in flight at once")
+    parser.add_argument("--executor", choices=["thread", "process"], default="thread")
+    parser.add_argument("--workers", type=int, default=1)
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    asyncio.run(main(parse_args()))
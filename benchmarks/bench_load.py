@@ -0,0 +1,267 @@
+#!/usr/bin/env python3
+"""
+Load test the API in process at several data sizes.
+
+For each size (number of posts) a fresh database and upload directory are
+seeded with seed_data.py and the app is started in its own process, with
+its lifespan, behind httpx's ASGI transport. Each endpoint is then hit with
+--concurrency requests in flight at once, and its throughput and p50, p95
+and p99 latency are reported. Latency includes the middlewares but no
+network or server overhead, so it is comparable between runs on the same
+machine rather than with production numbers.
+
+The same --seed gives the same data and the same request sequence. Each
+worker registers its own user, so the thumbs endpoints like a post and
+remove the like again without running into "already liked" errors.
+Detection requests send --image with a few random bytes appended after the
+image data, so every request misses the detection cache; pass
+--detect-cache to measure cache hits instead.
+
+--save writes the results to a JSON file, and --compare checks them against
+such a baseline: any endpoint whose p50 or p95 latency grew, or whose
+throughput dropped, by more than --threshold is flagged and the script
+exits with status 1.
+
+Usage:
+    python benchmarks/bench_load.py --sizes 1000 10000 50000 --save baseline.json
+    python benchmarks/bench_load.py --sizes 1000 10000 50000 --compare baseline.json --threshold 0.2
+    python benchmarks/bench_load.py --sizes 1000 --endpoints get_posts post_comments --requests 1000
+"""
+
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "api"))
+
+import seed_data
+import settings
+
+ENDPOINTS = ("get_posts", "get_posts_by_likes", "posts_changed", "post_comments", "thumbs", "detect_objects")
+# Results compared against a baseline
+COMPARED = (("p50_ms", 1), ("p95_ms", 1), ("rps", -1))
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+def build_requests(endpoint: str, rng: random.Random, data: dict, worker: dict) -> list:
+    """The requests of one iteration, as (name, method, url, httpx keyword arguments)."""
+    post_id = rng.randint(1, data["posts"])
+    if endpoint in ("get_posts", "get_posts_by_likes"):
+        # Mostly the first pages, as people scroll from the top
+        page = min(int(rng.expovariate(0.5)), max(0, data["posts"] // 18 - 1))
+        sort_by = "recent" if endpoint == "get_posts" else "likes"
+        return [(endpoint, "GET", "/posts/", {"params": {"sort_by": sort_by, "page": page}})]
+    if endpoint == "posts_changed":
+        # A client polling every few seconds, or coming back after hours
+        oldest = datetime.fromisoformat(data["oldest"])
+        since = datetime.fromisoformat(data["newest"]) - timedelta(seconds=rng.choice((5, 60, 3600, 86400)))
+        return [(endpoint, "GET", "/posts/changed", {"params": {"since": max(since, oldest).isoformat()}})]
+    if endpoint == "post_comments":
+        return [(endpoint, "GET", f"/posts/{post_id}/comments/", {})]
+    if endpoint == "thumbs":
+        auth = {"headers": {"Authorization": f"Bearer {worker['token']}"}}
+        return [("thumbs_up", "POST", f"/posts/{post_id}/thumbs-up/", auth),
+                ("thumbs_down", "POST", f"/posts/{post_id}/thumbs-down/", auth)]
+    if endpoint == "detect_objects":
+        contents = worker["image"] if worker["detect_cache"] else worker["image"] + rng.randbytes(16)
+        return [(endpoint, "POST", "/api/detect-objects/", {
+            "files": {"file": ("photo.jpg", contents, "image/jpeg")},
+            "params": {"mode": worker["detect_mode"]},
+        })]
+    raise ValueError(f"Unknown endpoint {endpoint}")
+
+
+async def run_worker(client, endpoint, iterations, rng, data, worker, samples):
+    for _ in range(iterations):
+        for name, method, url, kwargs in build_requests(endpoint, rng, data, worker):
+            start = time.perf_counter()
+            response = await client.request(method, url, **kwargs)
+            samples.setdefault(name, []).append((time.perf_counter() - start, response.status_code))
+
+
+async def run_endpoint(client, endpoint, requests, concurrency, warmup, seed, data, workers) -> dict:
+    """Send `requests` iterations of `endpoint` from `concurrency` workers; returns stats by request name."""
+    await run_worker(client, endpoint, warmup, random.Random(seed - 1), data, workers[0], {})
+    samples = {}
+    counts = [requests // concurrency + (i < requests % concurrency) for i in range(concurrency)]
+    start = time.perf_counter()
+    await asyncio.gather(*(
+        run_worker(client, endpoint, count, random.Random(seed * 1000 + i), data, workers[i], samples)
+        for i, count in enumerate(counts)
+    ))
+    elapsed = time.perf_counter() - start
+
+    stats = {}
+    for name, values in samples.items():
+        latencies = [seconds * 1000 for seconds, _ in values]
+        stats[name] = {
+            "requests": len(values),
+            "errors": sum(status >= 400 for _, status in values),
+            "rps": len(values) / elapsed,
+            "p50_ms": percentile(latencies, 50),
+            "p95_ms": percentile(latencies, 95),
+            "p99_ms": percentile(latencies, 99),
+        }
+    return stats
+
+
+async def wait_for_model(client, timeout: float = 300) -> str:
+    deadline = time.monotonic() + timeout
+    while True:
+        state = (await client.get("/ready")).json()["model"]
+        if state in ("ready", "failed") or time.monotonic() > deadline:
+            return state
+        await asyncio.sleep(0.2)
+
+
+async def drive(app, args, data) -> dict:
+    import httpx
+
+    with open(args.image, "rb") as f:
+        image = f.read()
+    results = {}
+    transport = httpx.ASGITransport(app=app)
+    async with app.router.lifespan_context(app), \
+            httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        workers = []
+        for i in range(args.concurrency):
+            response = await client.post("/users/register/", json={"username": f"bench{i}", "password": "benchmark"})
+            response.raise_for_status()
+            workers.append({"token": response.json()["token"], "image": image,
+                            "detect_cache": args.detect_cache, "detect_mode": args.detect_mode})
+
+        for endpoint in args.endpoints:
+            requests = args.requests
+            if endpoint == "detect_objects":
+                requests = args.detect_requests
+                state = await wait_for_model(client)
+                if state != "ready":
+                    print(f"  model is {state}, detection requests will fail", file=sys.stderr)
+            results.update(await run_endpoint(client, endpoint, requests, args.concurrency, args.warmup,
+                                              args.seed, data, workers))
+    return results
+
+
+def run_size(posts: int, args, connection):
+    """Child process: seed a fresh database with `posts` posts, load test it and send back the results."""
+    with tempfile.TemporaryDirectory(prefix="figart-load-") as data_dir:
+        seed_data.configure(data_dir)
+        settings.LOG_LEVEL = "WARNING"
+        settings.INFERENCE_WARMUP = "detect_objects" in args.endpoints
+        users = args.users or max(50, posts // 20)
+        data = seed_data.seed(users, posts, args.comments, args.likes, seed=args.seed)
+
+        import api_main
+        results = asyncio.run(drive(api_main.app, args, data))
+        connection.send({"data": {key: data[key] for key in ("users", "posts", "comments", "likes", "seconds")},
+                         "endpoints": results})
+        connection.close()
+
+
+def print_results(result: dict):
+    data = result["data"]
+    print(f"\n{data['posts']} posts, {data['users']} users, {data['comments']} comments, {data['likes']} likes "
+          f"(seeded in {data['seconds']:.1f}s)")
+    print(f"{'endpoint':>20} {'req/s':>9} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'errors':>7}")
+    for name, stats in result["endpoints"].items():
+        print(f"{name:>20} {stats['rps']:>9.1f} {stats['p50_ms']:>8.2f} {stats['p95_ms']:>8.2f} "
+              f"{stats['p99_ms']:>8.2f} {stats['errors']:>7}")
+
+
+def compare(results: dict, baseline: dict, threshold: float) -> list:
+    """Print the change against `baseline` for every endpoint run in both; returns the regressions."""
+    regressions = []
+    print(f"\nAgainst {baseline['created']} (threshold {threshold:.0%})")
+    print(f"{'posts':>7} {'endpoint':>20} " + " ".join(f"{key:>16}" for key, _ in COMPARED))
+    for size, result in results.items():
+        before = baseline["results"].get(size, {}).get("endpoints", {})
+        for name, stats in result["endpoints"].items():
+            if name not in before:
+                continue
+            cells, flagged = [], []
+            for key, direction in COMPARED:
+                old, new = before[name][key], stats[key]
+                change = (new - old) / old if old else 0.0
+                cells.append(f"{old:>7.1f} {change:>+7.0%}" + ("!" if change * direction > threshold else " "))
+                if change * direction > threshold:
+                    flagged.append(f"{key} {old:.1f} -> {new:.1f}")
+            if stats["errors"] > before[name]["errors"]:
+                flagged.append(f"errors {before[name]['errors']} -> {stats['errors']}")
+            print(f"{size:>7} {name:>20} " + " ".join(cells))
+            if flagged:
+                regressions.append(f"{size} posts, {name}: " + ", ".join(flagged))
+    return regressions
+
+
+def main(args):
+    config = {key: getattr(args, key) for key in ("requests", "detect_requests", "concurrency", "warmup",
+                                                  "users", "comments", "likes", "seed", "detect_mode")}
+    print(f"{args.requests} requests per endpoint ({args.detect_requests} for detection) "
+          f"at concurrency {args.concurrency}")
+
+    context = multiprocessing.get_context("spawn")
+    results = {}
+    for posts in args.sizes:
+        receiver, sender = context.Pipe(duplex=False)
+        process = context.Process(target=run_size, args=(posts, args, sender))
+        process.start()
+        try:
+            results[str(posts)] = receiver.recv()
+        except EOFError:
+            sys.exit(f"The load test with {posts} posts failed")
+        process.join()
+        print_results(results[str(posts)])
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump({"created": datetime.now().isoformat(timespec="seconds"), "python": platform.python_version(),
+                       "machine": platform.node(), "config": config, "results": results}, f, indent=2)
+        print(f"\nSaved to {args.save}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if baseline.get("config") != config:
+            print("\nWarning: the baseline was run with different options", file=sys.stderr)
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print("\nRegressions:\n  " + "\n  ".join(regressions))
+            sys.exit(1)
+        print("\nNo regressions")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Load test the API in process at several data sizes")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000], help="Numbers of posts to seed")
+    parser.add_argument("--endpoints", nargs="+", choices=ENDPOINTS, default=list(ENDPOINTS))
+    parser.add_argument("--requests", type=int, default=500, help="Requests per endpoint")
+    parser.add_argument("--detect-requests", type=int, default=32, help="Requests for detect_objects")
+    parser.add_argument("--concurrency", type=int, default=8, help="Requests in flight at once")
+    parser.add_argument("--warmup", type=int, default=5, help="Untimed requests before each endpoint")
+    parser.add_argument("--users", type=int, default=0, help="Users to seed (default: one per 20 posts, at least 50)")
+    parser.add_argument("--comments", type=float, default=3, help="Average comments per post")
+    parser.add_argument("--likes", type=float, default=10, help="Average likes per user")
+    parser.add_argument("--image", default="tests/test_image.jpg", help="Image sent to detect_objects")
+    parser.add_argument("--detect-mode", default="boxes", choices=["full", "preview", "boxes", "binary"])
+    parser.add_argument("--detect-cache", action="store_true", help="Send the same image every time")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--save", help="Write the results to this JSON file")
+    parser.add_argument("--compare", help="Baseline JSON file to check the results against")
+    parser.add_argument("--threshold", type=float, default=0.2, help="Relative change flagged as a regression")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    main(parse_args())
@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+"""
+Benchmark the detection pipeline stage by stage, with peak memory.
+
+Runs one photo through every stage a detect-objects request goes through
+(header probe, decode, letterbox, inference, post-processing, saliency,
+framing, drawing, JPEG and base64 encoding) and reports the median time of
+each stage per response mode, and the peak RSS above the process's
+footprint after imports and warm-up. Each mode runs in a fresh process so
+its peak isn't inflated by buffers left over from the modes before it.
+
+Uses a synthetic 12 MP photo unless --image is given. Without --model the
+inference stage is skipped and post-processing maps synthetic detections.
+
+Usage:
+    python benchmarks/bench_pipeline.py --megapixels 12 --modes full preview boxes binary
+    python benchmarks/bench_pipeline.py --image photo.jpg --model
+"""
+
+import argparse
+import base64
+import multiprocessing
+import os
+import resource
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "api"))
+
+import cv2
+import numpy as np
+
+from settings import INFERENCE_IMGSZ, DETECTION_PREVIEW_SIZE, DETECTION_PREVIEW_QUALITY
+from composition import suggest_frames
+from image_probe import check_image
+import vision
+
+STAGES = ("probe", "decode", "letterbox", "inference", "postprocess", "saliency", "framing", "draw", "encode")
+
+
+def memory_mb(field: str) -> float:
+    """
+    VmRSS (current) or VmHWM (peak) RSS in MB. The peak comes from getrusage
+    where /proc isn't available; it then can't be reset and includes
+    everything before the reset.
+    """
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith(field + ":"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return peak / (1024 * 1024 if sys.platform == "darwin" else 1024)
+
+
+def reset_peak_rss() -> None:
+    """Reset VmHWM to the current RSS (Linux only)."""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        pass
+
+
+def synthetic_jpeg(megapixels: float) -> bytes:
+    """A noisy gradient photo of about `megapixels` MP in 4:3."""
+    height = int((megapixels * 1e6 * 3 / 4) ** 0.5)
+    width = height * 4 // 3
+    rng = np.random.default_rng(0)
+    gradient = np.linspace(0, 255, width, dtype=np.float32)[None, :, None]
+    img = np.clip(gradient + rng.normal(0, 25, (height, width, 3)), 0, 255).astype(np.uint8)
+    ok, buffer = cv2.imencode(".jpg", img, [cv2.IMWRITE_JPEG_QUALITY, 90])
+    return buffer.tobytes()
+
+
+def synthetic_detections(count: int, size: int, rng):
+    """Raw detector output: boxes on the letterbox square, confidences and class ids."""
+    xy = rng.uniform(0, size * 0.7, (count, 2))
+    wh = rng.uniform(size * 0.05, size * 0.3, (count, 2))
+    return np.hstack([xy, xy + wh]).astype(np.float32), rng.uniform(0.3, 1.0, count).astype(np.float32), \
+        rng.integers(0, 80, count)
+
+
+def run_pipeline(contents: bytes, mode: str, with_model: bool, names, rng) -> list:
+    """Process `contents` once; returns the time at the end of each stage, after the start time."""
+    marks = [time.perf_counter()]
+    info = check_image(contents)
+    marks.append(time.perf_counter())
+    img = vision.decode_image(contents, info=info)
+    marks.append(time.perf_counter())
+    canvas, scale, pad = vision.letterbox(img.pixels, INFERENCE_IMGSZ, vision.canvas_buffer(1)[0])
+    marks.append(time.perf_counter())
+    if with_model:
+        xyxy, confidences, classes = vision.get_model().predict([canvas], INFERENCE_IMGSZ)[0]
+    else:
+        xyxy, confidences, classes = synthetic_detections(20, INFERENCE_IMGSZ, rng)
+    marks.append(time.perf_counter())
+    boxes = vision.to_original(xyxy, img, scale, pad).tolist()
+    detections = [{"box": box, "confidence": confidence, "class": names[cls]}
+                  for box, confidence, cls in zip(boxes, confidences.tolist(), classes.tolist())]
+    marks.append(time.perf_counter())
+    saliency = vision.saliency(img)
+    marks.append(time.perf_counter())
+    suggest_frames(detections, img.width, img.height, saliency=saliency)
+    marks.append(time.perf_counter())
+    if mode == "boxes":
+        return marks + [marks[-1]] * 2
+    preview = mode == "preview"
+    pixels = vision.draw(img, detections, DETECTION_PREVIEW_SIZE if preview else None)
+    marks.append(time.perf_counter())
+    quality = DETECTION_PREVIEW_QUALITY if preview else None
+    if mode == "binary":
+        vision.encode_jpeg(pixels, quality)
+    else:
+        base64.b64encode(vision.jpeg_buffer(pixels, quality)).decode("ascii")
+    marks.append(time.perf_counter())
+    return marks
+
+
+def run_mode(contents: bytes, mode: str, repeat: int, with_model: bool, connection):
+    """Child process: time `repeat` runs in one mode and send back the medians and peak RSS."""
+    rng = np.random.default_rng(0)
+    if with_model:
+        vision.warm_up()
+        names = vision.get_model().names
+    else:
+        names = {i: f"class{i}" for i in range(80)}
+    reset_peak_rss()
+    baseline = memory_mb("VmRSS")
+
+    # The first run pays for lazily allocated buffers and isn't timed
+    run_pipeline(contents, mode, with_model, names, rng)
+    times = {stage: [] for stage in STAGES}
+    for _ in range(repeat):
+        marks = run_pipeline(contents, mode, with_model, names, rng)
+        for stage, start, end in zip(STAGES, marks, marks[1:]):
+            times[stage].append((end - start) * 1000)
+
+    connection.send({
+        "stages": {stage: statistics.median(values) for stage, values in times.items()},
+        "peak_rss_mb": memory_mb("VmHWM") - baseline,
+    })
+    connection.close()
+
+
+def main(args):
+    if args.image:
+        with open(args.image, "rb") as f:
+            contents = f.read()
+    else:
+        contents = synthetic_jpeg(args.megapixels)
+    width, height = check_image(contents).display_size
+    print(f"{width}x{height} image of {len(contents) / 1e6:.1f} MB, {args.repeat} runs per mode"
+          f"{'' if args.model else ', inference skipped'}")
+
+    context = multiprocessing.get_context("spawn")
+    print(f"{'mode':>8} " + " ".join(f"{stage:>11}" for stage in STAGES) + f" {'total ms':>9} {'peak MB':>8}")
+    for mode in args.modes:
+        receiver, sender = context.Pipe(duplex=False)
+        process = context.Process(target=run_mode, args=(contents, mode, args.repeat, args.model, sender))
+        process.start()
+        result = receiver.recv()
+        process.join()
+        stages = result["stages"]
+        print(f"{mode:>8} " + " ".join(f"{stages[stage]:>11.2f}" for stage in STAGES)
+              + f" {sum(stages.values()):>9.2f} {result['peak_rss_mb']:>8.1f}")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark the detection pipeline stage by stage")
+    parser.add_argument("--image", help="Photo to use instead of a synthetic one")
+    parser.add_argument("--megapixels", type=float, default=12, help="Size of the synthetic photo")
+    parser.add_argument("--modes", nargs="+", default=["full", "preview", "boxes", "binary"])
+    parser.add_argument("--model", action="store_true", help="Include inference")
+    parser.add_argument("--repeat", type=int, default=10, help="Runs per mode")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    main(parse_args())
@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""
+Benchmark API cold start.
+
+Each run starts a fresh interpreter and measures how long importing
+api_main takes, how long the app takes to answer its first request once the
+lifespan startup has run, and, with --wait-model, how long until /ready
+reports the model as loaded. It also lists which heavy modules were already
+imported when the first response arrived; with --no-warmup that should be
+none of them.
+
+Usage:
+    python benchmarks/bench_startup.py --runs 5
+    python benchmarks/bench_startup.py --runs 3 --wait-model
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+API_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "api")
+
+HEAVY_MODULES = ["cv2", "numpy", "PIL.Image", "torch", "ultralytics"]
+
+CHILD = """
+import json, sys, time
+start = time.perf_counter()
+import settings
+settings.INFERENCE_WARMUP = {warmup}
+import api_main
+imported = time.perf_counter()
+from fastapi.testclient import TestClient
+result = {{"import_s": imported - start}}
+with TestClient(api_main.app) as client:
+    client.get("/ready")
+    result["first_response_s"] = time.perf_counter() - start
+    result["heavy_modules"] = [m for m in {heavy} if m in sys.modules]
+    if {wait_model}:
+        while True:
+            state = client.get("/ready").json()["model"]
+            if state in ("ready", "failed"):
+                break
+            time.sleep(0.05)
+        result["model_state"] = state
+        result["model_ready_s"] = time.perf_counter() - start
+print(json.dumps(result))
+"""
+
+
+def run_once(warmup, wait_model):
+    code = CHILD.format(warmup=warmup, wait_model=wait_model, heavy=HEAVY_MODULES)
+    output = subprocess.run(
+        [sys.executable, "-c", code], cwd=API_DIR, capture_output=True, text=True, check=True
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main(args):
+    results = [run_once(not args.no_warmup, args.wait_model) for _ in range(args.runs)]
+
+    for key in ("import_s", "first_response_s", "model_ready_s"):
+        values = [r[key] for r in results if key in r]
+        if values:
+            print(f"{key:>18}: median {statistics.median(values) * 1000:8.1f} ms  "
+                  f"min {min(values) * 1000:8.1f} ms  max {max(values) * 1000:8.1f} ms")
+    heavy = sorted({m for r in results for m in r["heavy_modules"]})
+    print(f"{'heavy modules':>18}: {', '.join(heavy) if heavy else 'none'} before the first response")
+    if args.wait_model:
+        print(f"{'model state':>18}: {', '.join(sorted({r['model_state'] for r in results}))}")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark API cold start")
+    parser.add_argument("--runs", type=int, default=5, help="Fresh interpreters to start")
+    parser.add_argument("--wait-model", action="store_true", help="Also time until the model is ready")
+    parser.add_argument("--no-warmup", action="store_true", help="Don't load the model in the background")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    main(parse_args())
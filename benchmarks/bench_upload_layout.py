@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+"""
+Benchmark photo lookup latency for the flat and sharded upload layouts.
+
+For each directory size a scratch directory is filled with empty files named
+like real uploads (sha256 digests), once flat and once fanned out the way
+storage.photo_path does it. We then time os.stat on random existing names
+(what get_photo does on a cache miss) and on missing names (the 404 path).
+
+Usage:
+    python benchmarks/bench_upload_layout.py --sizes 1000 10000 100000
+"""
+
+import argparse
+import hashlib
+import os
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "api"))
+
+from storage import shard_parts
+
+
+def make_names(count):
+    return [hashlib.sha256(str(i).encode()).hexdigest() + ".jpg" for i in range(count)]
+
+
+def populate(root, names, sharded):
+    for name in names:
+        directory = os.path.join(root, *shard_parts(name)) if sharded else root
+        os.makedirs(directory, exist_ok=True)
+        open(os.path.join(directory, name), "wb").close()
+
+
+def path_for(root, name, sharded):
+    return os.path.join(root, *shard_parts(name), name) if sharded else os.path.join(root, name)
+
+
+def time_lookups(root, names, sharded, lookups):
+    timings = []
+    for name in names[:lookups]:
+        path = path_for(root, name, sharded)
+        start = time.perf_counter()
+        try:
+            os.stat(path)
+        except FileNotFoundError:
+            pass
+        timings.append(time.perf_counter() - start)
+    timings.sort()
+    return {
+        "mean_us": statistics.fmean(timings) * 1e6,
+        "p99_us": timings[int(len(timings) * 0.99) - 1] * 1e6,
+    }
+
+
+def run(sizes, lookups):
+    print(f"{'files':>9} {'layout':>8} {'hit mean':>10} {'hit p99':>10} {'miss mean':>10} {'miss p99':>10}  (us)")
+    for size in sizes:
+        names = make_names(size)
+        missing = [hashlib.sha256(f"missing-{i}".encode()).hexdigest() + ".jpg" for i in range(lookups)]
+        for sharded in (False, True):
+            root = tempfile.mkdtemp(prefix="figart-layout-")
+            try:
+                populate(root, names, sharded)
+                sample = random.sample(names, min(lookups, len(names)))
+                hit = time_lookups(root, sample, sharded, lookups)
+                miss = time_lookups(root, missing, sharded, lookups)
+                layout = "sharded" if sharded else "flat"
+                print(f"{size:>9} {layout:>8} {hit['mean_us']:>10.2f} {hit['p99_us']:>10.2f} "
+                      f"{miss['mean_us']:>10.2f} {miss['p99_us']:>10.2f}")
+            finally:
+                shutil.rmtree(root, ignore_errors=True)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Compare photo lookup latency across upload layouts")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000], help="Directory sizes to test")
+    parser.add_argument("--lookups", type=int, default=5000, help="Lookups per measurement")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    run(args.sizes, args.lookups)
@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+"""
+Fill a fresh database and upload directory with synthetic data.
+
+Creates users, posts backed by real JPEG files, comments and likes directly
+in SQLite, so load tests run against a feed of known size. The same --seed
+always produces the same data, with times relative to when it runs. Posts
+share --images distinct photos through the usual content-addressed PhotoBlob
+rows; their creation times are spread over the last --days days. Every
+user's password is "benchmark".
+
+The database and uploads go to --data-dir instead of the API's own, which is
+done by changing the settings before anything imports backend, so call
+configure() first when using seed() from another script.
+
+Usage:
+    python benchmarks/seed_data.py --data-dir /tmp/figart-seed --posts 10000
+    python benchmarks/seed_data.py --data-dir /tmp/figart-seed --users 500 --posts 50000 --comments 5 --likes 20
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import random
+import sys
+import time
+from datetime import timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "api"))
+
+import cv2
+import numpy as np
+
+import settings
+
+PASSWORD = "benchmark"
+WORDS = ("nice", "light", "framing", "love", "the", "colors", "great", "shot", "sky", "crop", "tight", "wow")
+
+
+def configure(data_dir: str) -> None:
+    """Point the database and photo storage at `data_dir`. Must run before backend is imported."""
+    if "backend" in sys.modules:
+        raise RuntimeError("configure() must be called before backend is imported")
+    data_dir = os.path.abspath(data_dir)
+    os.makedirs(data_dir, exist_ok=True)
+    settings.DB = f"sqlite:///{os.path.join(data_dir, 'db.sqlite3')}"
+    settings.UPLOAD_DIR = os.path.join(data_dir, "uploads")
+    settings.PHOTO_PACK_DIR = os.path.join(data_dir, "uploads", ".packs")
+    settings.DETECTION_CACHE_DIR = None
+
+
+def synthetic_jpeg(index: int, width: int, height: int) -> bytes:
+    """A distinct noisy gradient photo for each index."""
+    rng = np.random.default_rng(index)
+    base = rng.uniform(0, 255, 3).astype(np.float32)
+    gradient = np.linspace(-80, 80, width, dtype=np.float32)[None, :, None]
+    img = np.clip(base + gradient + rng.normal(0, 20, (height, width, 3)), 0, 255).astype(np.uint8)
+    ok, buffer = cv2.imencode(".jpg", img, [cv2.IMWRITE_JPEG_QUALITY, 85])
+    return buffer.tobytes()
+
+
+def store_images(session, count: int, width: int, height: int) -> list:
+    """Write `count` photos to the photo store; returns their PhotoBlobs."""
+    from backend import PhotoBlob
+    from storage import store_blob, temp_path
+
+    blobs = []
+    for index in range(count):
+        contents = synthetic_jpeg(index, width, height)
+        path = temp_path()
+        with open(path, "wb") as f:
+            f.write(contents)
+        digest = hashlib.sha256(contents).hexdigest()
+        store_blob(session, digest, path, len(contents), "seed.jpg")
+        session.flush()
+        blob = session.query(PhotoBlob).filter_by(digest=digest).one()
+        blob.ref_count = 0
+        blobs.append(blob)
+    return blobs
+
+
+def seed(users: int, posts: int, comments: float, likes: float, images: int = 20, days: int = 30,
+         width: int = 1600, height: int = 1200, seed: int = 0) -> dict:
+    """
+    Insert the data into the configured database, which should be empty.
+    `comments` is per post and `likes` per user, on average. Post IDs run
+    from 1 to `posts`; returns the row counts, photo names and time range.
+    """
+    from backend import Comment, Post, User, init_db, session, utcnow
+    from storage import ensure_upload_dirs
+    from werkzeug.security import generate_password_hash
+
+    rng = random.Random(seed)
+    init_db()
+    ensure_upload_dirs()
+    start = time.perf_counter()
+
+    blobs = store_images(session, images, width, height)
+    # Hashing is deliberately slow, so every user shares one hash
+    password_hash = generate_password_hash(PASSWORD)
+    now = utcnow().replace(tzinfo=None)
+    oldest = now - timedelta(days=days)
+
+    session.execute(User.__table__.insert(), [
+        {"id": i + 1, "username": f"user{i}", "password_hash": password_hash, "thumbed_posts": []}
+        for i in range(users)
+    ])
+
+    post_rows = []
+    for i in range(posts):
+        blob = blobs[i % len(blobs)]
+        blob.ref_count += 1
+        created = oldest + timedelta(seconds=rng.uniform(0, days * 86400))
+        post_rows.append({
+            "id": i + 1, "photo_uuid": blob.photo_uuid, "user_id": rng.randint(1, users),
+            "created_at": created, "updated_at": created, "thumbs_up": 0, "original_size": blob.size,
+        })
+
+    # Likes are skewed towards a few popular posts, as on a real feed
+    thumbed = {}
+    for user_id in range(1, users + 1):
+        count = min(posts, int(rng.expovariate(1 / likes))) if likes else 0
+        liked = {min(posts, int(rng.paretovariate(1.2))) if rng.random() < 0.3 else rng.randint(1, posts)
+                 for _ in range(count)}
+        for post_id in liked:
+            post_rows[post_id - 1]["thumbs_up"] += 1
+        if liked:
+            thumbed[user_id] = sorted(liked)
+    session.execute(Post.__table__.insert(), post_rows)
+    for user_id, liked in thumbed.items():
+        session.execute(User.__table__.update().where(User.id == user_id).values(thumbed_posts=liked))
+
+    comment_rows = []
+    for post in post_rows:
+        for _ in range(int(rng.expovariate(1 / comments)) if comments else 0):
+            content = " ".join(rng.choice(WORDS) for _ in range(rng.randint(1, 8)))
+            comment_rows.append({
+                "post_id": post["id"], "user_id": rng.randint(1, users), "content": content[:60],
+                "created_at": post["created_at"] + timedelta(seconds=rng.uniform(0, (now - post["created_at"]).total_seconds())),
+            })
+    if comment_rows:
+        session.execute(Comment.__table__.insert(), comment_rows)
+    session.commit()
+
+    return {
+        "users": users,
+        "posts": posts,
+        "comments": len(comment_rows),
+        "likes": sum(len(liked) for liked in thumbed.values()),
+        "images": len(blobs),
+        "photos": [blob.photo_uuid for blob in blobs],
+        "oldest": oldest.isoformat(),
+        "newest": now.isoformat(),
+        "seconds": time.perf_counter() - start,
+    }
+
+
+def main(args):
+    configure(args.data_dir)
+    summary = seed(args.users, args.posts, args.comments, args.likes, args.images, args.days, seed=args.seed)
+    print(f"{summary['users']} users, {summary['posts']} posts, {summary['comments']} comments and "
+          f"{summary['likes']} likes on {summary['images']} photos in {summary['seconds']:.1f}s")
+    with open(os.path.join(args.data_dir, "seed.json"), "w") as f:
+        json.dump(summary, f, indent=2)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Fill a fresh database with synthetic users, posts, comments and likes")
+    parser.add_argument("--data-dir", required=True, help="Directory for the database and uploads")
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--posts", type=int, default=1000)
+    parser.add_argument("--comments", type=float, default=3, help="Average comments per post")
+    parser.add_argument("--likes", type=float, default=10, help="Average likes per user")
+    parser.add_argument("--images", type=int, default=20, help="Distinct photos shared by the posts")
+    parser.add_argument("--days", type=int, default=30, help="Spread posts over this many days")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    if os.path.exists(os.path.join(args.data_dir, "db.sqlite3")):
+        parser.error(f"{args.data_dir} already has a database")
+    return args
+
+
+if __name__ == "__main__":
+    main(parse_args())
@@ -25,7 +25,7 @@ export default function AIPage() {
   const [objectDetectionComplete, setObjectDetectionComplete] = useState(false);
   const [boxedImageUrl, setBoxedImageUrl] = useState<string | null>(null);
   const [detectedObjects, setDetectedObjects] = useState<DetectionObject[]>([]);
-  const [suggestedFrame, setSuggestedFrame] = useState<{ x: number; y: number; width: number; height: number } | null>(null);
+  const [imageSize, setImageSize] = useState<{ width: number; height: number } | null>(null);
   const [imagesLoaded, setImagesLoaded] = useState<Record<string, boolean>>({});
   const [animationState, setAnimationState] = useState<'initial' | 'showingBoxes' | 'scanningFrames' | 'transitionToFrame' | 'showingFrame'>('initial');
   const [currentScanningFrame, setCurrentScanningFrame] = useState<{ x: number; y: number; width: number; height: number } | null>(null);
@@ -62,7 +62,7 @@ export default function AIPage() {
       const objectUrl = URL.createObjectURL(file);
       setImageUrl(objectUrl);
       setImageFile(file); // Save the actual file object
-      setSuggestedFrame(null);
+      setImageSize(null);
       setBoxedImageUrl(null);
       setDetectedObjects([]);
       setObjectDetectionComplete(false);
@@ -99,76 +99,61 @@ export default function AIPage() {
     }
   });
   
-  const scanFrames = () => {
-    // First check if we have an image URL
-    if (!imageUrl) {
-      console.error("Cannot scan frames: No image URL available");
-      return;
-    }
-    
-    // If we have imageUrl but no suggestedFrame, create a default one
-    if (!suggestedFrame) {
-      console.log("Creating default suggested frame");
-      const defaultFrame = {
-        x: 550,
-        y: 20,
-        width: 475,
-        height: 812
-      };
-      
-      // Set the suggested frame
-      setSuggestedFrame(defaultFrame);
-      
-      // Use the default frame for scanning
-      console.log("Starting frame scanning with default frame");
-      scanWithFrame(defaultFrame);
-      return;
-    }
-    
-    // If we have both imageUrl and suggestedFrame, proceed normally
-    console.log("Starting frame scanning with frame:", suggestedFrame);
-    scanWithFrame(suggestedFrame);
+  // A centered 9:16 frame, for responses without suggested frames
+  const defaultFrame = (size: { width: number; height: number }) => {
+    const height = Math.min(size.height, Math.floor(size.width * 16 / 9));
+    const width = Math.floor(height * 9 / 16);
+    return {
+      x: Math.floor((size.width - width) / 2),
+      y: Math.floor((size.height - height) / 2),
+      width,
+      height
+    };
   };
   
-  const scanWithFrame = (frame: { x: number; y: number; width: number; height: number }) => {
-    // Frame properties
-    const frameWidth = frame.width;
-    const frameHeight = frame.height;
+  const scanWithFrame = (
+    frame: { x: number; y: number; width: number; height: number },
+    candidates: Array<{ x: number; y: number; width: number; height: number }>,
+    size: { width: number; height: number },
+    objects: DetectionObject[]
+  ) => {
+    // Frames and boxes are in the photo's own pixels, as given by image_size
+    const imgWidth = size.width;
+    const imgHeight = size.height;
+    const frameWidth = Math.min(frame.width, imgWidth);
+    const frameHeight = Math.min(frame.height, imgHeight);
     
-    // Get image dimensions (we'll use a fake value for the simulation)
-    const imgWidth = 1200;
-    const imgHeight = 900;
+    // Ensure we don't exceed image boundaries
+    const maxX = imgWidth - frameWidth;
+    const maxY = imgHeight - frameHeight;
     
-    // Calculate step size for scanning (we'll scan ~8 positions)
-    const stepX = Math.floor((imgWidth - frameWidth) / 3);
-    const stepY = Math.floor((imgHeight - frameHeight) / 2);
+    // Calculate step size for scanning (we'll scan ~12 positions); a frame as
+    // wide or as tall as the photo has a single position along that side
+    const stepX = Math.max(1, Math.floor(maxX / 3));
+    const stepY = Math.max(1, Math.floor(maxY / 2));
     
     // Generate all scan positions
     const scanPositions: Array<{x: number, y: number}> = [];
     
-    // Ensure we don't exceed image boundaries
-    const maxY = imgHeight - frameHeight;
-    
     for (let y = 0; y <= maxY; y += stepY) {
-      for (let x = 0; x <= imgWidth - frameWidth; x += stepX) {
-        // Skip positions that would go beyond the image bounds
-        if (x + frameWidth <= imgWidth && y + frameHeight <= imgHeight) {
-          // Check if this frame would intersect with any detected object box
-          const adjustedX = adjustFrameToAvoidSplittingObjects(x, y, frameWidth, frameHeight);
-          // Ensure y is also within bounds
-          const boundedY = Math.min(y, maxY);
-          scanPositions.push({x: adjustedX, y: boundedY});
-        }
+      for (let x = 0; x <= maxX; x += stepX) {
+        // Check if this frame would intersect with any detected object box
+        const adjustedX = adjustFrameToAvoidSplittingObjects(x, y, frameWidth, frameHeight, objects, maxX);
+        scanPositions.push({x: adjustedX, y});
+      }
+    }
+    
+    // Then the runner-up frames the API suggested, of the same size
+    for (const candidate of candidates) {
+      if (candidate.width === frame.width && candidate.height === frame.height) {
+        scanPositions.push({x: Math.min(candidate.x, maxX), y: Math.min(candidate.y, maxY)});
       }
     }
     
     // Add the suggested frame as the last position (which will be the highest scoring)
-    // Also adjust it if needed and ensure it's within bounds
-    const adjustedSuggestedX = adjustFrameToAvoidSplittingObjects(frame.x, frame.y, frameWidth, frameHeight);
-    const boundedY = Math.min(frame.y, maxY);
     scanPositions.push({
-      x: adjustedSuggestedX,
-      y: boundedY
+      x: Math.min(Math.max(0, frame.x), maxX),
+      y: Math.min(Math.max(0, frame.y), maxY)
     });
     
     console.log(`Created ${scanPositions.length} scan positions`);
@@ -276,9 +261,11 @@ export default function AIPage() {
     x: number, 
     y: number, 
     width: number, 
-    height: number
+    height: number,
+    objects: DetectionObject[],
+    maxX: number
   ): number => {
-    if (!detectedObjects.length) return x;
+    if (!objects.length) return x;
     
     let adjustedX = x;
     let needsAdjustment = true;
@@ -287,7 +274,7 @@ export default function AIPage() {
       needsAdjustment = false;
       
       // Check each detected object
-      for (const obj of detectedObjects) {
+      for (const obj of objects) {
         const [objX1, objY1, objX2, objY2] = obj.box;
         
         // Check if the frame cuts through the object box
@@ -308,13 +295,13 @@ export default function AIPage() {
       }
       
       // Safety check to prevent infinite loop
-      if (adjustedX + width > 1200) {
+      if (adjustedX > maxX) {
         console.log("Frame adjustment reached edge of image, stopping");
         break;
       }
     }
     
-    return adjustedX;
+    return Math.min(adjustedX, maxX);
   };
   
   const analyzeImage = async () => {
@@ -332,8 +319,9 @@ export default function AIPage() {
       console.log(`Using file: ${imageFile.name}, size: ${imageFile.size} bytes, type: ${imageFile.type}`);
       console.log('Sending request to object detection API...');
       
-      // Call the object detection API
-      const apiResponse = await fetch('/api/detect-objects/', {
+      // Call the object detection API; the boxed image is only shown scaled
+      // down, so a preview-sized one is enough
+      const apiResponse = await fetch('/api/detect-objects/?mode=preview', {
         method: 'POST',
         body: formData,
       });
@@ -360,23 +348,17 @@ export default function AIPage() {
       const boxedImage = `data:image/jpeg;base64,${data.boxed_image}`;
       setBoxedImageUrl(boxedImage);
       
-      // Set detected objects and suggested frame
+      // Set detected objects
       setDetectedObjects(data.detected_objects);
       
-      // Ensure we have a suggested frame
-      if (data.suggested_frame) {
-        console.log("Received suggested frame from API:", data.suggested_frame);
-        setSuggestedFrame(data.suggested_frame);
-      } else {
-        console.log("No suggested frame from API, creating default");
-        // Create a default frame if none is provided
-        setSuggestedFrame({
-          x: 550, 
-          y: 20,
-          width: 475,
-          height: 812
-        });
-      }
+      // Boxes and frames are in the pixels of the photo, whatever its size
+      const size = data.image_size;
+      setImageSize(size);
+      
+      // The best 9:16 frame, and the runners-up to show while scanning
+      const candidates = data.suggested_frames?.['9:16'] ?? [];
+      const frame = data.suggested_frame ?? candidates[0] ?? defaultFrame(size);
+      console.log("Received suggested frame from API:", frame);
       
       // First show the boxed image
       setAnimationState('showingBoxes');
@@ -387,7 +369,8 @@ export default function AIPage() {
       timeoutRef.current = setTimeout(() => {
         console.log("Timeout triggered, changing to scanningFrames state");
         setAnimationState('scanningFrames');
-        scanFrames();
+        // State set above isn't visible in this closure, so pass the response on
+        scanWithFrame(frame, candidates.slice(1).reverse(), size, data.detected_objects);
       }, 2500); // Show detection boxes for 2.5 seconds
     } catch (error) {
       console.error('Error analyzing image:', error);
@@ -455,7 +438,8 @@ export default function AIPage() {
   
   // Render frames as overlays on the full image
   const renderFrameOverlays = () => {
-    if (!scoredFrames.length) return null;
+    if (!scoredFrames.length || !imageSize) return null;
+    const { width: imgWidth, height: imgHeight } = imageSize;
     
     return (
       <>
@@ -470,10 +454,10 @@ export default function AIPage() {
                   : 'border-indigo-400/70'
               } transition-all duration-300`}
               style={{
-                left: `${frame.x * 100 / 1200}%`,
-                top: `${frame.y * 100 / 900}%`,
-                width: `${frame.width * 100 / 1200}%`,
-                height: `${frame.height * 100 / 900}%`,
+                left: `${frame.x * 100 / imgWidth}%`,
+                top: `${frame.y * 100 / imgHeight}%`,
+                width: `${frame.width * 100 / imgWidth}%`,
+                height: `${frame.height * 100 / imgHeight}%`,
               }}
             >
               <div 
@@ -494,10 +478,10 @@ export default function AIPage() {
           <div
             className="absolute border-2 border-yellow-400 border-dashed animate-pulse"
             style={{
-              left: `${currentScanningFrame.x * 100 / 1200}%`,
-              top: `${currentScanningFrame.y * 100 / 900}%`,
-              width: `${currentScanningFrame.width * 100 / 1200}%`,
-              height: `${currentScanningFrame.height * 100 / 900}%`,
+              left: `${currentScanningFrame.x * 100 / imgWidth}%`,
+              top: `${currentScanningFrame.y * 100 / imgHeight}%`,
+              width: `${currentScanningFrame.width * 100 / imgWidth}%`,
+              height: `${currentScanningFrame.height * 100 / imgHeight}%`,
             }}
           >
             <div className="absolute top-0 right-0 transform translate-x-1/2 -translate-y-1/2 px-2 py-1 text-xs font-bold rounded-full bg-yellow-500/80 text-white animate-pulse">
@@ -511,6 +495,9 @@ export default function AIPage() {
   
   // Render the results based on animation state
   const renderResults = () => {
+    // Keep the photo's aspect ratio, so frame overlays line up with it
+    const imageAspect = imageSize ? (imageSize.height / imageSize.width) * 100 : 75;
+    
     if (isAnalyzing) {
       return (
         <div className="flex flex-col items-center justify-center h-full py-20">
@@ -541,7 +528,7 @@ export default function AIPage() {
     if (animationState === 'showingBoxes' && boxedImageUrl) {
       return (
         <div className="glass-dark border-indigo-800/20 rounded-xl overflow-hidden">
-          <div className="relative" style={{ paddingBottom: '75%' }}>
+          <div className="relative" style={{ paddingBottom: `${imageAspect}%` }}>
             <img 
               src={boxedImageUrl} 
               alt="Object Detection" 
@@ -579,7 +566,7 @@ export default function AIPage() {
     if (animationState === 'scanningFrames' && imageUrl && currentScanningFrame) {
       return (
         <div className="glass-dark border-indigo-800/20 rounded-xl overflow-hidden">
-          <div className="relative" style={{ paddingBottom: '75%' }}>
+          <div className="relative" style={{ paddingBottom: `${imageAspect}%` }}>
             {/* Use the boxed image instead of original to keep detection boxes visible */}
             <img 
               src={boxedImageUrl || imageUrl} 
@@ -15,6 +15,7 @@ interface Post {
   user_id: string;
   created_at: string;
   thumbs_up: number;
+  placeholder?: string | null;
 }
 
 interface PostIdObject {
@@ -621,7 +622,10 @@ export default function CommunityPage() {
           <div className="grid grid-cols-1 md:grid-cols-2 lg:grid-cols-3 gap-6">
               {posts.map((post) => (
                 <div key={post.id} className="border rounded-xl overflow-hidden shadow-sm hover:shadow-md transition">
-                <div className="relative pb-[75%] bg-gray-100">
+                <div
+                  className="relative pb-[75%] bg-gray-100 bg-cover bg-center"
+                  style={post.placeholder ? { backgroundImage: `url(${post.placeholder})` } : undefined}
+                >
                     <Link href={`/posts/${post.id}`}>
                       <img
                         src={getPhotoUrl(post.photo_uuid)}
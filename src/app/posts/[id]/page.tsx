@@ -13,6 +13,7 @@ interface Post {
   user_id: string;
   created_at: string;
   thumbs_up: number;
+  placeholder?: string | null;
 }
 
 interface Comment {
@@ -3,6 +3,7 @@ Pytest configuration file with fixtures and markers.
 """
 
 import os
+import sys
 import pytest
 import time
 import requests
@@ -17,6 +18,9 @@ from test_utils import (
     api_request, BASE_URL
 )
 
+# Unit tests import the API modules directly
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "api"))
+
 # Register markers
 def pytest_configure(config):
     """Register custom markers."""
@@ -24,6 +28,7 @@ def pytest_configure(config):
     config.addinivalue_line("markers", "frontend: tests that use Selenium for frontend testing")
     config.addinivalue_line("markers", "database: tests that directly check database integrity")
     config.addinivalue_line("markers", "slow: tests that take a long time to run")
+    config.addinivalue_line("markers", "unit: tests that call the API modules directly, without a server")
 
 # Fixtures for test data
 @pytest.fixture(scope="session")
@@ -64,6 +69,29 @@ def test_comment(test_user, test_post):
     comment_id = add_comment(test_user["token"], test_post, comment_text)
     return {"id": comment_id, "text": comment_text, "post_id": test_post}
 
+# Fixtures for unit tests
+@pytest.fixture(scope="function")
+def upload_dir(tmp_path, monkeypatch):
+    """Point the photo storage at an empty temporary uploads directory."""
+    import storage
+    root = str(tmp_path / "uploads")
+    os.makedirs(root)
+    monkeypatch.setattr(storage, "UPLOAD_DIR", root)
+    monkeypatch.setattr(storage, "TMP_DIR", os.path.join(root, ".tmp"))
+    monkeypatch.setattr(storage, "QUARANTINE_DIR", os.path.join(root, ".quarantine"))
+    return root
+
+@pytest.fixture(scope="function")
+def session_factory(tmp_path):
+    """A sessionmaker for a fresh SQLite database with the API's tables."""
+    from sqlalchemy import create_engine
+    from sqlalchemy.orm import sessionmaker
+    from backend import Base
+    engine = create_engine(f"sqlite:///{tmp_path / 'test.sqlite3'}")
+    Base.metadata.create_all(engine)
+    yield sessionmaker(bind=engine)
+    engine.dispose()
+
 # Fixtures for Selenium WebDriver
 @pytest.fixture(scope="session")
 def driver_init():
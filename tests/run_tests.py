@@ -20,6 +20,7 @@ def parse_args():
     parser.add_argument("--api-only", action="store_true", help="Run only API tests")
     parser.add_argument("--frontend-only", action="store_true", help="Run only frontend tests")
     parser.add_argument("--database-only", action="store_true", help="Run only database tests")
+    parser.add_argument("--unit-only", action="store_true", help="Run only unit tests, which need no server")
     parser.add_argument("--skip-slow", action="store_true", help="Skip slow tests")
     return parser.parse_args()
 
@@ -44,6 +45,8 @@ def run_tests(args):
         markers.append("frontend")
     if args.database_only:
         markers.append("database")
+    if args.unit_only:
+        markers.append("unit")
     if args.skip_slow:
         markers.append("not slow")
     
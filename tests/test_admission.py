@@ -0,0 +1,194 @@
+import asyncio
+
+import httpx
+import pytest
+
+import admission
+from admission import AdmissionMiddleware, Bulkhead, Rejected, classify
+
+# Mark all tests in this file as unit tests
+pytestmark = pytest.mark.unit
+
+
+@pytest.mark.parametrize("method, path, route_class", [
+    ("GET", "/ready", "exempt"),
+    ("GET", "/api/admission/stats", "exempt"),
+    ("POST", "/api/detect-objects/", "inference"),
+    ("POST", "/api/detect-objects/batch/", "inference"),
+    ("GET", "/posts/7/frames/", "inference"),
+    ("POST", "/posts/7/frames/score/", "inference"),
+    ("POST", "/posts/create/", "uploads"),
+    ("GET", "/posts/", "reads"),
+    ("HEAD", "/photos/a.jpg", "reads"),
+    ("POST", "/posts/7/comment/add/", "writes"),
+])
+def test_classify(method, path, route_class):
+    assert classify(method, path) == route_class
+
+
+def test_requests_beyond_the_queue_are_rejected_at_once():
+    async def run():
+        bulkhead = Bulkhead("test", limit=2, queue_size=1)
+        await bulkhead.acquire()
+        await bulkhead.acquire()
+        waiter = asyncio.ensure_future(bulkhead.acquire())
+        await asyncio.sleep(0)
+        with pytest.raises(Rejected):
+            await bulkhead.acquire()
+        bulkhead.release()
+        await waiter
+        return bulkhead.stats()
+
+    stats = asyncio.run(run())
+    assert (stats["active"], stats["waiting"]) == (2, 0)
+    assert (stats["admitted"], stats["rejected"]) == (3, 1)
+
+
+def test_slots_go_to_waiters_in_arrival_order():
+    async def run():
+        bulkhead = Bulkhead("test", limit=1, queue_size=3)
+        await bulkhead.acquire()
+        order = []
+
+        async def wait(name):
+            await bulkhead.acquire()
+            order.append(name)
+
+        waiters = [asyncio.ensure_future(wait(name)) for name in "abc"]
+        await asyncio.sleep(0)
+        for _ in waiters:
+            bulkhead.release()
+            await asyncio.sleep(0)
+        await asyncio.gather(*waiters)
+        return order, bulkhead.active
+
+    assert asyncio.run(run()) == (["a", "b", "c"], 1)
+
+
+def test_waiting_too_long_is_rejected_without_taking_a_slot():
+    async def run():
+        bulkhead = Bulkhead("test", limit=1, queue_size=1)
+        await bulkhead.acquire()
+        with pytest.raises(Rejected):
+            await bulkhead.acquire(timeout=0.01)
+        bulkhead.release()
+        return bulkhead.stats()
+
+    stats = asyncio.run(run())
+    assert (stats["active"], stats["waiting"], stats["timed_out"]) == (0, 0, 1)
+
+
+def test_a_cancelled_waiter_leaves_the_queue():
+    async def run():
+        bulkhead = Bulkhead("test", limit=1, queue_size=1)
+        await bulkhead.acquire()
+        waiter = asyncio.ensure_future(bulkhead.acquire())
+        await asyncio.sleep(0)
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        waiting = bulkhead.waiting
+        bulkhead.release()
+        return waiting, bulkhead.active
+
+    assert asyncio.run(run()) == (0, 0)
+
+
+async def timeout_wait_for(future, timeout):
+    """wait_for as of Python 3.12, which raises CancelledError even if `future` is done."""
+    async with asyncio.timeout(timeout):
+        return await future
+
+
+@pytest.mark.parametrize("wait_for", [asyncio.wait_for, timeout_wait_for])
+def test_a_slot_handed_to_a_waiter_as_it_is_cancelled_is_not_lost(wait_for, monkeypatch):
+    monkeypatch.setattr(admission.asyncio, "wait_for", wait_for)
+
+    async def run():
+        bulkhead = Bulkhead("test", limit=1, queue_size=2)
+        await bulkhead.acquire()
+        second = asyncio.ensure_future(bulkhead.acquire())
+        third = asyncio.ensure_future(bulkhead.acquire())
+        await asyncio.sleep(0)
+        # The slot goes to the second waiter, which is cancelled before it resumes
+        bulkhead.release()
+        second.cancel()
+        [result] = await asyncio.gather(second, return_exceptions=True)
+        if result is None:
+            # wait_for before Python 3.12 returns the result despite the cancellation
+            bulkhead.release()
+        await third
+        bulkhead.release()
+        return bulkhead.active, bulkhead.waiting
+
+    assert asyncio.run(run()) == (0, 0)
+
+
+class App:
+    """Answers 200, holding requests to /slow until `gate` is set."""
+
+    def __init__(self):
+        self.gate = asyncio.Event()
+
+    async def __call__(self, scope, receive, send):
+        if scope["path"] == "/slow":
+            await self.gate.wait()
+        if scope["path"] == "/fail":
+            raise RuntimeError("handler failed")
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        await send({"type": "http.response.body", "body": b"ok"})
+
+
+@pytest.fixture
+def bulkheads(monkeypatch):
+    bulkheads = {"reads": Bulkhead("reads", 1, 4), "inference": Bulkhead("inference", 4, 4),
+                 "writes": Bulkhead("writes", 1, 0)}
+    monkeypatch.setattr(admission, "bulkheads", bulkheads)
+    return bulkheads
+
+
+def client(app):
+    return httpx.AsyncClient(transport=httpx.ASGITransport(app=AdmissionMiddleware(app, enabled=True)),
+                             base_url="http://test")
+
+
+def test_inference_is_shed_while_reads_wait(bulkheads):
+    async def run():
+        app = App()
+        async with client(app) as http:
+            reads = [asyncio.ensure_future(http.get("/slow")) for _ in range(2)]
+            while not bulkheads["reads"].waiting:
+                await asyncio.sleep(0)
+            shed = await http.post("/api/detect-objects/")
+            # Exempt routes still answer
+            ready = await http.get("/ready")
+            app.gate.set()
+            await asyncio.gather(*reads)
+            admitted = await http.post("/api/detect-objects/")
+        return shed, ready, admitted
+
+    shed, ready, admitted = asyncio.run(run())
+    assert shed.status_code == 429
+    assert shed.headers["Retry-After"] == str(admission.ADMISSION_RETRY_AFTER)
+    assert (ready.status_code, admitted.status_code) == (200, 200)
+    assert bulkheads["inference"].stats()["rejected"] == 1
+    assert bulkheads["inference"].stats()["admitted"] == 1
+    assert bulkheads["reads"].stats()["active"] == 0
+
+
+def test_a_full_class_answers_429_and_slots_are_freed_when_handlers_fail(bulkheads):
+    async def run():
+        app = App()
+        async with client(app) as http:
+            held = asyncio.ensure_future(http.post("/slow"))
+            while not bulkheads["writes"].active:
+                await asyncio.sleep(0)
+            full = await http.post("/posts/7/comment/add/")
+            app.gate.set()
+            await held
+            with pytest.raises(RuntimeError):
+                await http.post("/fail")
+        return full
+
+    assert asyncio.run(run()).status_code == 429
+    assert bulkheads["writes"].stats()["active"] == 0
@@ -1,4 +1,5 @@
 import pytest
+import requests
 import time
 import json
 from typing import Dict, Any, List
@@ -168,4 +169,68 @@ def test_create_post_after_deletion(test_user, test_image):
         assert False, "New post should exist"
     
     # Clean up
-    delete_post(test_user["token"], post2_id) 
\ No newline at end of file
+    delete_post(test_user["token"], post2_id) 
+
+
+@pytest.mark.api
+def test_readiness_endpoint():
+    """The API reports ready before the model is loaded, along with its model state."""
+    data = api_request("/ready")
+    assert data["ready"] is True
+    assert data["model"] in ("unloaded", "loading", "ready", "failed")
+
+    response = requests.get(f"{BASE_URL}/ready", params={"require_model": "true"})
+    assert response.status_code == (200 if response.json()["model"] == "ready" else 503)
+
+
+
+@pytest.mark.api
+def test_admission_stats():
+    """Requests are counted against their route class."""
+    before = api_request("/api/admission/stats")
+    assert set(before) >= {"inference", "uploads", "writes", "reads"}
+    api_request("/posts/")
+    after = api_request("/api/admission/stats")
+    assert after["reads"]["admitted"] > before["reads"]["admitted"]
+    assert after["reads"]["limit"] > after["inference"]["limit"]
+
+
+@pytest.mark.api
+def test_request_id_header():
+    """Responses carry the request ID used in the logs, the client's if it sent a valid one."""
+    response = requests.get(f"{BASE_URL}/posts/", headers={"X-Request-ID": "test-request-1"})
+    assert response.headers["X-Request-ID"] == "test-request-1"
+
+    generated = requests.get(f"{BASE_URL}/posts/", headers={"X-Request-ID": "not a valid id"})
+    generated_id = generated.headers["X-Request-ID"]
+    assert generated_id and generated_id != "not a valid id"
+    other = requests.get(f"{BASE_URL}/posts/").headers["X-Request-ID"]
+    assert other and other != generated_id
+
+
+def metric_value(text: str, sample: str) -> float:
+    """The value of one sample, e.g. 'name_count{label="value"}', in Prometheus text output."""
+    for line in text.splitlines():
+        if line.startswith(sample + " "):
+            return float(line.rsplit(" ", 1)[1])
+    return 0.0
+
+
+@pytest.mark.api
+def test_metrics_endpoint():
+    """Requests are counted by route template in the Prometheus text format."""
+    duration_count = 'figart_http_request_duration_seconds_count{method="GET",route="/posts/"}'
+    requests_total = 'figart_http_requests_total{method="GET",route="/posts/",status="200"}'
+    requests.get(f"{BASE_URL}/posts/")
+    before = requests.get(f"{BASE_URL}/metrics")
+    assert before.status_code == 200
+    assert before.headers["Content-Type"].startswith("text/plain")
+    assert "# TYPE figart_db_query_duration_seconds histogram" in before.text
+    assert "figart_detection_queue_depth" in before.text
+
+    for _ in range(3):
+        assert requests.get(f"{BASE_URL}/posts/").status_code == 200
+    after = requests.get(f"{BASE_URL}/metrics").text
+    # Other clients may hit the API meanwhile, so at least our three requests
+    assert metric_value(after, duration_count) >= metric_value(before.text, duration_count) + 3
+    assert metric_value(after, requests_total) >= metric_value(before.text, requests_total) + 3
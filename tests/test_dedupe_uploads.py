@@ -0,0 +1,88 @@
+import hashlib
+import os
+
+import pytest
+
+# Mark all tests in this file as unit tests
+pytestmark = pytest.mark.unit
+
+CONTENT = b"the same photo"
+DIGEST = hashlib.sha256(CONTENT).hexdigest()
+CANONICAL = f"{DIGEST}.jpg"
+
+
+def store_photo(name, content=CONTENT):
+    import storage
+    path = storage.photo_path(name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(content)
+
+
+@pytest.fixture
+def dedupe(upload_dir, session_factory, monkeypatch):
+    import dedupe_uploads
+    from backend import Post, PhotoBlob
+    session = session_factory()
+    # An upload stored under its digest, and a copy from before content addressing
+    store_photo(CANONICAL)
+    store_photo("legacy.jpg")
+    session.add(PhotoBlob(digest=DIGEST, photo_uuid=CANONICAL, size=len(CONTENT), ref_count=1))
+    session.add_all([Post(id=1, photo_uuid=CANONICAL, user_id=1), Post(id=2, photo_uuid="legacy.jpg", user_id=1)])
+    session.commit()
+    monkeypatch.setattr(dedupe_uploads, "session", session)
+    yield dedupe_uploads
+    session.close()
+
+
+def blob_and_posts(session_factory):
+    from backend import Post, PhotoBlob
+    session = session_factory()
+    try:
+        blob = session.query(PhotoBlob).filter_by(digest=DIGEST).one()
+        return blob.ref_count, sorted(post.photo_uuid for post in session.query(Post))
+    finally:
+        session.close()
+
+
+def test_copies_are_collapsed_onto_one_counted_file(dedupe, session_factory):
+    import storage
+    dedupe.dedupe_uploads()
+    assert blob_and_posts(session_factory) == (2, [CANONICAL, CANONICAL])
+    assert storage.locate_photo("legacy.jpg") is None
+    assert storage.locate_photo(CANONICAL) is not None
+
+    # Running it again changes nothing
+    dedupe.dedupe_uploads()
+    assert blob_and_posts(session_factory) == (2, [CANONICAL, CANONICAL])
+
+
+def test_an_upload_committed_while_it_runs_is_counted(dedupe, session_factory, monkeypatch):
+    """An API worker stores the same photo after the script counted its references."""
+    from backend import Post, PhotoBlob
+    materialize = dedupe.materialize
+
+    def upload_meanwhile(source, target, dry_run):
+        session = session_factory()
+        session.add(Post(id=3, photo_uuid=CANONICAL, user_id=1))
+        session.query(PhotoBlob).filter_by(digest=DIGEST).update({PhotoBlob.ref_count: PhotoBlob.ref_count + 1})
+        session.commit()
+        session.close()
+        materialize(source, target, dry_run)
+
+    monkeypatch.setattr(dedupe, "materialize", upload_meanwhile)
+    dedupe.dedupe_uploads()
+    assert blob_and_posts(session_factory) == (3, [CANONICAL] * 3)
+
+
+def test_api_reference_counting_adds_up_within_one_session(dedupe, session_factory, tmp_path):
+    """Re-encoding a photo to identical bytes takes a reference and drops one in the same transaction."""
+    import storage
+    session = session_factory()
+    upload = tmp_path / "upload"
+    upload.write_bytes(CONTENT)
+    assert storage.store_blob(session, DIGEST, str(upload), len(CONTENT), "photo.jpg") == (CANONICAL, False)
+    assert storage.release_blob(session, CANONICAL) is None
+    session.commit()
+    session.close()
+    assert blob_and_posts(session_factory)[0] == 1
@@ -0,0 +1,124 @@
+import asyncio
+import os
+
+import pytest
+
+# Mark all tests in this file as unit tests
+pytestmark = pytest.mark.unit
+
+
+class Computation:
+    """A compute() for the cache that counts its calls and finishes when released."""
+
+    def __init__(self, body=b"response", error=None):
+        self.body = body
+        self.error = error
+        self.calls = 0
+        self.cancelled = False
+        self.release = asyncio.Event()
+
+    async def __call__(self):
+        self.calls += 1
+        try:
+            await self.release.wait()
+        except asyncio.CancelledError:
+            self.cancelled = True
+            raise
+        if self.error:
+            raise self.error
+        return self.body
+
+
+def make_cache(directory=None):
+    from detection_cache import DetectionCache
+    return DetectionCache(max_bytes=1024, directory=directory)
+
+
+def test_concurrent_misses_compute_once():
+    async def run():
+        cache, compute = make_cache(), Computation()
+        callers = [asyncio.create_task(cache.get_or_compute("key", compute)) for _ in range(3)]
+        await asyncio.sleep(0)
+        compute.release.set()
+        assert await asyncio.gather(*callers) == [b"response"] * 3
+        assert compute.calls == 1
+        assert await cache.get_or_compute("key", compute) == b"response"
+        assert cache.stats()["coalesced"] == 2
+        assert cache.stats()["memory_hits"] == 1
+
+    asyncio.run(run())
+
+
+def test_cancelled_caller_doesnt_cancel_the_others():
+    """The request that started a computation going away leaves it running for the rest."""
+    async def run():
+        cache, compute = make_cache(), Computation()
+        first = asyncio.create_task(cache.get_or_compute("key", compute))
+        await asyncio.sleep(0)
+        second = asyncio.create_task(cache.get_or_compute("key", compute))
+        await asyncio.sleep(0)
+
+        first.cancel()
+        await asyncio.sleep(0)
+        compute.release.set()
+        assert await second == b"response"
+        assert first.cancelled()
+        assert not compute.cancelled
+        assert compute.calls == 1
+
+    asyncio.run(run())
+
+
+def test_computation_is_cancelled_once_nobody_waits():
+    async def run():
+        cache, compute = make_cache(), Computation()
+        callers = [asyncio.create_task(cache.get_or_compute("key", compute)) for _ in range(2)]
+        await asyncio.sleep(0)
+        for caller in callers:
+            caller.cancel()
+        await asyncio.sleep(0.01)
+        assert compute.cancelled
+        assert cache._inflight == {}
+
+        # The next caller starts over
+        retry = Computation()
+        retry.release.set()
+        assert await cache.get_or_compute("key", retry) == b"response"
+
+    asyncio.run(run())
+
+
+def test_errors_reach_every_caller_and_are_not_cached():
+    async def run():
+        cache, compute = make_cache(), Computation(error=ValueError("bad image"))
+        callers = [asyncio.create_task(cache.get_or_compute("key", compute)) for _ in range(2)]
+        await asyncio.sleep(0)
+        compute.release.set()
+        results = await asyncio.gather(*callers, return_exceptions=True)
+        assert all(isinstance(result, ValueError) for result in results)
+        assert cache.stats()["entries"] == 0
+
+    asyncio.run(run())
+
+
+def test_unreadable_and_corrupt_disk_entries_are_misses(tmp_path):
+    async def run():
+        cache = make_cache(str(tmp_path))
+        await cache.put("k1", b"stored")
+        await cache.put("k2", b"stored")
+        cache.clear()
+        assert await cache.get("k1") == b"stored"
+
+        # A damaged file is dropped, an unreadable one skipped
+        with open(cache._path("k2"), "r+b") as f:
+            f.seek(-1, os.SEEK_END)
+            f.write(b"X")
+        os.makedirs(cache._path("k3"))
+        compute = Computation(b"recomputed")
+        compute.release.set()
+        assert await cache.get_or_compute("k2", compute) == b"recomputed"
+        assert await cache.get_or_compute("k3", compute) == b"recomputed"
+        assert compute.calls == 2
+        assert cache.stats()["disk_hits"] == 1
+
+    asyncio.run(run())
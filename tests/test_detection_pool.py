@@ -0,0 +1,129 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import detection
+from detection import BatchScheduler, DetectionError, InferencePool, QueueFull
+
+# Mark all tests in this file as unit tests
+pytestmark = pytest.mark.unit
+
+
+@pytest.fixture
+def pool():
+    pool = InferencePool(kind="thread", workers=2)
+    # Skip the initializer, which loads the model
+    pool._executor = ThreadPoolExecutor(max_workers=2)
+    yield pool
+    pool.shutdown()
+
+
+def test_warm_up_loads_the_model_in_every_worker(pool, monkeypatch):
+    loaded = []
+    monkeypatch.setattr(detection, "warm_up", lambda: loaded.append(True))
+    assert pool.model_state == "unloaded"
+    asyncio.run(pool.warm_up())
+    assert pool.model_state == "ready"
+    assert len(loaded) == pool.workers
+
+
+def test_failed_warm_up_is_reported(pool, monkeypatch):
+    def fail():
+        raise DetectionError(500, "Model file missing")
+
+    monkeypatch.setattr(detection, "warm_up", fail)
+    asyncio.run(pool.warm_up())
+    assert pool.model_state == "failed"
+    assert pool.model_error == "Model file missing"
+
+
+def test_jobs_run_off_the_event_loop(pool):
+    async def run():
+        return await pool.run(threading.get_ident), threading.get_ident()
+
+    worker, loop = asyncio.run(run())
+    assert worker != loop
+
+
+class FakePool:
+    """Stands in for InferencePool, recording the batches it is given."""
+
+    def __init__(self, error=None):
+        self.batches = []
+        self.error = error
+        self.model_state = "unloaded"
+        self.model_error = None
+
+    async def detect_batch(self, uploads, modes, infos=None):
+        self.batches.append(list(uploads))
+        await asyncio.sleep(0)
+        if self.error:
+            raise self.error
+        return [
+            DetectionError(400, "Invalid image") if contents == b"bad" else {"image": contents.decode(), "mode": mode}
+            for contents, mode in zip(uploads, modes)
+        ]
+
+    def model_failed(self, error):
+        self.model_state = "failed"
+        self.model_error = str(error)
+
+
+def test_concurrent_requests_share_batches():
+    async def run():
+        pool = FakePool()
+        scheduler = BatchScheduler(pool, max_batch=2, max_wait_ms=10)
+        results = await asyncio.gather(*(scheduler.detect(f"img{i}".encode(), "boxes") for i in range(5)))
+        return pool, scheduler, results
+
+    pool, scheduler, results = asyncio.run(run())
+    assert results == [{"image": f"img{i}", "mode": "boxes"} for i in range(5)]
+    assert [len(batch) for batch in pool.batches] == [2, 2, 1]
+    assert pool.model_state == "ready"
+    assert scheduler.pending == 0
+
+
+def test_a_bad_image_only_fails_its_own_request():
+    async def run():
+        scheduler = BatchScheduler(FakePool(), max_batch=4, max_wait_ms=10)
+        return await asyncio.gather(scheduler.detect(b"bad"), scheduler.detect(b"good"), return_exceptions=True)
+
+    bad, good = asyncio.run(run())
+    assert isinstance(bad, DetectionError) and bad.status_code == 400
+    assert good == {"image": "good", "mode": "full"}
+
+
+def test_requests_beyond_the_queue_are_turned_away():
+    async def run():
+        scheduler = BatchScheduler(FakePool(), max_batch=8, max_wait_ms=10, queue_size=2)
+        return await asyncio.gather(*(scheduler.detect(b"img") for _ in range(3)), return_exceptions=True)
+
+    results = asyncio.run(run())
+    assert [isinstance(result, QueueFull) for result in results] == [False, False, True]
+
+
+def test_a_failed_batch_fails_every_request_and_the_model():
+    async def run():
+        pool = FakePool(error=RuntimeError("out of memory"))
+        scheduler = BatchScheduler(pool, max_batch=2, max_wait_ms=10)
+        results = await asyncio.gather(scheduler.detect(b"a"), scheduler.detect(b"b"), return_exceptions=True)
+        return pool, results
+
+    pool, results = asyncio.run(run())
+    assert all(isinstance(result, RuntimeError) for result in results)
+    assert (pool.model_state, pool.model_error) == ("failed", "out of memory")
+
+
+def test_an_unreachable_inference_server_fails_requests_but_not_the_model():
+    async def run():
+        pool = FakePool(error=DetectionError(503, "Image analysis is temporarily unavailable."))
+        pool.model_state = "ready"
+        scheduler = BatchScheduler(pool, max_batch=2, max_wait_ms=10)
+        results = await asyncio.gather(scheduler.detect(b"a"), scheduler.detect(b"b"), return_exceptions=True)
+        return pool, results
+
+    pool, results = asyncio.run(run())
+    assert all(isinstance(result, DetectionError) and result.status_code == 503 for result in results)
+    assert (pool.model_state, pool.model_error) == ("ready", None)
@@ -0,0 +1,216 @@
+import asyncio
+import threading
+from array import array
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pytest
+from fastapi import BackgroundTasks, HTTPException
+
+from composition import frame_array, frame_coverage, frame_sums, grid_shape, grid_windows, suggest_frames
+
+# Mark all tests in this file as unit tests
+pytestmark = pytest.mark.unit
+
+WIDTH, HEIGHT = 1200, 900
+
+
+def random_frames(rng, count):
+    frames = []
+    for _ in range(count):
+        x, y = rng.integers(-50, WIDTH), rng.integers(-50, HEIGHT)
+        frames.append({"x": int(x), "y": int(y),
+                       "width": int(rng.integers(1, WIDTH)), "height": int(rng.integers(1, HEIGHT))})
+    return frames
+
+
+def test_coverage_counts_match_painting_each_frame():
+    frames = random_frames(np.random.default_rng(0), 200)
+    columns, rows = grid_shape(WIDTH, HEIGHT)
+    expected = np.zeros((rows, columns), dtype=np.uint32)
+    for x0, y0, x1, y1 in grid_windows(frame_array(frames, WIDTH, HEIGHT), WIDTH, HEIGHT, (columns, rows)):
+        expected[y0:y1, x0:x1] += 1
+
+    coverage = frame_coverage(frames, WIDTH, HEIGHT)
+    assert coverage.dtype == np.uint32
+    np.testing.assert_array_equal(coverage, expected)
+
+
+def test_sums_are_of_the_frames_clipped_to_the_photo():
+    frames = [{"x": -100, "y": 450, "width": 700, "height": 900}, {"x": 600, "y": 0, "width": 600, "height": 450}]
+    assert frame_sums(frames, WIDTH, HEIGHT) == pytest.approx((0.5, 0.5, 1.0, 1.0))
+
+
+def test_whole_photo_frames_cover_every_cell():
+    frames = [{"x": 0, "y": 0, "width": WIDTH, "height": HEIGHT}] * 3
+    assert (frame_coverage(frames, WIDTH, HEIGHT) == 3).all()
+
+
+def test_suggested_frames_score_100_against_the_stored_saliency():
+    import api_main
+    columns, rows = grid_shape(WIDTH, HEIGHT)
+    # Something stands out on the right, away from the only detection
+    saliency = np.zeros((rows, columns), np.float32)
+    saliency[:, -columns // 5:] = 1
+    saliency /= saliency.sum()
+    detections = {"image_size": {"width": WIDTH, "height": HEIGHT},
+                  "detected_objects": [{"box": [100, 300, 400, 800], "confidence": 0.9, "class": "person"}]}
+    suggested = suggest_frames(detections["detected_objects"], WIDTH, HEIGHT, saliency=saliency)
+    shown = [{key: frames[0][key] for key in ("x", "y", "width", "height")} for frames in suggested.values()]
+
+    scores, best, _ = api_main.score_user_frames(detections, shown, False, saliency.tobytes())
+    assert [score["score"] for score in scores] == [100] * len(shown)
+    assert best == {ratio: frames[0] for ratio, frames in suggested.items()}
+    ranked = api_main.rank_frames(detections, list(suggested), 1, saliency.tobytes())
+    assert ranked == {ratio: frames[:1] for ratio, frames in suggested.items()}
+    # Without the map, the shown frames are not the reference any more
+    assert api_main.score_user_frames(detections, shown, False)[1] != best
+
+
+@pytest.fixture
+def heatmaps(session_factory, monkeypatch):
+    import api_main
+    import backend
+    from backend import Post, PostDetection, User
+    session = session_factory()
+    session.add(Post(id=1, photo_uuid="photo.jpg", user_id=1))
+    session.add(PostDetection(post_id=1, status="done", detected_objects=[], image_width=WIDTH, image_height=HEIGHT))
+    for user_id in (1, 2, 3):
+        session.add(User(id=user_id, username=f"user{user_id}", password_hash="-"))
+    session.commit()
+    monkeypatch.setattr(api_main, "session", session)
+    monkeypatch.setattr(backend, "session", session)
+    # Tokens are the usernames themselves
+    monkeypatch.setattr(api_main, "get_current_user", lambda token: token)
+    yield api_main
+    session.close()
+
+
+def submit(api_main, frames, width=WIDTH, height=HEIGHT, user=1):
+    return api_main.add_to_heatmap(1, user, (grid_shape(width, height), frame_coverage(frames, width, height).tobytes(),
+                                len(frames), frame_sums(frames, width, height)))
+
+
+def stored(api_main):
+    from backend import FrameHeatmap
+    heatmap = api_main.session.query(FrameHeatmap).filter_by(post_id=1).one()
+    counts = array("I")
+    counts.frombytes(heatmap.counts)
+    return heatmap, np.array(counts, dtype=np.uint32).reshape(heatmap.rows, heatmap.columns)
+
+
+def test_submissions_are_summed(heatmaps):
+    rng = np.random.default_rng(1)
+    first, second = random_frames(rng, 5), random_frames(rng, 7)
+    submit(heatmaps, first)
+    submit(heatmaps, second, user=2)
+
+    heatmap, counts = stored(heatmaps)
+    np.testing.assert_array_equal(counts, frame_coverage(first + second, WIDTH, HEIGHT))
+    assert heatmap.frames == 12
+    assert heatmap.sum_x == pytest.approx(frame_sums(first, WIDTH, HEIGHT)[0] + frame_sums(second, WIDTH, HEIGHT)[0])
+    assert heatmap.sum_height == pytest.approx(frame_sums(first + second, WIDTH, HEIGHT)[3])
+
+
+def test_a_photo_of_another_shape_starts_a_new_heatmap(heatmaps):
+    submit(heatmaps, random_frames(np.random.default_rng(2), 5))
+    frames = [{"x": 0, "y": 0, "width": 300, "height": 900}]
+    submit(heatmaps, frames, width=600, height=900, user=2)
+
+    heatmap, counts = stored(heatmaps)
+    assert (heatmap.columns, heatmap.rows) == grid_shape(600, 900)
+    assert heatmap.frames == 1
+    np.testing.assert_array_equal(counts, frame_coverage(frames, 600, 900))
+
+
+def test_counts_saturate_instead_of_wrapping(heatmaps):
+    frames = [{"x": 0, "y": 0, "width": WIDTH, "height": HEIGHT}]
+    submit(heatmaps, frames)
+    heatmap, counts = stored(heatmaps)
+    heatmap.counts = np.full_like(counts, 0xFFFFFFFF).tobytes()
+    heatmaps.session.commit()
+
+    submit(heatmaps, frames, user=2)
+    _, counts = stored(heatmaps)
+    assert (counts == 0xFFFFFFFF).all()
+
+
+def test_concurrent_contributions_are_all_counted(session_factory, monkeypatch):
+    import api_main
+    from sqlalchemy.orm import scoped_session
+    # A session per thread, as each API worker process has its own
+    sessions = scoped_session(session_factory)
+    monkeypatch.setattr(api_main, "session", sessions)
+    rng = np.random.default_rng(3)
+    contributions = [random_frames(rng, 4) for _ in range(8)]
+    barrier = threading.Barrier(len(contributions))
+
+    def contribute(user, frames):
+        barrier.wait()
+        try:
+            return submit(api_main, frames, user=user)
+        finally:
+            sessions.remove()
+
+    with ThreadPoolExecutor(len(contributions)) as executor:
+        assert all(executor.map(contribute, range(1, 9), contributions))
+
+    heatmap, counts = stored(api_main)
+    everything = [frame for frames in contributions for frame in frames]
+    assert heatmap.frames == len(everything)
+    assert heatmap.sum_x == pytest.approx(frame_sums(everything, WIDTH, HEIGHT)[0])
+    np.testing.assert_array_equal(counts, frame_coverage(everything, WIDTH, HEIGHT))
+    sessions.remove()
+
+
+def test_frames_must_be_finite():
+    import api_main
+    from pydantic import ValidationError
+    for value in ("nan", "inf", "-inf"):
+        with pytest.raises(ValidationError):
+            api_main.FrameScoreRequest(frames=[{"x": 0, "y": 0, "width": value, "height": 10}])
+
+
+@pytest.mark.parametrize("frame", [
+    {"x": -1, "y": 0, "width": 100, "height": 100},
+    {"x": 0, "y": 0, "width": WIDTH + 1, "height": 100},
+    {"x": 1100, "y": 800, "width": 101, "height": 100},
+])
+def test_frames_outside_the_photo_are_rejected_before_anything_is_stored(heatmaps, frame):
+    request = heatmaps.FrameScoreRequest(frames=[{"x": 0, "y": 0, "width": 100, "height": 100}, frame],
+                                         contribute=True)
+    assert status_of(heatmaps.score_post_frames(1, request, BackgroundTasks(), "user1")) == 400
+    assert heatmaps.session.query(heatmaps.FrameHeatmap).count() == 0
+
+
+def status_of(call):
+    try:
+        asyncio.run(call)
+    except HTTPException as e:
+        return e.status_code
+    return 200
+
+
+def test_contributing_takes_a_login_and_happens_once_per_user(heatmaps):
+    frames = [{"x": 0, "y": 0, "width": 600, "height": 450}]
+    anonymous = heatmaps.FrameScoreRequest(frames=frames)
+    assert anonymous.contribute is False
+    result = asyncio.run(heatmaps.score_post_frames(1, anonymous, BackgroundTasks(), None))
+    assert len(result["scores"]) == 1
+    assert heatmaps.session.query(heatmaps.FrameHeatmap).count() == 0
+
+    contribution = heatmaps.FrameScoreRequest(frames=frames, contribute=True)
+    assert status_of(heatmaps.score_post_frames(1, contribution, BackgroundTasks(), None)) == 401
+    assert status_of(heatmaps.score_post_frames(1, contribution, BackgroundTasks(), "user1")) == 200
+    assert status_of(heatmaps.score_post_frames(1, contribution, BackgroundTasks(), "user1")) == 409
+    assert status_of(heatmaps.score_post_frames(1, contribution, BackgroundTasks(), "user2")) == 200
+    assert stored(heatmaps)[0].frames == 2
+
+
+def test_a_second_contribution_changes_nothing(heatmaps):
+    frames = [{"x": 0, "y": 0, "width": 600, "height": 450}]
+    assert submit(heatmaps, frames)
+    assert not submit(heatmaps, frames * 3)
+    heatmap, counts = stored(heatmaps)
+    assert heatmap.frames == 1
+    np.testing.assert_array_equal(counts, frame_coverage(frames, WIDTH, HEIGHT))
@@ -0,0 +1,120 @@
+import io
+
+import pytest
+from PIL import Image
+
+from image_probe import ORIENTATION_TAG, ImageRejected, check_file, check_image, probe
+
+# Mark all tests in this file as unit tests
+pytestmark = pytest.mark.unit
+
+
+def encode(fmt, size=(120, 80), **options):
+    buffer = io.BytesIO()
+    Image.new("RGB", size, "orange").save(buffer, format=fmt, **options)
+    return buffer.getvalue()
+
+
+@pytest.mark.parametrize("fmt, name", [("JPEG", "jpeg"), ("PNG", "png"), ("WEBP", "webp"), ("GIF", "gif"),
+                                       ("TIFF", "tiff"), ("BMP", "bmp")])
+def test_dimensions_are_read_from_the_header(fmt, name):
+    info = check_image(encode(fmt))
+    assert (info.format, info.width, info.height, info.frames) == (name, 120, 80, 1)
+
+
+def tiff(order, width, height, orientation=1, pages=1, kind=3):
+    """A TIFF header with one image directory per page, its dimensions stored as SHORTs (3) or LONGs (4)."""
+    byteorder = "little" if order == b"II" else "big"
+
+    def field(value, size):
+        return value.to_bytes(size, byteorder)
+
+    data = order + field(42, 2) + field(8, 4)
+    for page in range(pages):
+        entries = [(0x0100, kind, width), (0x0101, kind, height), (ORIENTATION_TAG, 3, orientation)]
+        data += field(len(entries), 2)
+        for tag, entry_kind, value in entries:
+            size = 2 if entry_kind == 3 else 4
+            data += field(tag, 2) + field(entry_kind, 2) + field(1, 4) + field(value, size) + bytes(4 - size)
+        next_directory = len(data) + 4 if page < pages - 1 else 0
+        data += field(next_directory, 4)
+    return data
+
+
+@pytest.mark.parametrize("order, kind", [(b"II", 3), (b"II", 4), (b"MM", 3), (b"MM", 4)])
+def test_tiff_orientation_and_pages(order, kind):
+    info = probe(tiff(order, 120, 80, orientation=6, pages=3, kind=kind))
+    assert (info.format, info.width, info.height, info.orientation, info.frames) == ("tiff", 120, 80, 6, 3)
+    assert info.display_size == (80, 120)
+
+
+def test_top_down_bmp():
+    data = bytearray(encode("BMP"))
+    # Store the height negated, as top-down bitmaps do
+    data[22:26] = (-80).to_bytes(4, "little", signed=True)
+    assert probe(bytes(data))[1:3] == (120, 80)
+
+
+def test_tiff_pixel_bombs_are_refused():
+    with pytest.raises(ImageRejected) as error:
+        check_image(encode("TIFF", size=(400, 300)), max_pixels=100_000)
+    assert error.value.status_code == 413
+
+
+def ftyp(major, *compatible):
+    box = major + b"\0\0\0\0" + b"".join(compatible)
+    return (8 + len(box)).to_bytes(4, "big") + b"ftyp" + box + b"\0\0\0\x08meta"
+
+
+@pytest.mark.parametrize("data, name", [
+    (ftyp(b"heic", b"mif1", b"heic"), "HEIC"),
+    (ftyp(b"mif1", b"avif", b"mif1"), "AVIF"),
+    (ftyp(b"mif1", b"mif1"), "HEIF"),
+])
+def test_heic_and_avif_are_refused_by_name(data, name):
+    with pytest.raises(ImageRejected) as error:
+        check_image(data)
+    assert error.value.status_code == 415
+    assert error.value.detail.startswith(f"{name} images are not supported")
+    assert "JPEG, PNG, WebP, GIF, TIFF or BMP" in error.value.detail
+
+
+def test_unknown_formats_get_415_and_damaged_images_400():
+    with pytest.raises(ImageRejected) as error:
+        check_image(b"%PDF-1.7\n" + bytes(100))
+    assert error.value.status_code == 415
+    assert "JPEG, PNG, WebP, GIF, TIFF or BMP" in error.value.detail
+
+    for truncated in (encode("JPEG")[:20], encode("TIFF")[:8]):
+        with pytest.raises(ImageRejected) as error:
+            check_image(truncated)
+        assert error.value.status_code == 400
+
+
+def test_check_file(tmp_path):
+    path = tmp_path / "upload"
+    path.write_bytes(encode("BMP"))
+    assert check_file(str(path)).format == "bmp"
+    path.write_bytes(b"")
+    with pytest.raises(ImageRejected) as error:
+        check_file(str(path))
+    assert error.value.status_code == 400
+
+
+def test_the_detection_endpoint_probes_off_the_event_loop(monkeypatch):
+    import asyncio
+    from fastapi import HTTPException, UploadFile
+    from starlette.datastructures import Headers
+    import api_main
+
+    def probe_in_thread(contents):
+        # Raises RuntimeError when called on the event loop's thread
+        with pytest.raises(RuntimeError):
+            asyncio.get_running_loop()
+        raise ImageRejected(415, "probed")
+
+    monkeypatch.setattr(api_main, "check_image", probe_in_thread)
+    upload = UploadFile(io.BytesIO(encode("GIF")), filename="a.gif", headers=Headers({"content-type": "image/png"}))
+    with pytest.raises(HTTPException) as error:
+        asyncio.run(api_main.detect_objects(upload, mode="boxes"))
+    assert (error.value.status_code, error.value.detail) == (415, "probed")
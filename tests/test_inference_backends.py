@@ -0,0 +1,85 @@
+import numpy as np
+import pytest
+
+from inference_backends import load_detector, nms, postprocess, preprocess
+
+# Mark all tests in this file as unit tests
+pytestmark = pytest.mark.unit
+
+
+def reference_nms(boxes, scores, iou_threshold):
+    """Textbook greedy NMS, one pair of boxes at a time."""
+    def iou(a, b):
+        width = max(0.0, min(a[2], b[2]) - max(a[0], b[0]))
+        height = max(0.0, min(a[3], b[3]) - max(a[1], b[1]))
+        inter = width * height
+        return inter / ((a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - inter)
+
+    keep = []
+    for i in sorted(range(len(scores)), key=lambda i: -scores[i]):
+        if all(iou(boxes[i], boxes[j]) <= iou_threshold for j in keep):
+            keep.append(i)
+    return keep
+
+
+def random_boxes(rng, count, extent=200):
+    xy = rng.uniform(0, extent, (count, 2))
+    wh = rng.uniform(5, 60, (count, 2))
+    return np.hstack([xy, xy + wh]).astype(np.float32)
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_nms_matches_the_pairwise_loop(seed):
+    rng = np.random.default_rng(seed)
+    boxes = random_boxes(rng, 150)
+    # Distinct scores, so the order of the boxes is well defined
+    scores = rng.permutation(150).astype(np.float32) / 150
+    assert nms(boxes, scores, 0.45).tolist() == reference_nms(boxes.tolist(), scores.tolist(), 0.45)
+
+
+def raw_output(rows, classes=3, anchors=8):
+    """YOLOv8 output for one image: (4 + classes, anchors), rows of (cx, cy, w, h, class, score)."""
+    output = np.zeros((4 + classes, anchors), np.float32)
+    for anchor, (cx, cy, w, h, cls, score) in enumerate(rows):
+        output[:4, anchor] = cx, cy, w, h
+        output[4 + cls, anchor] = score
+    return output[None]
+
+
+def test_postprocess_decodes_filters_and_suppresses_per_class():
+    output = raw_output([
+        (50, 50, 20, 40, 0, 0.9),
+        (51, 50, 20, 40, 0, 0.8),   # Same object, lower score
+        (51, 50, 20, 40, 1, 0.7),   # Overlaps, but another class
+        (150, 100, 10, 10, 2, 0.1),  # Below the confidence threshold
+    ])
+    [(boxes, confidences, classes)] = postprocess(output, conf_threshold=0.25, iou_threshold=0.45)
+    assert boxes.tolist() == [[40, 30, 60, 70], [41, 30, 61, 70]]
+    assert confidences.tolist() == pytest.approx([0.9, 0.7])
+    assert classes.tolist() == [0, 1]
+
+
+def test_postprocess_keeps_at_most_max_det_per_image():
+    rows = [(20 * i + 10, 10, 10, 10, 0, 0.5 + i / 100) for i in range(8)]
+    [(boxes, confidences, _)] = postprocess(raw_output(rows), max_det=3)
+    assert len(boxes) == 3
+    assert confidences.tolist() == pytest.approx([0.57, 0.56, 0.55])
+
+
+def test_postprocess_with_nothing_detected():
+    [(boxes, confidences, classes)] = postprocess(raw_output([]))
+    assert boxes.shape == (0, 4)
+    assert len(confidences) == len(classes) == 0
+
+
+def test_preprocess_produces_rgb_nchw_in_0_1():
+    canvases = [np.random.default_rng(i).integers(0, 256, (16, 16, 3), dtype=np.uint8) for i in range(2)]
+    batch = preprocess(canvases)
+    expected = np.stack(canvases)[..., ::-1].transpose(0, 3, 1, 2).astype(np.float32) / 255
+    assert batch.dtype == np.float32
+    np.testing.assert_allclose(batch, expected)
+
+
+def test_unknown_backend_is_rejected():
+    with pytest.raises(ValueError):
+        load_detector("tensorrt")
@@ -0,0 +1,47 @@
+import asyncio
+import json
+
+import pytest
+
+# Mark all tests in this file as unit tests
+pytestmark = pytest.mark.unit
+
+
+async def serve(path, reply):
+    """A stand-in inference server that answers each request with `reply`, or never if it is None."""
+    async def handle(reader, writer):
+        await reader.readline()
+        if reply is None:
+            await asyncio.sleep(60)
+        writer.write(json.dumps(reply).encode() + b"\n")
+        await writer.drain()
+        writer.close()
+    return await asyncio.start_unix_server(handle, path=path)
+
+
+def test_status_request(tmp_path):
+    from detection import InferenceClient
+
+    async def run():
+        path = str(tmp_path / "inference.sock")
+        async with await serve(path, {"model": "ready", "model_error": None}):
+            client = InferenceClient(socket_path=path)
+            await client.warm_up()
+            assert client.model_state == "ready"
+
+    asyncio.run(run())
+
+
+def test_unresponsive_server_times_out_with_503(tmp_path, monkeypatch):
+    import detection
+    monkeypatch.setattr(detection, "INFERENCE_SERVER_TIMEOUT", 0.1)
+
+    async def run():
+        path = str(tmp_path / "inference.sock")
+        async with await serve(path, None):
+            client = detection.InferenceClient(socket_path=path)
+            with pytest.raises(detection.DetectionError) as error:
+                await client.detect_batch([b"image"], ["full"])
+            assert error.value.status_code == 503
+
+    asyncio.run(run())
@@ -0,0 +1,142 @@
+import asyncio
+import json
+import os
+import random
+import sqlite3
+import subprocess
+import sys
+from datetime import datetime
+
+import pytest
+
+BENCHMARKS = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "benchmarks")
+sys.path.insert(0, BENCHMARKS)
+
+import bench_load  # noqa: E402
+
+# Mark all tests in this file as unit tests
+pytestmark = pytest.mark.unit
+
+DATA = {"posts": 100, "oldest": "2026-01-01T00:00:00", "newest": "2026-01-31T00:00:00"}
+WORKER = {"token": "abc", "image": b"jpeg", "detect_cache": False, "detect_mode": "boxes"}
+
+
+def requests_for(endpoint, seed=0, iterations=20):
+    rng = random.Random(seed)
+    return [bench_load.build_requests(endpoint, rng, DATA, WORKER) for _ in range(iterations)]
+
+
+@pytest.mark.parametrize("endpoint", bench_load.ENDPOINTS)
+def test_the_same_seed_sends_the_same_requests(endpoint):
+    assert requests_for(endpoint) == requests_for(endpoint)
+    if endpoint != "detect_objects":
+        assert requests_for(endpoint) != requests_for(endpoint, seed=1)
+
+
+def test_requests_stay_within_the_seeded_data():
+    for [(_, _, url, kwargs)] in requests_for("get_posts", iterations=200):
+        assert url == "/posts/" and 0 <= kwargs["params"]["page"] < DATA["posts"] // 18
+    for [(_, _, _, kwargs)] in requests_for("posts_changed", iterations=200):
+        assert DATA["oldest"] <= kwargs["params"]["since"] < DATA["newest"]
+    for [(_, _, url, _)] in requests_for("post_comments", iterations=200):
+        assert 1 <= int(url.split("/")[2]) <= DATA["posts"]
+    for up, down in requests_for("thumbs"):
+        assert up[2].replace("up", "down") == down[2]
+        assert up[3]["headers"]["Authorization"] == "Bearer abc"
+
+
+def test_detection_requests_miss_the_cache_unless_asked():
+    uploads = [kwargs["files"]["file"][1] for [(_, _, _, kwargs)] in requests_for("detect_objects")]
+    assert len(set(uploads)) == len(uploads)
+    assert all(upload.startswith(b"jpeg") for upload in uploads)
+
+    rng = random.Random(0)
+    cached = dict(WORKER, detect_cache=True)
+    assert {bench_load.build_requests("detect_objects", rng, DATA, cached)[0][3]["files"]["file"][1]
+            for _ in range(5)} == {b"jpeg"}
+
+
+class FakeClient:
+    """Answers every request at once, with 500 for comments."""
+
+    def __init__(self):
+        self.calls = []
+
+    async def request(self, method, url, **kwargs):
+        self.calls.append((method, url))
+        return type("Response", (), {"status_code": 500 if "comments" in url else 200})
+
+
+def test_run_endpoint_splits_requests_between_workers():
+    client = FakeClient()
+    stats = asyncio.run(bench_load.run_endpoint(client, "thumbs", 10, 3, 2, 0, DATA, [WORKER] * 3))
+    # Two warm-up iterations, then ten iterations of two requests each
+    assert len(client.calls) == 24
+    assert set(stats) == {"thumbs_up", "thumbs_down"}
+    assert stats["thumbs_up"]["requests"] == 10
+    assert stats["thumbs_up"]["errors"] == 0
+    assert stats["thumbs_up"]["p50_ms"] <= stats["thumbs_up"]["p95_ms"] <= stats["thumbs_up"]["p99_ms"]
+
+    stats = asyncio.run(bench_load.run_endpoint(client, "post_comments", 4, 2, 0, 0, DATA, [WORKER] * 2))
+    assert stats["post_comments"]["errors"] == 4
+
+
+def test_percentile():
+    values = list(range(1, 101))
+    assert bench_load.percentile(values, 50) == 51
+    assert bench_load.percentile(values, 99) == 100
+    assert bench_load.percentile([5], 95) == 5
+
+
+def endpoint_stats(p50=10.0, p95=20.0, rps=100.0, errors=0):
+    return {"requests": 100, "errors": errors, "rps": rps, "p50_ms": p50, "p95_ms": p95, "p99_ms": 30.0}
+
+
+def test_compare_flags_only_changes_beyond_the_threshold():
+    baseline = {"created": "2026-01-01", "results": {"1000": {"endpoints": {
+        "get_posts": endpoint_stats(), "thumbs_up": endpoint_stats(), "post_comments": endpoint_stats(),
+    }}}}
+    results = {"1000": {"endpoints": {
+        "get_posts": endpoint_stats(p50=11.0, rps=90.0),          # Within 20%
+        "thumbs_up": endpoint_stats(p95=30.0, rps=70.0),          # Slower and less throughput
+        "post_comments": endpoint_stats(p50=5.0, errors=1),       # Faster, but failing
+        "detect_objects": endpoint_stats(p50=1000.0),             # Not in the baseline
+    }}, "5000": {"endpoints": {"get_posts": endpoint_stats(p50=100.0)}}}
+
+    regressions = bench_load.compare(results, baseline, 0.2)
+
+    assert regressions == [
+        "1000 posts, thumbs_up: p95_ms 20.0 -> 30.0, rps 100.0 -> 70.0",
+        "1000 posts, post_comments: errors 0 -> 1",
+    ]
+
+
+def test_seeding_is_deterministic(tmp_path):
+    """seed_data.py gives the same posts, comments and likes for the same seed, relative to when it runs."""
+    def seed(name):
+        data_dir = tmp_path / name
+        subprocess.run([sys.executable, os.path.join(BENCHMARKS, "seed_data.py"), "--data-dir", str(data_dir),
+                        "--users", "10", "--posts", "40", "--images", "3", "--seed", "7"],
+                       check=True, capture_output=True, timeout=120)
+        db = sqlite3.connect(data_dir / "db.sqlite3")
+        rows = {table: db.execute(query).fetchall() for table, query in {
+            "posts": "SELECT id, photo_uuid, user_id, created_at, thumbs_up, original_size FROM posts ORDER BY id",
+            "comments": "SELECT post_id, user_id, content, created_at FROM comments ORDER BY id",
+            "likes": "SELECT id, thumbed_posts FROM users ORDER BY id",
+            "blobs": "SELECT photo_uuid, ref_count FROM photo_blobs ORDER BY photo_uuid",
+        }.items()}
+        db.close()
+        summary = json.loads((data_dir / "seed.json").read_text())
+        # Times are spread back from when the data was seeded
+        newest = datetime.fromisoformat(summary["newest"])
+        for table in ("posts", "comments"):
+            # created_at is the fourth column of both
+            rows[table] = [row[:3] + (newest - datetime.fromisoformat(row[3]),) + row[4:] for row in rows[table]]
+        return summary, rows
+
+    summary, rows = seed("first")
+    assert (summary["users"], summary["posts"], summary["images"]) == (10, 40, 3)
+    assert len(rows["posts"]) == 40 and len(rows["comments"]) == summary["comments"]
+    assert sum(count for _, count in rows["blobs"]) == 40
+    assert sum(thumbs for *_, thumbs, _ in rows["posts"]) == summary["likes"]
+    assert seed("second")[1] == rows
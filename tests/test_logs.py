@@ -0,0 +1,29 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+# Mark all tests in this file as unit tests
+pytestmark = pytest.mark.unit
+
+
+def test_request_id_reaches_inference_threads():
+    from detection import InferencePool
+    from logs import request_id
+
+    pool = InferencePool(kind="thread", workers=1)
+    # Skip the initializer, which loads the model
+    pool._executor = ThreadPoolExecutor(max_workers=1)
+
+    async def handle(current):
+        request_id.set(current)
+        return await pool.run(request_id.get), await asyncio.to_thread(request_id.get)
+
+    async def run():
+        return await asyncio.gather(handle("first"), handle("second"))
+
+    try:
+        assert asyncio.run(run()) == [("first", "first"), ("second", "second")]
+        assert request_id.get() is None
+    finally:
+        pool.shutdown()
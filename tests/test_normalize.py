@@ -0,0 +1,100 @@
+import base64
+import hashlib
+import io
+
+import pytest
+from PIL import Image, ImageCms
+
+from normalize import ORIENTATION_TAG, make_placeholder, normalize_image
+
+# Mark all tests in this file as unit tests
+pytestmark = pytest.mark.unit
+
+
+def save(path, size=(300, 200), mode="RGB", **options):
+    """A gradient image, so it compresses like a photo rather than a flat color."""
+    im = Image.linear_gradient("L").resize(size).convert(mode)
+    im.save(path, **options)
+    return str(path)
+
+
+def test_orientation_is_applied_and_metadata_dropped(tmp_path):
+    exif = Image.Exif()
+    exif[ORIENTATION_TAG] = 6  # Rotated 90 degrees clockwise
+    exif[0x010F] = "Phone maker"
+    icc = ImageCms.ImageCmsProfile(ImageCms.createProfile("sRGB")).tobytes()
+    src = save(tmp_path / "in.jpg", exif=exif.tobytes(), icc_profile=icc, quality=95)
+
+    result = normalize_image(src, str(tmp_path / "out.jpg"))
+
+    with Image.open(tmp_path / "out.jpg") as out:
+        assert out.size == (200, 300)
+        assert out.format == "JPEG"
+        assert "progressive" in out.info
+        assert "exif" not in out.info
+        assert out.info.get("icc_profile") == icc
+    assert result["keep"] is True
+    assert result["extension"] == "jpg"
+    assert result["digest"] == hashlib.sha256((tmp_path / "out.jpg").read_bytes()).hexdigest()
+    assert result["normalized_size"] == (tmp_path / "out.jpg").stat().st_size
+
+
+def test_large_photos_are_scaled_down(tmp_path):
+    src = save(tmp_path / "in.png", size=(1000, 400))
+    result = normalize_image(src, str(tmp_path / "out.webp"), max_dimension=500, fmt="webp")
+    with Image.open(tmp_path / "out.webp") as out:
+        assert out.size == (500, 200)
+        assert out.format == "WEBP"
+    assert result["keep"] is True
+    assert result["extension"] == "webp"
+
+
+def test_transparency_is_flattened_onto_white_for_jpeg(tmp_path):
+    im = Image.new("RGBA", (50, 50), (255, 0, 0, 0))
+    im.paste((0, 0, 255, 255), (0, 0, 25, 50))
+    im.save(tmp_path / "in.png")
+    normalize_image(str(tmp_path / "in.png"), str(tmp_path / "out.jpg"))
+    with Image.open(tmp_path / "out.jpg") as out:
+        assert out.mode == "RGB"
+        assert all(abs(a - b) < 16 for a, b in zip(out.getpixel((45, 25)), (255, 255, 255)))
+        assert all(abs(a - b) < 16 for a, b in zip(out.getpixel((5, 25)), (0, 0, 255)))
+
+
+def test_clean_small_photo_is_not_worth_replacing(tmp_path):
+    src = save(tmp_path / "in.jpg", quality=30)
+    result = normalize_image(src, str(tmp_path / "out.jpg"), quality=95)
+    assert result["normalized_size"] > result["original_size"]
+    assert result["keep"] is False
+
+
+def test_animations_are_left_alone(tmp_path):
+    frames = [Image.new("RGB", (20, 20), color) for color in ("red", "blue")]
+    frames[0].save(tmp_path / "in.gif", save_all=True, append_images=frames[1:])
+    assert normalize_image(str(tmp_path / "in.gif"), str(tmp_path / "out.jpg")) is None
+    assert not (tmp_path / "out.jpg").exists()
+
+
+def decode_placeholder(placeholder: str) -> Image.Image:
+    prefix = "data:image/jpeg;base64,"
+    assert placeholder.startswith(prefix)
+    return Image.open(io.BytesIO(base64.b64decode(placeholder[len(prefix):])))
+
+
+def test_placeholder_is_a_tiny_upright_jpeg(tmp_path):
+    exif = Image.Exif()
+    exif[ORIENTATION_TAG] = 6
+    src = save(tmp_path / "in.jpg", size=(1600, 1200), exif=exif.tobytes())
+
+    placeholder = make_placeholder(src)
+
+    preview = decode_placeholder(placeholder)
+    assert preview.format == "JPEG"
+    assert preview.size == (24, 32)
+    assert len(placeholder) < 1024
+
+
+def test_placeholder_of_a_transparent_png(tmp_path):
+    Image.new("RGBA", (100, 50), (0, 0, 255, 128)).save(tmp_path / "in.png")
+    preview = decode_placeholder(make_placeholder(str(tmp_path / "in.png"), size=16))
+    assert preview.mode == "RGB"
+    assert preview.size == (16, 8)
@@ -0,0 +1,164 @@
+import io
+import json
+import time
+import zipfile
+import zlib
+
+import pytest
+import requests
+
+from test_utils import BASE_URL, api_request
+
+# Mark all tests in this file as API tests
+pytestmark = pytest.mark.api
+
+def detect(image_path: str, **params) -> requests.Response:
+    with open(image_path, "rb") as img:
+        return requests.post(
+            f"{BASE_URL}/api/detect-objects/",
+            files={"file": ("test_image.jpg", img, "image/jpeg")},
+            params=params,
+        )
+
+@pytest.mark.api
+@pytest.mark.slow
+def test_repeated_detection_is_cached(test_image):
+    """Sending the same image twice answers the second request from the cache."""
+    first = detect(test_image)
+    assert first.status_code == 200
+    before = requests.get(f"{BASE_URL}/api/detect-objects/stats").json()["cache"]
+
+    second = detect(test_image)
+    assert second.status_code == 200
+    assert second.json() == first.json()
+
+    after = requests.get(f"{BASE_URL}/api/detect-objects/stats").json()["cache"]
+    hits = lambda stats: stats["memory_hits"] + stats["disk_hits"] + stats["coalesced"]
+    assert hits(after) == hits(before) + 1
+    assert after["misses"] == before["misses"]
+
+@pytest.mark.api
+@pytest.mark.slow
+def test_detection_modes(test_image):
+    """The lean modes return the same detections with less or no image data."""
+    full = detect(test_image).json()
+
+    boxes = detect(test_image, mode="boxes")
+    assert boxes.status_code == 200
+    data = boxes.json()
+    assert "boxed_image" not in data
+    assert data["detected_objects"] == full["detected_objects"]
+    assert data["image_size"] == full["image_size"]
+    assert "boxed_image_size" not in data
+    assert full["boxed_image_size"]["width"] <= full["image_size"]["width"]
+    assert data["suggested_frame"] in data["suggested_frames"]["9:16"]
+
+    preview = detect(test_image, mode="preview").json()
+    assert len(preview["boxed_image"]) <= len(full["boxed_image"])
+    assert preview["image_size"] == full["image_size"]
+    assert preview["boxed_image_size"]["width"] <= full["boxed_image_size"]["width"]
+
+    binary = detect(test_image, mode="binary")
+    assert binary.status_code == 200
+    assert binary.headers["Content-Type"].startswith("multipart/mixed")
+    assert b"Content-Type: image/jpeg" in binary.content
+
+@pytest.mark.api
+def test_unknown_detection_mode(test_image):
+    """An unknown mode is rejected before any work is done."""
+    assert detect(test_image, mode="thumbnail").status_code == 400
+
+@pytest.mark.api
+def test_oversized_and_malformed_images_are_rejected(test_user):
+    """Images are refused from their header, before anything decodes them."""
+    # A valid PNG header claiming 30000x30000 pixels, with no image data
+    ihdr = b"IHDR" + (30000).to_bytes(4, "big") * 2 + bytes([8, 2, 0, 0, 0])
+    bomb = b"\x89PNG\r\n\x1a\n" + (13).to_bytes(4, "big") + ihdr + zlib.crc32(ihdr).to_bytes(4, "big")
+    truncated = b"\xff\xd8\xff\xe0\x00\x10JFIF"
+
+    for data, status in ((bomb, 413), (truncated, 400)):
+        response = requests.post(f"{BASE_URL}/api/detect-objects/", files={"file": ("image.png", data, "image/png")})
+        assert response.status_code == status
+        response = requests.post(
+            f"{BASE_URL}/posts/create/",
+            files={"file": ("image.png", data, "image/png")},
+            headers={"Authorization": f"Bearer {test_user['token']}"},
+        )
+        assert response.status_code == status
+
+def wait_for_detections(post_id: int, timeout: float = 60) -> requests.Response:
+    deadline = time.time() + timeout
+    while True:
+        response = requests.get(f"{BASE_URL}/posts/{post_id}/detections/")
+        if response.status_code != 202 or time.time() > deadline:
+            return response
+        time.sleep(0.5)
+
+@pytest.mark.api
+@pytest.mark.slow
+def test_post_detections_are_stored(test_post, test_image):
+    """A new post is analyzed in the background and its detections served from the database."""
+    response = wait_for_detections(test_post)
+    assert response.status_code == 200
+    data = response.json()
+    assert data["status"] == "done"
+    assert data["detected_objects"] == detect(test_image, mode="boxes").json()["detected_objects"]
+
+    frames = requests.get(f"{BASE_URL}/posts/{test_post}/frames/", params={"ratios": "1:1,3:2", "k": 2}).json()
+    assert set(frames["suggested_frames"]) == {"1:1", "3:2"}
+    for frame in frames["suggested_frames"]["1:1"]:
+        assert frame["width"] == frame["height"]
+        assert frame["x"] + frame["width"] <= data["image_size"]["width"]
+
+@pytest.mark.api
+@pytest.mark.slow
+def test_batch_detection_streams_ndjson(test_image):
+    """Every image of a batch, sent as parts or in a zip, gets one NDJSON line."""
+    with open(test_image, "rb") as img:
+        contents = img.read()
+    archive = io.BytesIO()
+    with zipfile.ZipFile(archive, "w") as zf:
+        zf.writestr("scenes/one.jpg", contents)
+        zf.writestr("notes.txt", "not an image")
+
+    response = requests.post(
+        f"{BASE_URL}/api/detect-objects/batch/",
+        files=[
+            ("files", ("a.jpg", contents, "image/jpeg")),
+            ("files", ("b.gif", b"GIF89a", "image/gif")),
+            ("archive", ("scenes.zip", archive.getvalue(), "application/zip")),
+        ],
+    )
+    assert response.status_code == 200
+    assert response.headers["Content-Type"].startswith("application/x-ndjson")
+    lines = sorted((json.loads(line) for line in response.text.splitlines()), key=lambda line: line["index"])
+    assert [line["name"] for line in lines] == ["a.jpg", "b.gif", "scenes/one.jpg"]
+
+    expected = detect(test_image, mode="boxes").json()["detected_objects"]
+    assert lines[0]["detected_objects"] == expected
+    assert lines[1]["status"] == 400
+    assert lines[2]["detected_objects"] == expected
+
+@pytest.mark.api
+@pytest.mark.slow
+def test_frame_scores_feed_community_heatmap(test_post, test_user):
+    """Frames a user contributes are added to the post's heatmap, read back in one request."""
+    size = wait_for_detections(test_post).json()["image_size"]
+    half = {"x": 0, "y": 0, "width": size["width"] // 2, "height": size["height"] // 2}
+    whole = {"x": 0, "y": 0, "width": size["width"], "height": size["height"]}
+
+    response = api_request(f"/posts/{test_post}/frames/score/", method="POST", data={"frames": [half, whole]})
+    assert api_request(f"/posts/{test_post}/frames/community/")["frames"] == 0
+
+    response = api_request(f"/posts/{test_post}/frames/score/", method="POST", token=test_user["token"],
+                           data={"frames": [half, whole], "contribute": True})
+    assert len(response["scores"]) == 2
+    assert all(0 <= s["score"] <= 100 for s in response["scores"])
+
+    community = api_request(f"/posts/{test_post}/frames/community/")
+    assert community["frames"] == 2
+    heatmap = community["heatmap"]
+    assert len(heatmap) == community["grid"]["rows"]
+    # Top-left cell is in both frames, bottom-right only in the whole photo
+    assert heatmap[0][0] == 2
+    assert heatmap[-1][-1] == 1
@@ -0,0 +1,133 @@
+import os
+import time
+
+import pytest
+
+# Mark all tests in this file as unit tests
+pytestmark = pytest.mark.unit
+
+GRACE = 3600
+
+
+def store_photo(name: str, age: float = 2 * GRACE, flat: bool = False) -> str:
+    """Write a photo in the sharded (or flat) layout, last modified `age` seconds ago."""
+    import storage
+    path = storage.legacy_photo_path(name) if flat else storage.photo_path(name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(b"photo " + name.encode())
+    mtime = time.time() - age
+    os.utime(path, (mtime, mtime))
+    return path
+
+
+@pytest.fixture
+def gc(upload_dir, session_factory, monkeypatch):
+    import orphan_gc
+    import storage
+    monkeypatch.setattr(orphan_gc, "Session", session_factory)
+    monkeypatch.setattr(orphan_gc, "QUARANTINE_DIR", storage.QUARANTINE_DIR)
+    monkeypatch.setattr(orphan_gc, "TMP_DIR", storage.TMP_DIR)
+    return orphan_gc
+
+
+def reference(session_factory, *names):
+    from backend import Post
+    session = session_factory()
+    session.add_all(Post(photo_uuid=name, user_id=1) for name in names)
+    session.commit()
+    session.close()
+
+
+def test_legacy_photos_are_listed_in_order(upload_dir):
+    """The flat directory is listed prefix by prefix but comes out fully sorted."""
+    import storage
+    names = ["f00d.jpg", "0abc.jpg", "a1.png", "a", "ab12cd.jpg", "Z9.jpg", "0000.jpg"]
+    for name in names:
+        store_photo(name, flat=True)
+    os.makedirs(os.path.join(upload_dir, "ab"))
+    store_photo(".hidden", flat=True)
+
+    for prefix_length in (1, 2, 3):
+        listed = [name for name, _ in storage.iter_legacy_photos(prefix_length)]
+        assert listed == sorted(names)
+
+    store_photo("abcdef0123.jpg")
+    assert [name for name, _ in storage.iter_stored_photos()] == sorted(names + ["abcdef0123.jpg"])
+
+
+def test_referenced_photos_are_kept_and_orphans_quarantined(gc, session_factory):
+    """Only old unreferenced photos are taken out of service, in either layout."""
+    import storage
+    referenced = [store_photo("aa11ref.jpg"), store_photo("cc33ref.jpg", flat=True)]
+    orphans = [store_photo("bb22orphan.jpg"), store_photo("dd44orphan.jpg", flat=True)]
+    recent = store_photo("ee55recent.jpg", age=60)
+    reference(session_factory, "aa11ref.jpg", "cc33ref.jpg")
+
+    removed = []
+    # One name per query, so the merge-join crosses batch boundaries
+    report = gc.collect_orphans(grace=GRACE, batch_size=1, on_removed=removed.append)
+
+    assert report["scanned"] == 5
+    assert report["orphans"] == 2
+    assert report["skipped_recent"] == 1
+    assert report["quarantined"] == 2
+    assert report["deleted"] == 0
+    assert sorted(removed) == ["bb22orphan.jpg", "dd44orphan.jpg"]
+    assert all(os.path.exists(path) for path in referenced + [recent])
+    assert not any(os.path.exists(path) for path in orphans)
+    assert sorted(os.listdir(storage.QUARANTINE_DIR)) == ["bb22orphan.jpg", "dd44orphan.jpg"]
+
+
+def test_dry_run_changes_nothing(gc):
+    orphan = store_photo("bb22orphan.jpg")
+    report = gc.collect_orphans(grace=GRACE, dry_run=True)
+    assert report["orphans"] == 1
+    assert os.path.exists(orphan)
+
+
+def test_quarantined_photos_are_purged_after_the_grace_period(gc):
+    """A quarantined photo can still be restored until it has sat out another grace period."""
+    import storage
+    store_photo("bb22orphan.jpg")
+    gc.collect_orphans(grace=GRACE)
+    quarantined = os.path.join(storage.QUARANTINE_DIR, "bb22orphan.jpg")
+
+    # The quarantine clock starts when the photo is moved, not at its mtime
+    report = gc.collect_orphans(grace=GRACE)
+    assert os.path.exists(quarantined)
+    assert report["deleted"] == 0
+
+    # An upload interrupted long ago is cleaned up along with it
+    stale_upload = storage.temp_path()
+    with open(stale_upload, "wb") as f:
+        f.write(b"partial")
+    expired = time.time() - GRACE - 1
+    for path in (quarantined, stale_upload):
+        os.utime(path, (expired, expired))
+
+    report = gc.collect_orphans(grace=GRACE)
+    assert not os.path.exists(quarantined)
+    assert not os.path.exists(stale_upload)
+    assert report["deleted"] == 2
+    assert report["reclaimed_bytes"] == len(b"photo bb22orphan.jpg") + len(b"partial")
+
+
+def test_upload_restores_a_collected_photo(upload_dir, session_factory):
+    """A blob whose file was collected is written back by the next identical upload."""
+    import storage
+    from backend import PhotoBlob
+    session = session_factory()
+    session.add(PhotoBlob(digest="ab" * 32, photo_uuid="ab" * 32 + ".jpg", size=5, ref_count=1))
+    session.commit()
+
+    tmp = storage.temp_path()
+    with open(tmp, "wb") as f:
+        f.write(b"photo")
+    name, created = storage.store_blob(session, "ab" * 32, tmp, 5, "photo.jpg")
+    session.commit()
+
+    assert (name, created) == ("ab" * 32 + ".jpg", True)
+    assert storage.locate_photo(name) == storage.photo_path(name)
+    assert session.query(PhotoBlob).one().ref_count == 2
+    session.close()
@@ -0,0 +1,90 @@
+import os
+
+import pytest
+
+# Mark all tests in this file as unit tests
+pytestmark = pytest.mark.unit
+
+
+@pytest.fixture
+def store(tmp_path):
+    from pack_store import PackFileStore
+    # Small segments, so a few photos fill several of them
+    return PackFileStore(str(tmp_path / "packs"), segment_size=100)
+
+
+def photo(i: int) -> bytes:
+    return bytes([i]) * 40
+
+
+def test_put_read_delete(store, tmp_path):
+    store.put_bytes("a.jpg", photo(1))
+    store.put_bytes("a.jpg", photo(2))
+    tmp = tmp_path / "upload"
+    tmp.write_bytes(photo(3))
+    store.put(str(tmp), "b.jpg")
+
+    assert not tmp.exists()
+    view = store.read(store.lookup("a.jpg"))
+    assert isinstance(view, memoryview)
+    # Existing names are left untouched
+    assert view == photo(1)
+    assert store.read_bytes("b.jpg") == photo(3)
+    with store.local_path("b.jpg") as path:
+        with open(path, "rb") as f:
+            assert f.read() == photo(3)
+
+    store.delete("a.jpg")
+    assert store.lookup("a.jpg") is None
+    assert store.read_bytes("a.jpg") is None
+    assert [name for name, _, _ in store.iter_photos()] == ["b.jpg"]
+    assert store.stats()["live_bytes"] == 40
+
+
+def test_segments_roll_over(store):
+    for i in range(5):
+        store.put_bytes(f"{i}.jpg", photo(i))
+    stats = store.stats()
+    assert stats["segments"] == 3
+    assert stats["disk_bytes"] == 200
+    assert all(store.read_bytes(f"{i}.jpg") == photo(i) for i in range(5))
+
+
+def test_compaction_moves_live_blobs_and_frees_dead_segments(store):
+    for i in range(5):
+        store.put_bytes(f"{i}.jpg", photo(i))
+    old_segment = store.lookup("1.jpg").segment
+    store.delete("0.jpg")
+
+    report = store.compact(min_dead_ratio=0.5)
+
+    assert report == {"segments": 1, "moved_blobs": 1, "reclaimed_bytes": 40}
+    assert not os.path.exists(store.segment_path(old_segment))
+    assert store.lookup("1.jpg").segment != old_segment
+    assert all(store.read_bytes(f"{i}.jpg") == photo(i) for i in range(1, 5))
+    assert store.stats()["live_bytes"] == 160
+
+
+def test_interrupted_compaction_keeps_the_index_on_the_old_segment(store, monkeypatch):
+    """Nothing is committed until the copies are on disk, so a crash leaves the old segment in use."""
+    for i in range(5):
+        store.put_bytes(f"{i}.jpg", photo(i))
+    store.delete("0.jpg")
+    before = store.lookup("1.jpg")
+
+    def crash(segment):
+        raise OSError("disk gone")
+
+    monkeypatch.setattr(store, "_sync", crash)
+    with pytest.raises(OSError):
+        store.compact(min_dead_ratio=0.5)
+
+    assert not store._connection().in_transaction
+    after = store.lookup("1.jpg")
+    assert (after.segment, after.offset) == (before.segment, before.offset)
+    assert os.path.exists(store.segment_path(before.segment))
+    assert store.read_bytes("1.jpg") == photo(1)
+
+    monkeypatch.undo()
+    assert store.compact(min_dead_ratio=0.5)["moved_blobs"] == 1
+    assert all(store.read_bytes(f"{i}.jpg") == photo(i) for i in range(1, 5))
@@ -0,0 +1,99 @@
+import pytest
+
+from photo_cache import PhotoStatCache, RangeNotSatisfiable, etag_matches, iter_file_range, parse_range
+
+# Mark all tests in this file as unit tests
+pytestmark = pytest.mark.unit
+
+
+class Lookup:
+    """A photo store lookup that counts its calls."""
+
+    def __init__(self, *existing):
+        self.existing = set(existing)
+        self.calls = []
+
+    def __call__(self, name):
+        self.calls.append(name)
+        return f"entry for {name}" if name in self.existing else None
+
+
+def test_lookups_are_cached_until_they_expire(monkeypatch):
+    import photo_cache
+    now = [1000.0]
+    monkeypatch.setattr(photo_cache.time, "monotonic", lambda: now[0])
+    cache, lookup = PhotoStatCache(maxsize=10, ttl=60), Lookup("a.jpg")
+
+    assert cache.get("a.jpg", lookup) == "entry for a.jpg"
+    now[0] += 59
+    assert cache.get("a.jpg", lookup) == "entry for a.jpg"
+    assert lookup.calls == ["a.jpg"]
+    now[0] += 2
+    assert cache.get("a.jpg", lookup) == "entry for a.jpg"
+    assert lookup.calls == ["a.jpg", "a.jpg"]
+    assert (cache.hits, cache.misses) == (1, 2)
+
+
+def test_missing_photos_are_not_cached():
+    cache, lookup = PhotoStatCache(), Lookup()
+    assert cache.get("new.jpg", lookup) is None
+    # Uploaded in the meantime
+    lookup.existing.add("new.jpg")
+    assert cache.get("new.jpg", lookup) == "entry for new.jpg"
+
+
+def test_least_recently_used_entries_are_evicted_and_invalidated_ones_forgotten():
+    cache, lookup = PhotoStatCache(maxsize=2), Lookup("a", "b", "c")
+    cache.get("a", lookup)
+    cache.get("b", lookup)
+    cache.get("a", lookup)
+    cache.get("c", lookup)
+    lookup.calls.clear()
+
+    cache.get("a", lookup)
+    cache.get("b", lookup)
+    assert lookup.calls == ["b"]
+
+    cache.invalidate("a")
+    cache.get("a", lookup)
+    assert lookup.calls == ["b", "a"]
+
+
+@pytest.mark.parametrize("header, matches", [
+    (None, False),
+    ('"abc"', True),
+    ('W/"abc"', True),
+    ('"x", "abc"', True),
+    ('"abcd"', False),
+    ("*", True),
+])
+def test_etag_matches(header, matches):
+    assert etag_matches(header, '"abc"') is matches
+
+
+@pytest.mark.parametrize("header, expected", [
+    (None, None),
+    ("bytes=0-99", (0, 99)),
+    ("bytes=100-", (100, 999)),
+    ("bytes=-100", (900, 999)),
+    ("bytes=-5000", (0, 999)),
+    ("bytes=900-5000", (900, 999)),
+    ("bytes=5-1", None),
+    ("bytes=0-1,5-6", None),
+    ("items=0-1", None),
+    ("bytes=a-b", None),
+])
+def test_parse_range(header, expected):
+    assert parse_range(header, 1000) == expected
+
+
+@pytest.mark.parametrize("header, size", [("bytes=1000-", 1000), ("bytes=-0", 1000), ("bytes=-1", 0)])
+def test_unsatisfiable_ranges(header, size):
+    with pytest.raises(RangeNotSatisfiable):
+        parse_range(header, size)
+
+
+def test_iter_file_range(tmp_path):
+    path = tmp_path / "photo.jpg"
+    path.write_bytes(bytes(range(256)) * 4)
+    assert b"".join(iter_file_range(str(path), 10, 700, chunk_size=64)) == path.read_bytes()[10:701]
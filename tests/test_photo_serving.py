@@ -0,0 +1,50 @@
+import pytest
+import requests
+
+from test_utils import create_test_post, delete_post, api_request, BASE_URL
+
+# Mark all tests in this file as API tests
+pytestmark = pytest.mark.api
+
+@pytest.fixture(scope="function")
+def photo_url(test_user, test_image):
+    """Create a post and return the URL of its photo."""
+    post_id = create_test_post(test_user["token"], test_image)
+    post = api_request(f"/posts/{post_id}/")["post"]
+    yield f"{BASE_URL}/photos/{post['photo_uuid']}"
+    delete_post(test_user["token"], post_id)
+
+@pytest.mark.api
+def test_photo_has_immutable_cache_headers(photo_url):
+    """Photos are served with long-lived caching headers and an ETag."""
+    response = requests.get(photo_url)
+    assert response.status_code == 200
+    assert "immutable" in response.headers["Cache-Control"]
+    assert response.headers["ETag"]
+    assert response.headers["Accept-Ranges"] == "bytes"
+
+@pytest.mark.api
+def test_photo_conditional_request(photo_url):
+    """A matching If-None-Match gets an empty 304."""
+    etag = requests.get(photo_url).headers["ETag"]
+    response = requests.get(photo_url, headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.content == b""
+
+@pytest.mark.api
+def test_photo_byte_range(photo_url):
+    """Single byte ranges are answered with 206 and the requested slice."""
+    full = requests.get(photo_url).content
+    response = requests.get(photo_url, headers={"Range": "bytes=2-9"})
+    assert response.status_code == 206
+    assert response.content == full[2:10]
+    assert response.headers["Content-Range"] == f"bytes 2-9/{len(full)}"
+
+    response = requests.get(photo_url, headers={"Range": f"bytes={len(full)}-"})
+    assert response.status_code == 416
+
+@pytest.mark.api
+def test_photo_path_traversal_rejected():
+    """Names that escape the uploads directory are refused."""
+    response = requests.get(f"{BASE_URL}/photos/..%2Fsettings.py")
+    assert response.status_code in (403, 404)
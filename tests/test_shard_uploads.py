@@ -0,0 +1,89 @@
+import os
+
+import pytest
+
+# Mark all tests in this file as unit tests
+pytestmark = pytest.mark.unit
+
+DIGEST = "abcdef" + "0" * 58
+
+
+def write(path: str, contents: bytes = b"photo") -> str:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(contents)
+    return path
+
+
+def stored_files(upload_dir: str) -> list:
+    return sorted(
+        os.path.relpath(os.path.join(directory, name), upload_dir)
+        for directory, _, files in os.walk(upload_dir) for name in files
+    )
+
+
+def test_photos_are_fanned_out_by_name(upload_dir):
+    import storage
+    assert storage.shard_parts(f"{DIGEST}.jpg") == ["ab", "cd"]
+    assert storage.photo_path(f"{DIGEST}.jpg") == os.path.join(upload_dir, "ab", "cd", f"{DIGEST}.jpg")
+    assert storage.legacy_photo_path(f"{DIGEST}.jpg") == os.path.join(upload_dir, f"{DIGEST}.jpg")
+
+    # Names too short or not alphanumeric where they would be split stay flat
+    for name in ("abcd", "a.b-cdef.jpg", "../etc.jpg"):
+        assert storage.shard_parts(name) == []
+        assert storage.photo_path(name) == storage.legacy_photo_path(name)
+        assert storage.candidate_paths(name) == (storage.legacy_photo_path(name),)
+
+
+def test_photos_are_found_in_either_layout(upload_dir):
+    import storage
+    name = f"{DIGEST}.jpg"
+    assert storage.locate_photo(name) is None
+
+    flat = write(storage.legacy_photo_path(name))
+    assert storage.locate_photo(name) == flat
+
+    sharded = storage.place_photo(flat, name, link=True)
+    assert sharded == storage.photo_path(name)
+    assert os.path.exists(flat)
+    # The sharded copy wins once both exist
+    assert storage.locate_photo(name) == sharded
+
+    source = write(storage.temp_path(), b"other")
+    storage.place_photo(source, "1234abcdef.png")
+    assert not os.path.exists(source)
+    with open(storage.locate_photo("1234abcdef.png"), "rb") as f:
+        assert f.read() == b"other"
+
+
+def test_migration_moves_flat_photos_and_can_be_rerun(upload_dir):
+    import storage
+    from shard_uploads import shard_uploads
+    names = [f"{DIGEST}.jpg", "1234abcdef.png", "5678" + "f" * 60 + ".webp"]
+    for name in names:
+        write(storage.legacy_photo_path(name), name.encode())
+    write(storage.legacy_photo_path("abcd"))
+    # Already linked by an interrupted run
+    os.makedirs(os.path.dirname(storage.photo_path(names[0])))
+    os.link(storage.legacy_photo_path(names[0]), storage.photo_path(names[0]))
+
+    shard_uploads(batch_size=2, pause=0, grace=0)
+    layout = stored_files(upload_dir)
+
+    assert layout == sorted(
+        [os.path.join(name[:2], name[2:4], name) for name in names] + ["abcd"]
+    )
+    for name in names:
+        with open(storage.locate_photo(name), "rb") as f:
+            assert f.read() == name.encode()
+
+    shard_uploads(batch_size=2, pause=0, grace=0)
+    assert stored_files(upload_dir) == layout
+
+
+def test_dry_run_moves_nothing(upload_dir):
+    import storage
+    from shard_uploads import shard_uploads
+    flat = write(storage.legacy_photo_path(f"{DIGEST}.jpg"))
+    shard_uploads(dry_run=True)
+    assert os.listdir(upload_dir) == [os.path.basename(flat)]
@@ -0,0 +1,45 @@
+import os
+import random
+import pytest
+import requests
+
+from test_utils import create_test_post, delete_post, api_request, BASE_URL
+
+# Mark all tests in this file as API tests
+pytestmark = pytest.mark.api
+
+@pytest.fixture(scope="function")
+def unique_image(tmp_path):
+    """Create an image whose bytes no other test uploads."""
+    from PIL import Image
+
+    path = os.path.join(tmp_path, "unique.jpg")
+    color = tuple(random.randint(0, 255) for _ in range(3))
+    Image.new('RGB', (64, 64), color=color).save(path)
+    return path
+
+@pytest.mark.api
+def test_identical_uploads_share_one_photo(test_user, unique_image):
+    """Uploading the same bytes twice stores them once."""
+    first = create_test_post(test_user["token"], unique_image)
+    second = create_test_post(test_user["token"], unique_image)
+
+    first_photo = api_request(f"/posts/{first}/")["post"]["photo_uuid"]
+    second_photo = api_request(f"/posts/{second}/")["post"]["photo_uuid"]
+    assert first_photo == second_photo
+
+    delete_post(test_user["token"], first)
+    delete_post(test_user["token"], second)
+
+@pytest.mark.api
+def test_photo_removed_with_last_reference(test_user, unique_image):
+    """The stored photo survives until the last post using it is deleted."""
+    first = create_test_post(test_user["token"], unique_image)
+    second = create_test_post(test_user["token"], unique_image)
+    photo_url = f"{BASE_URL}/photos/{api_request(f'/posts/{first}/')['post']['photo_uuid']}"
+
+    delete_post(test_user["token"], first)
+    assert requests.get(photo_url).status_code == 200
+
+    delete_post(test_user["token"], second)
+    assert requests.get(photo_url).status_code == 404
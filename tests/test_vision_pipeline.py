@@ -0,0 +1,153 @@
+import base64
+
+import cv2
+import numpy as np
+import pytest
+
+import vision
+from composition import grid_shape, suggest_frames
+from inference_backends import input_buffer, preprocess
+from vision import LETTERBOX_COLOR, DecodedImage, letterbox, to_original
+
+# Mark all tests in this file as unit tests
+pytestmark = pytest.mark.unit
+
+
+def reference_letterbox(img, size):
+    """letterbox() as it was before it could draw into a reused buffer."""
+    height, width = img.shape[:2]
+    scale = min(size / height, size / width)
+    new_width, new_height = round(width * scale), round(height * scale)
+    if (new_width, new_height) != (width, height):
+        img = cv2.resize(img, (new_width, new_height), interpolation=cv2.INTER_LINEAR)
+    pad_x, pad_y = (size - new_width) // 2, (size - new_height) // 2
+    canvas = cv2.copyMakeBorder(img, pad_y, size - new_height - pad_y, pad_x, size - new_width - pad_x,
+                                cv2.BORDER_CONSTANT, value=LETTERBOX_COLOR)
+    return canvas, scale, (pad_x, pad_y)
+
+
+def reference_boxes(xyxy, img, scale, pad):
+    """The per-box loop to_original() replaced."""
+    scale_x, scale_y = img.scale
+    scale_x, scale_y = scale_x / scale, scale_y / scale
+    pad_x, pad_y = pad
+    boxes = []
+    for x1, y1, x2, y2 in xyxy.tolist():
+        x1 = min(max((x1 - pad_x) * scale_x, 0), img.width)
+        x2 = min(max((x2 - pad_x) * scale_x, 0), img.width)
+        y1 = min(max((y1 - pad_y) * scale_y, 0), img.height)
+        y2 = min(max((y2 - pad_y) * scale_y, 0), img.height)
+        boxes.append([int(x1), int(y1), int(x2), int(y2)])
+    return boxes
+
+
+def photo(width, height, seed=0):
+    return np.random.default_rng(seed).integers(0, 256, (height, width, 3), dtype=np.uint8)
+
+
+@pytest.mark.parametrize("width, height", [(640, 480), (480, 640), (1000, 333), (64, 64), (640, 640)])
+def test_letterbox_into_a_used_buffer_matches_copy_make_border(width, height):
+    img = photo(width, height)
+    out = np.full((320, 320, 3), 7, np.uint8)
+    canvas, scale, pad = letterbox(img, 320, out)
+    expected, expected_scale, expected_pad = reference_letterbox(img, 320)
+    assert canvas is out
+    assert (scale, pad) == (expected_scale, expected_pad)
+    np.testing.assert_array_equal(canvas, expected)
+
+
+@pytest.mark.parametrize("decoded, original", [((640, 480), (640, 480)), ((1008, 756), (4032, 3024)),
+                                               ((300, 800), (600, 1600))])
+def test_to_original_matches_the_per_box_loop(decoded, original):
+    rng = np.random.default_rng(sum(original))
+    img = DecodedImage(photo(*decoded), *original)
+    _, scale, pad = letterbox(img.pixels, 640)
+    # Including boxes that reach into the padding and past the edges
+    xy = rng.uniform(-40, 660, (200, 2))
+    xyxy = np.hstack([xy, xy + rng.uniform(0, 300, (200, 2))]).astype(np.float32)
+    assert to_original(xyxy, img, scale, pad).tolist() == reference_boxes(xyxy, img, scale, pad)
+
+
+class FakeModel:
+    names = {0: "person", 1: "dog"}
+
+    def __init__(self, results):
+        self.results = results
+        self.canvases = None
+
+    def predict(self, canvases, size):
+        self.canvases = [canvas.copy() for canvas in canvases]
+        return self.results
+
+
+def test_infer_batch_maps_every_image_back_to_its_original(monkeypatch):
+    imgs = [DecodedImage(photo(800, 600, 1), 3200, 2400), DecodedImage(photo(300, 500, 2), 300, 500)]
+    results = [
+        (np.array([[100, 150, 300, 400], [0, 80, 640, 560]], np.float32), np.array([0.9, 0.5], np.float32),
+         np.array([0, 1])),
+        (np.zeros((0, 4), np.float32), np.zeros(0, np.float32), np.zeros(0, int)),
+    ]
+    model = FakeModel(results)
+    monkeypatch.setattr(vision, "get_model", lambda: model)
+
+    detections = vision.infer_batch(imgs, 640)
+
+    _, scale, pad = reference_letterbox(imgs[0].pixels, 640)
+    assert detections[0] == [
+        {"box": box, "confidence": pytest.approx(confidence), "class": name}
+        for box, confidence, name in zip(reference_boxes(results[0][0], imgs[0], scale, pad), (0.9, 0.5),
+                                         ("person", "dog"))
+    ]
+    assert detections[1] == []
+    for canvas, img in zip(model.canvases, imgs):
+        np.testing.assert_array_equal(canvas, reference_letterbox(img.pixels, 640)[0])
+
+
+def test_preprocess_into_a_reused_buffer_matches_stacking():
+    buffer = input_buffer(None, 3, 32)
+    assert input_buffer(buffer, 2, 32) is buffer
+    assert input_buffer(buffer, len(buffer) + 1, 32) is not buffer
+    assert input_buffer(buffer, 2, 64) is not buffer
+
+    canvases = [photo(32, 32, seed) for seed in range(2)]
+    expected = np.ascontiguousarray(np.stack(canvases)[..., ::-1].transpose(0, 3, 1, 2), dtype=np.float32) / 255
+    buffer[:] = 9
+    batch = preprocess(canvases, buffer)
+    assert np.shares_memory(batch, buffer)
+    np.testing.assert_allclose(batch, expected)
+
+
+@pytest.mark.parametrize("mode", ["full", "preview", "binary", "boxes"])
+def test_responses_give_the_photo_and_boxed_image_sizes(mode, monkeypatch):
+    monkeypatch.setattr(vision, "DETECTION_PREVIEW_SIZE", 1280)
+    # A 4000x3000 photo decoded at a quarter of its size
+    img = DecodedImage(photo(1000, 750), 4000, 3000)
+    detections = [{"box": [400, 300, 2000, 1500], "confidence": 0.9, "class": "person"}]
+
+    response = vision.build_response(img, detections, mode)
+
+    assert response["image_size"] == {"width": 4000, "height": 3000}
+    if mode == "boxes":
+        assert "boxed_image_size" not in response
+        return
+    # The boxes are drawn on the decoded pixels, so that is the size of the boxed image
+    assert response["boxed_image_size"] == {"width": 1000, "height": 750}
+    jpeg = response["boxed_jpeg"] if mode == "binary" else base64.b64decode(response["boxed_image"])
+    assert cv2.imdecode(np.frombuffer(jpeg, np.uint8), cv2.IMREAD_COLOR).shape[:2] == (750, 1000)
+
+
+def test_preview_is_scaled_down_to_its_size_limit(monkeypatch):
+    monkeypatch.setattr(vision, "DETECTION_PREVIEW_SIZE", 400)
+    img = DecodedImage(photo(1000, 750), 4000, 3000)
+    response = vision.build_response(img, [], "preview")
+    assert response["boxed_image_size"] == {"width": 400, "height": 300}
+
+
+def test_post_mode_keeps_the_saliency_the_frames_were_scored_with():
+    img = DecodedImage(photo(1000, 750), 4000, 3000)
+    response = vision.build_response(img, [], vision.POST_MODE)
+    assert "boxed_image" not in response and "boxed_image_size" not in response
+    columns, rows = grid_shape(4000, 3000)
+    saliency = np.frombuffer(base64.b64decode(response["saliency"]), np.float32).reshape(rows, columns)
+    np.testing.assert_array_equal(saliency, vision.saliency(img))
+    assert response["suggested_frames"] == suggest_frames([], 4000, 3000, saliency=saliency)